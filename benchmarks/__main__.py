@@ -0,0 +1,59 @@
+import argparse
+import datetime
+import importlib
+import importlib.metadata
+import json
+import platform
+import sys
+
+SUITES = ('totp', 'storage', 'http')
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmarks', description="Runs benchmark suites and writes their results as JSON")
+    parser.add_argument('suites', nargs='*', metavar='suite', help=f"Suites to run among {', '.join(SUITES)} (all by default)")
+    parser.add_argument('--output', '-o', type=argparse.FileType('w', encoding='utf-8'), default='-', help="File to write the results to (standard output by default)")
+    parser.add_argument('--quick', default=False, action='store_true', help="Run smaller benchmarks, to check that they work")
+    args = parser.parse_args()
+    suites = args.suites or SUITES
+    for suite in suites:
+        if suite not in SUITES:
+            parser.error(f'unknown suite {suite!r}')
+
+    # Sizes are chosen for results to be comparable from a release to another
+    options = {
+        'totp': {'secrets': 10000, 'number': 10},
+        'storage': {'sizes': (1000, 10000, 100000), 'repeat': 3},
+        'http': {'size': 1000, 'requests': 5000},
+    }
+    if args.quick:
+        options = {
+            'totp': {'secrets': 100, 'number': 1},
+            'storage': {'sizes': (100,), 'repeat': 1},
+            'http': {'size': 100, 'requests': 50},
+        }
+
+    try:
+        version = importlib.metadata.version('requireris')
+    except importlib.metadata.PackageNotFoundError:
+        version = None
+    report = {
+        'requireris': version,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'options': {suite: options[suite] for suite in suites},
+        'results': {},
+    }
+    for suite in suites:
+        print(f'Running {suite} benchmarks...', file=sys.stderr)
+        module = importlib.import_module(f'.{suite}', __package__)
+        report['results'][suite] = module.run(**options[suite])
+
+    json.dump(report, args.output, indent=2)
+    args.output.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+import argparse
+import asyncio
+import http.client
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from requireris.database import Database
+from requireris.httpd.app import app
+from requireris.httpd.asgi import ASGIRequestHandler
+from requireris.httpd.server import PooledHTTPServer
+from requireris.utils import get_socket_url
+
+from .totp import make_secrets
+
+KEY = 'site-000000'
+
+
+class QuietRequestHandler(ASGIRequestHandler):
+    # Access logs written to a terminal would be measured instead of the server
+    def log_message(self, format, *args):
+        pass
+
+
+def make_database(path, size):
+    db = Database(path)
+    for index, secret in enumerate(make_secrets(size)):
+        db[f'site-{index:06d}'] = {'secret': secret, 'issuer': f'issuer-{index % 100}'}
+    return db
+
+
+def bench_app(requests):
+    "Calls the application directly, without any socket nor HTTP parsing"
+    scope = {
+        'type': 'http',
+        'method': 'GET',
+        'path': f'/keys/{KEY}',
+        'query_string': b'',
+        'headers': [(b'accept', b'application/json')],
+    }
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start' and message['status'] != 200:
+            raise RuntimeError(message['status'])
+
+    async def requests_loop():
+        for _ in range(requests):
+            # Scopes are updated by the routing, each request gets its own
+            await app(dict(scope), receive, send)
+
+    start = time.perf_counter()
+    asyncio.run(requests_loop())
+    return requests / (time.perf_counter() - start)
+
+
+def bench_handler(requests, clients, threads):
+    "Sends requests over persistent connections to a server running ASGIRequestHandler"
+    httpd = PooledHTTPServer(('127.0.0.1', 0), QuietRequestHandler, threads=threads)
+    httpd.app = app
+    app.url = get_socket_url(httpd.socket)
+    server = threading.Thread(target=httpd.serve_forever)
+    server.start()
+
+    def client(count):
+        connection = http.client.HTTPConnection(*httpd.server_address)
+        try:
+            for _ in range(count):
+                connection.request('GET', f'/keys/{KEY}', headers={'Accept': 'application/json'})
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    raise RuntimeError(response.status)
+        finally:
+            connection.close()
+
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(clients) as executor:
+            for future in [executor.submit(client, requests // clients) for _ in range(clients)]:
+                future.result()
+        return requests // clients * clients / (time.perf_counter() - start)
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        server.join()
+
+
+def run(size=1000, requests=5000, clients=(1, 8), threads=8):
+    "Returns the number of GET /keys/{key} requests handled per second by the application and by the HTTP server"
+    with tempfile.TemporaryDirectory() as directory:
+        app.db = make_database(Path(directory) / 'requireris.db', size)
+        app.closing.clear()
+        app.url = 'http://localhost'
+        results = {'app': {'requests_per_second': bench_app(requests)}}
+        for count in clients:
+            results[f'asgi_handler/{count}_clients'] = {
+                'requests_per_second': bench_handler(requests, count, threads),
+            }
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmarks.http')
+    parser.add_argument('--size', type=int, default=1000, help="Number of entries in the database")
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 8], help="Numbers of concurrent clients")
+    parser.add_argument('--threads', type=int, default=8, help="Number of server threads")
+    args = parser.parse_args()
+
+    for name, result in run(args.size, args.requests, args.clients, args.threads).items():
+        print(f'{name:<24} {result["requests_per_second"]:>10,.0f} requests/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import contextlib
+import io
+import tempfile
+import timeit
+from pathlib import Path
+
+from requireris.__main__ import list_keys
+from requireris.database import BACKENDS
+
+from .totp import make_secrets
+
+# Patterns listed against each store: a literal prefix answered from the
+# sorted keys, and a suffix needing a scan of all keys
+PATTERNS = {
+    'prefix': ['site-0001*'],
+    'suffix': ['*-42'],
+}
+
+
+def make_database(backend, path, size):
+    db = BACKENDS[backend](path)
+    db.load(missing_ok=True)
+    with db.batch():
+        for index, secret in enumerate(make_secrets(size)):
+            db[f'site-{index:06d}'] = {'secret': secret, 'issuer': f'issuer-{index % 100}'}
+        db.save()
+    if backend == 'journal':
+        # Stores are measured compacted, as after a long use
+        db.compact()
+    return db
+
+
+def best(function, repeat):
+    "Returns the shortest duration (in seconds) of function over repeat runs"
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def bench_store(backend, size, repeat):
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / 'requireris.db'
+        db = make_database(backend, path, size)
+
+        def load(lazy):
+            BACKENDS[backend](path).load(lazy=lazy)
+
+        def save():
+            db['site-000000'] = db['site-000000'] | {'comment': 'updated'}
+            db.save()
+
+        def compact():
+            db.compact()
+
+        results = {
+            'load_seconds': best(lambda: load(False), repeat),
+            'lazy_load_seconds': best(lambda: load(True), repeat),
+            'save_one_seconds': best(save, repeat),
+        }
+        if backend == 'journal':
+            results['compact_seconds'] = best(compact, repeat)
+
+        loaded = BACKENDS[backend](path)
+        loaded.load()
+        for name, patterns in PATTERNS.items():
+            with contextlib.redirect_stdout(io.StringIO()):
+                results[f'list_{name}_seconds'] = best(lambda: list_keys(loaded, patterns), repeat)
+        return results
+
+
+def run(sizes=(1000, 10000, 100000), backends=tuple(BACKENDS), repeat=5):
+    "Returns durations of loading, saving and listing stores of each backend and size"
+    return {
+        f'{backend}/{size}': bench_store(backend, size, repeat)
+        for backend in backends
+        for size in sizes
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmarks.storage')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--backends', choices=list(BACKENDS), nargs='+', default=list(BACKENDS))
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for name, results in run(args.sizes, args.backends, args.repeat).items():
+        print(name)
+        for measure, duration in results.items():
+            print(f'    {measure.removesuffix("_seconds"):<12} {duration * 1000:>10.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import argparse
+import base64
+import random
+import timeit
+
+from requireris.totp import ALGORITHMS, decode_secret, generate_hotp_many, generate_totp, generate_totp_many, get_time, make_generator
+
+
+def make_secrets(count, seed=0):
+    # Secrets are the same from a run to another, for results to be comparable
+    rand = random.Random(seed)
+    return [base64.b32encode(rand.randbytes(10)).decode() for _ in range(count)]
+
+
+def bench_loop(secrets, number):
+    return timeit.timeit(lambda: [generate_totp(secret) for secret in secrets], number=number)
+
+
+def bench_many(secrets, number):
+    return timeit.timeit(lambda: generate_totp_many(secrets), number=number)
+
+
+def bench_predecoded(secrets, number):
+    keys = [decode_secret(secret) for secret in secrets]
+    return timeit.timeit(lambda: generate_hotp_many(keys, get_time()), number=number)
+
+
+def bench_generator(algorithm, digits):
+    def bench(secrets, number):
+        generators = [make_generator(decode_secret(secret), algorithm, digits) for secret in secrets]
+        return timeit.timeit(lambda: [generate(get_time()) for generate in generators], number=number)
+    return bench
+
+
+def run(secrets=10000, number=10):
+    "Returns the number of codes generated per second by each way of generating them"
+    total = secrets * number
+    secrets = make_secrets(secrets)
+    results = {}
+    for name, bench in [
+        ('generate_totp loop', bench_loop),
+        ('generate_totp_many', bench_many),
+        ('generate_hotp_many', bench_predecoded),
+        *(
+            (f'{algorithm}/{digits} generator', bench_generator(algorithm, digits))
+            for algorithm in ALGORITHMS
+            for digits in (6, 8)
+        ),
+    ]:
+        results[name] = {'codes_per_second': total / bench(secrets, number)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmarks.totp')
+    parser.add_argument('--secrets', type=int, default=10000)
+    parser.add_argument('--number', type=int, default=10)
+    args = parser.parse_args()
+
+    for name, result in run(args.secrets, args.number).items():
+        print(f'{name:<22} {result["codes_per_second"]:>12,.0f} codes/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,43 +1,100 @@
 #!/usr/bin/env python3
 
 import argparse
-from fnmatch import fnmatch
-from logging import getLogger
+import math
+import os
+import time
+from logging import basicConfig, getLogger
 from os import getenv
 from pathlib import Path
-from sys import stderr
+from sys import stderr, stdout
 
-from .database import Database
-from .exceptions import WrongSecret
-from .totp import generate_totp
+from .database import BACKENDS, Database, detect_backend
+from .exceptions import WrongParameter, WrongPassphrase, WrongSecret
+from .patterns import compile_patterns
+from .totp import ALGORITHMS, get_time
 
 logger = getLogger(__name__)
 
 
-def list_keys(db, patterns=(), **kwargs):
+def list_keys(db, patterns=(), where=(), **kwargs):
     if not db:
         logger.warning('No available key')
         return
 
+    if where:
+        keys = db.find(dict(where))
+        if patterns:
+            keys = filter(compile_patterns(patterns).match, keys)
+    elif patterns:
+        keys = db.match(patterns)
+    else:
+        keys = db.keys()
     print('Available keys:')
-    for key in db.keys():
-        if not patterns or any(fnmatch(key, p) for p in patterns):
-            print('-', key)
+    for key in keys:
+        print('-', key)
+
 
+def get_secret(db, keys, watch=False, **kwargs):
+    if watch:
+        watch_codes(db, keys)
+        return
 
-def get_secret(db, keys, **kwargs):
     for key in keys:
         item = dict(db[key])
-        secret = item.pop('secret')
+        item.pop('secret', None)
+        code = db.get_code(key)
         print(f'{key}:')
-        print(f'    {generate_totp(secret)}')
+        print(f'    {code}')
         for name, value in item.items():
             print(f'    {name}: {value}')
 
 
+def watch_codes(db, keys):
+    "Prints codes of given keys each time they rotate, with a countdown when on a terminal"
+    redraw = stdout.isatty()
+    lines = []
+    try:
+        while True:
+            # The database is only parsed again when changed by another process
+            db.reload_if_changed()
+            now = time.time()
+            periods = [db.get_period(key) for key in keys]
+            if None in periods:
+                logger.error('Key %s has no rotating code', keys[periods.index(None)])
+                return
+            codes = db.get_codes(keys, now)
+            expirations = [(get_time(now, period) + 1) * period for period in periods]
+
+            if redraw:
+                if lines:
+                    stdout.write(f'\x1b[{len(lines)}F')
+                lines = [
+                    f'{key}: {code} ({math.ceil(expiration - now)}s)\x1b[K'
+                    for key, code, expiration in zip(keys, codes, expirations)
+                ]
+                print(*lines, sep='\n', flush=True)
+                # Wake up at each second for the countdown
+                delay = min(min(expirations), math.floor(now) + 1) - now
+            else:
+                new_lines = [f'{key}: {code}' for key, code in zip(keys, codes)]
+                if new_lines != lines:
+                    lines = new_lines
+                    print(*lines, sep='\n', flush=True)
+                delay = min(expirations) - now
+            time.sleep(max(delay, 0))
+    except KeyboardInterrupt:
+        pass
+
+
 def add_secret(db, key, secret, **kwargs):
     updated = key in db
-    db[key] = (kwargs.get('data') or {}) | {'secret': secret}
+    params = {
+        name: str(kwargs[name])
+        for name in ('type', 'algorithm', 'digits', 'period', 'counter')
+        if kwargs.get(name) is not None
+    }
+    db[key] = (kwargs.get('data') or {}) | params | {'secret': secret}
     if updated:
         logger.info('Key %s updated', key)
     else:
@@ -52,7 +109,83 @@ def remove_key(db, keys, **kwargs):
     db.save()
 
 
-def run_http_server(db, port, open=False, **kwargs):
+def verify_code(db, key, code, window=None, **kwargs):
+    if isinstance(db, Database) and db.get_period(key) is not None:
+        # Used TOTP steps are only remembered in memory, by the agent
+        logger.warning('No agent running, this code could be accepted again by another command')
+    if db.verify(key, code, window=window):
+        logger.info('Code is valid')
+    else:
+        logger.error('Code is not valid')
+        raise SystemExit(1)
+
+
+def import_keys(db, file, format=None, **kwargs):
+    from .bulk import guess_format, import_entries
+
+    format = format or guess_format(file.name)
+    imported, errors = import_entries(db, file, format)
+    for error in errors:
+        logger.warning('Line %d%s: %s', error.line, f' ({error.key})' if error.key else '', error.error)
+    logger.info('%d keys imported, %d errors', imported, len(errors))
+
+
+def export_keys(db, file, format=None, **kwargs):
+    from .bulk import export_entries, guess_format
+
+    format = format or guess_format(file.name)
+    file.writelines(export_entries(db, format))
+    file.flush()
+
+
+def encrypt_secrets(db, db_path, agent_socket=None, **kwargs):
+    from .agent import connect
+    from .crypto import SecretCipher
+
+    if db.cipher is not None:
+        logger.error('Database is already encrypted')
+        return
+    # A running agent keeps plain secrets in memory, and would write them back
+    agent = agent_socket and connect(agent_socket, db_path)
+    if agent is not None:
+        agent.close()
+        logger.error('An agent is running for this database, stop it before encrypting secrets')
+        return
+    passphrase = ask_passphrase()
+    if ask_passphrase('Confirm passphrase: ') != passphrase:
+        logger.error('Passphrases do not match')
+        return
+    db.cipher = SecretCipher.create(f'{db_path}.crypt', passphrase)
+    with db.batch():
+        for key, item in list(db.items()):
+            db[key] = item
+        db.save()
+    logger.info('%d secrets encrypted', len(db))
+
+
+def ask_passphrase(prompt='Passphrase: '):
+    passphrase = getenv('REQUIRERIS_PASSPHRASE')
+    if passphrase is None:
+        from getpass import getpass
+        passphrase = getpass(prompt, stream=stderr)
+    return passphrase
+
+
+def load_cipher(db, db_path):
+    "Sets the cipher of an encrypted database, its passphrase being only asked when a secret is needed"
+    # Key derivation parameters are stored next to the database file
+    path = Path(f'{db_path}.crypt')
+    if not path.exists():
+        return
+    try:
+        from .crypto import SecretCipher
+    except ImportError:
+        logger.error("Encryption not available, install requireris[crypto] dependencies to use it")
+        raise SystemExit(1)
+    db.cipher = SecretCipher(path, ask_passphrase)
+
+
+def run_http_server(db, port, open=False, save_delay=0, threads=0, workers=1, verify_window=1, **kwargs):
     def open_browser(httpd):
         import webbrowser
         webbrowser.open(httpd.url)
@@ -62,7 +195,47 @@ def run_http_server(db, port, open=False, **kwargs):
     except ImportError:
         logger.error("HTTP server not available, install requireris[http] dependencies to use it")
     else:
-        run_server(db, port, on_started=open_browser if open else None)
+        db.save_delay = save_delay
+        db.verify_window = verify_window
+        if db.cipher is not None:
+            # Derived once here, the key is then shared by all threads and workers
+            db.cipher.unlock()
+        try:
+            run_server(db, port, on_started=open_browser if open else None, threads=threads, workers=workers)
+        finally:
+            db.flush()
+
+
+def run_agent(db, agent_socket, **kwargs):
+    from .agent import AgentError, run_agent
+
+    if db.cipher is not None:
+        db.cipher.unlock()
+    try:
+        run_agent(db, agent_socket)
+    except AgentError as e:
+        logger.error(str(e))
+    finally:
+        db.flush()
+
+
+def default_agent_socket():
+    "Returns the path of the agent socket of the current user"
+    # Only POSIX platforms have user ids
+    name = f'requireris-{os.getuid()}.sock' if hasattr(os, 'getuid') else 'requireris.sock'
+    return Path(getenv('XDG_RUNTIME_DIR') or '/tmp') / name
+
+
+def env_flag(name):
+    "Returns whether an env variable is set to 1, true, yes or on"
+    return getenv(name, '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def field_condition(arg):
+    name, sep, value = arg.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError(f"{arg!r} is not of the form FIELD=VALUE")
+    return name, value
 
 
 class DataDictAction(argparse.Action):
@@ -76,7 +249,7 @@ class DataDictAction(argparse.Action):
 
 def _get_parser():
     parser = argparse.ArgumentParser(prog='requireris')
-    parser.set_defaults(func=list_keys, patterns=[])
+    parser.set_defaults(func=list_keys, patterns=[], where=[])
 
     parser.add_argument(
         '--db-path',
@@ -98,52 +271,129 @@ def _get_parser():
         default=getenv('REQUIRERIS_DB_FILE', 'requireris.db'),
         help="Name of current database file",
     )
+    parser.add_argument(
+        '--fsync',
+        default=env_flag('REQUIRERIS_DB_FSYNC'),
+        action=argparse.BooleanOptionalAction,
+        help="Sync database writes to disk before considering them done",
+    )
+    parser.add_argument(
+        '--db-backend',
+        choices=list(BACKENDS),
+        default=getenv('REQUIRERIS_DB_BACKEND'),
+        help="Storage of current database: full rewrite of the file on each change (ini), append-only journal of changes (journal) or SQLite file (sqlite), detected from the file by default",
+    )
+    parser.add_argument(
+        '--agent-socket',
+        type=Path,
+        default=getenv('REQUIRERIS_AGENT_SOCKET') or default_agent_socket(),
+        help="Unix socket of the agent (defaulting to REQUIRERIS_AGENT_SOCKET env variable)",
+    )
+    parser.add_argument(
+        '--agent',
+        default=True,
+        action=argparse.BooleanOptionalAction,
+        help="Send list, get and append commands to the agent when it is running",
+    )
 
     subparsers = parser.add_subparsers(required=False)
 
     list_parser = subparsers.add_parser('list', help="List all keys or all keys that match given patterns")
     list_parser.add_argument('patterns', nargs='*')
+    list_parser.add_argument('--where', action='append', type=field_condition, default=[], metavar='FIELD=VALUE', help="Only list keys having this field value, can be repeated (secret and counter cannot be searched)")
 
     get_parser = subparsers.add_parser('get', help="Get all secrets for given keys")
     get_parser.set_defaults(func=get_secret)
     get_parser.add_argument('keys', nargs='+')
+    get_parser.add_argument('--watch', '-w', default=False, action='store_true', help="Keep printing new codes of given TOTP keys as they rotate")
 
     append_parser = subparsers.add_parser('append', aliases=['add'], help="Append or update secret for given key")
     append_parser.set_defaults(func=add_secret)
     append_parser.add_argument('key')
     append_parser.add_argument('secret')
     append_parser.add_argument('--data', nargs='*', action=DataDictAction)
+    append_parser.add_argument('--type', choices=['totp', 'hotp'], help="Time-based or counter-based codes (defaulting to totp)")
+    append_parser.add_argument('--algorithm', choices=list(ALGORITHMS), help="HMAC algorithm (defaulting to sha1)")
+    append_parser.add_argument('--digits', type=int, help="Number of digits of codes (defaulting to 6)")
+    append_parser.add_argument('--period', type=int, help="Validity period of codes in seconds (defaulting to 30)")
+    append_parser.add_argument('--counter', type=int, help="Initial counter of HOTP codes (defaulting to 0)")
 
     delete_parser = subparsers.add_parser('delete', aliases=['del'], help="Delete all secrets for given keys")
     delete_parser.set_defaults(func=remove_key)
     delete_parser.add_argument('keys', nargs='+')
 
+    verify_parser = subparsers.add_parser('verify', help="Check a code of given key, each code being accepted only once")
+    verify_parser.set_defaults(func=verify_code)
+    verify_parser.add_argument('key')
+    verify_parser.add_argument('code')
+    verify_parser.add_argument('--window', type=int, help="Number of steps around the current one (or after the counter of HOTP keys) whose codes are accepted (defaulting to 1)")
+
+    import_parser = subparsers.add_parser('import', help="Import keys from a file of JSON lines, CSV rows or otpauth:// URIs")
+    import_parser.set_defaults(func=import_keys)
+    import_parser.add_argument('file', type=argparse.FileType('r', encoding='utf-8'), help="File to import ('-' for standard input)")
+    import_parser.add_argument('--format', choices=['jsonl', 'csv', 'otpauth'], help="Format of the file (guessed from its extension by default)")
+
+    export_parser = subparsers.add_parser('export', help="Export all keys to a file of JSON lines, CSV rows or otpauth:// URIs")
+    export_parser.set_defaults(func=export_keys)
+    export_parser.add_argument('file', nargs='?', type=argparse.FileType('w', encoding='utf-8'), default='-', help="File to export to (standard output by default)")
+    export_parser.add_argument('--format', choices=['jsonl', 'csv', 'otpauth'], help="Format of the file (guessed from its extension by default)")
+
+    encrypt_parser = subparsers.add_parser('encrypt', help="Encrypt all secrets of the database with a passphrase (read from REQUIRERIS_PASSPHRASE env variable or prompted)")
+    encrypt_parser.set_defaults(func=encrypt_secrets)
+
+    agent_parser = subparsers.add_parser('agent', help="Run an agent keeping the database in memory to answer other commands instantly")
+    agent_parser.set_defaults(func=run_agent)
+
     http_parser = subparsers.add_parser('http', aliases=['server'], help="Run an HTTP server")
     http_parser.set_defaults(func=run_http_server)
     http_parser.add_argument('--port', nargs='?', type=int, default=8080)
     http_parser.add_argument('--open', default=False, action=argparse.BooleanOptionalAction, help="Open website in browser")
+    http_parser.add_argument('--threads', type=int, default=8, help="Number of worker threads handling requests concurrently (0 to handle them one at a time)")
+    http_parser.add_argument('--workers', type=int, default=1, help="Number of processes handling requests, each one with its own threads")
+    http_parser.add_argument('--verify-window', type=int, default=1, help="Number of steps around the current one (or after the counter of HOTP keys) whose codes are accepted when verifying")
+    http_parser.add_argument('--save-delay', type=float, default=0, help="Coalesce all changes made within this delay (in seconds) into a single write")
 
 
     return parser
 
 
-parser = _get_parser()
+def __getattr__(name):
+    "Builds the module-level parser only when it is accessed, to keep the CLI startup fast"
+    if name == 'parser':
+        return _get_parser()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Commands answered by the agent when running
+AGENT_COMMANDS = (list_keys, get_secret, add_secret, verify_code)
 
 
 def main():
+    basicConfig(level='INFO', format='[%(levelname)s] %(message)s')
     try:
-        args = parser.parse_args()
+        args = _get_parser().parse_args()
         if args.db_path is None:
             args.db_path = args.db_dir / args.db_file
 
-        db = Database(args.db_path)
-        db.load(missing_ok=True)
+        db = None
+        if args.agent and args.func in AGENT_COMMANDS and not vars(args).get('watch') and args.agent_socket.exists():
+            from .agent import connect
+            db = connect(args.agent_socket, args.db_path)
+        if db is None:
+            db = BACKENDS[args.db_backend or detect_backend(args.db_path)](args.db_path)
+            db.fsync = args.fsync
+            load_cipher(db, args.db_path)
+            db.load(missing_ok=True, lazy=True)
 
         args.func(db, **vars(args))
     except KeyError as e:
         logger.error(f"Key {e} was not found in database")
+    except WrongPassphrase:
+        logger.error("Given passphrase is not valid for this database")
     except WrongSecret:
         logger.error("Given secret is not well-formated")
+    except WrongParameter:
+        logger.error("Given type, algorithm, digits, period or counter is not supported")
     except Exception as e:
         logger.error(f"A fatal error occured, please check your database's file: {type(e).__name__}: {e}")
 
@@ -0,0 +1,208 @@
+import json
+import os
+import signal
+import socket
+import socketserver
+import threading
+from logging import getLogger
+
+from .exceptions import MissingSecret, WrongParameter, WrongSecret
+
+logger = getLogger(__name__)
+
+# Exceptions transmitted from the agent to its clients
+ERRORS = {
+    'KeyError': KeyError,
+    'MissingSecret': MissingSecret,
+    'WrongSecret': WrongSecret,
+    'WrongParameter': WrongParameter,
+}
+
+
+class AgentError(Exception):
+    pass
+
+
+class AgentRequestHandler(socketserver.StreamRequestHandler):
+    "Answers requests sent as JSON lines, one response line per request"
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.answer(json.loads(line))
+            except ValueError:
+                response = {'error': 'BadRequest'}
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+
+
+class AgentServer(socketserver.ThreadingUnixStreamServer):
+    "Keeps a database loaded in memory and serves its entries over a Unix socket"
+
+    daemon_threads = True
+
+    def __init__(self, path, db):
+        self.db = db
+        self.db_path = os.path.abspath(db.path)
+        self._lock = threading.Lock()
+        _remove_stale_socket(path)
+        # Only the owner can talk to the agent
+        umask = os.umask(0o177)
+        try:
+            super().__init__(os.fspath(path), AgentRequestHandler)
+        finally:
+            os.umask(umask)
+
+    def answer(self, request):
+        with self._lock:
+            # Entries are only read again when changed by another process
+            self.db.reload_if_changed()
+            try:
+                return self._answer(request)
+            except (KeyError, MissingSecret, WrongSecret, WrongParameter) as e:
+                return {'error': type(e).__name__, 'key': e.args[0] if e.args else None}
+
+    def _answer(self, request):
+        match request:
+            case {'op': 'open', 'db': path}:
+                if os.path.abspath(path) != self.db_path:
+                    return {'error': 'WrongDatabase'}
+                return {}
+            case {'op': 'list'}:
+                return {'keys': list(self.db.keys())}
+            case {'op': 'find', 'fields': fields}:
+                return {'keys': self.db.find(fields)}
+            case {'op': 'match', 'patterns': patterns}:
+                return {'keys': list(self.db.match(patterns))}
+            case {'op': 'get', 'key': key, **options}:
+                item = dict(self.db[key])
+                del item['secret']
+                if options.get('code'):
+                    return {'item': item, 'code': self.db.get_code(key)}
+                return {'item': item}
+            case {'op': 'verify', 'key': key, 'code': code, **options}:
+                return {'valid': self.db.verify(key, code, window=options.get('window'))}
+            case {'op': 'add', 'key': key, 'item': item}:
+                updated = key in self.db
+                self.db[key] = item
+                self.db.save()
+                return {'updated': updated}
+        return {'error': 'BadRequest'}
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except FileNotFoundError:
+            pass
+
+
+def _remove_stale_socket(path):
+    with socket.socket(socket.AF_UNIX) as sock:
+        try:
+            sock.connect(os.fspath(path))
+        except FileNotFoundError:
+            return
+        except ConnectionRefusedError:
+            # Left by an agent that did not exit properly
+            os.unlink(path)
+            return
+    raise AgentError(f"An agent is already listening on {path}")
+
+
+def run_agent(db, path):
+    server = AgentServer(path, db)
+    logger.info('Agent listening on %s', path)
+    # Stopping the agent like ssh-agent also removes its socket
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info('Shutting down...')
+    finally:
+        server.server_close()
+
+
+class AgentClient:
+    """
+    Database-like proxy to the entries of an agent
+
+    Secrets never leave the agent, entries are returned without them.
+    """
+
+    def __init__(self, sock):
+        self._socket = sock
+        self._file = sock.makefile('rb')
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+    def _request(self, **request):
+        self._socket.sendall(json.dumps(request).encode() + b'\n')
+        line = self._file.readline()
+        if not line:
+            raise AgentError("Agent closed the connection")
+        response = json.loads(line)
+        if 'error' in response:
+            error = ERRORS.get(response['error'], AgentError)
+            raise error(response.get('key', response['error']))
+        return response
+
+    def keys(self):
+        return self._request(op='list')['keys']
+
+    def find(self, fields):
+        return self._request(op='find', fields=fields)['keys']
+
+    def match(self, patterns):
+        return self._request(op='match', patterns=patterns)['keys']
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __getitem__(self, key):
+        return self._request(op='get', key=key)['item']
+
+    def __setitem__(self, key, item):
+        self._request(op='add', key=key, item=item)
+
+    def get_code(self, key):
+        return self._request(op='get', key=key, code=True)['code']
+
+    def verify(self, key, code, window=None):
+        return self._request(op='verify', key=key, code=code, window=window)['valid']
+
+    def save(self):
+        "Entries are saved by the agent as soon as they are set"
+
+
+def connect(path, db_path):
+    "Returns a client of the agent listening on path for the given database, None if there is none"
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if hasattr(os, 'getuid') and stat.st_uid != os.getuid():
+        logger.warning('Ignoring agent socket %s owned by another user', path)
+        return None
+
+    sock = socket.socket(socket.AF_UNIX)
+    try:
+        sock.connect(os.fspath(path))
+    except OSError:
+        sock.close()
+        return None
+
+    client = AgentClient(sock)
+    try:
+        client._request(op='open', db=os.path.abspath(db_path))
+    except AgentError:
+        client.close()
+        return None
+    return client
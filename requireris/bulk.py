@@ -0,0 +1,151 @@
+import csv
+import io
+import json
+from collections import namedtuple
+from urllib.parse import parse_qsl, quote, unquote, urlencode, urlsplit
+
+from .exceptions import MissingSecret, WrongParameter, WrongSecret
+
+RowError = namedtuple('RowError', ['line', 'key', 'error'])
+
+
+def parse_jsonl(lines):
+    "Parses entries from JSON objects (with a key field), one per line"
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+            if not isinstance(data, dict):
+                raise ValueError("Row is not an object")
+            item = {str(name): str(value) for name, value in data.items()}
+            key = item.pop('key')
+        except KeyError:
+            yield number, None, ValueError("Missing key")
+        except ValueError as e:
+            yield number, None, e
+        else:
+            yield number, key, item
+
+
+def parse_csv(lines):
+    "Parses entries from CSV rows, with a header line naming the fields (including key)"
+    reader = csv.DictReader(lines)
+    for row in reader:
+        item = {name: value for name, value in row.items() if name and value}
+        key = item.pop('key', None)
+        if key is None:
+            yield reader.line_num, None, ValueError("Missing key")
+        else:
+            yield reader.line_num, key, item
+
+
+def parse_otpauth(lines):
+    "Parses entries from otpauth:// URIs, one per line, using their label as key"
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        url = urlsplit(line)
+        key = unquote(url.path.lstrip('/'))
+        if url.scheme != 'otpauth' or not key:
+            yield number, None, ValueError("Not an otpauth:// URI")
+            continue
+        item = {'type': url.netloc.lower(), **dict(parse_qsl(url.query))}
+        if 'algorithm' in item:
+            item['algorithm'] = item['algorithm'].lower()
+        if item['type'] == 'totp':
+            del item['type']
+        yield number, key, item
+
+
+def format_jsonl(items):
+    for key, item in items:
+        yield json.dumps({'key': key, **item}) + '\n'
+
+
+def format_csv(items):
+    items = list(items)
+    fields = {'key': None, 'secret': None}
+    for _, item in items:
+        fields.update(dict.fromkeys(item))
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, list(fields))
+    writer.writeheader()
+    for key, item in items:
+        writer.writerow({'key': key, **item})
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def format_otpauth(items):
+    for key, item in items:
+        params = dict(item)
+        kind = params.pop('type', 'totp')
+        if 'algorithm' in params:
+            params['algorithm'] = params['algorithm'].upper()
+        yield f'otpauth://{kind}/{quote(key)}?{urlencode(params, quote_via=quote)}\n'
+
+
+FORMATS = {
+    'jsonl': (parse_jsonl, format_jsonl, 'application/x-ndjson'),
+    'csv': (parse_csv, format_csv, 'text/csv'),
+    'otpauth': (parse_otpauth, format_otpauth, 'text/plain'),
+}
+
+
+def guess_format(filename, default='jsonl'):
+    if filename.endswith('.csv'):
+        return 'csv'
+    if filename.endswith(('.txt', '.uri', '.uris')):
+        return 'otpauth'
+    return default
+
+
+def import_entries(db, lines, format='jsonl'):
+    """
+    Inserts all valid entries read from lines in the database, with a single save
+
+    Returns the number of imported entries and the errors of other rows.
+    """
+    parse, _, _ = FORMATS[format]
+    return insert_entries(db, parse(lines))
+
+
+def insert_entries(db, rows):
+    """
+    Inserts all valid entries of (number, key, item) rows in the database, with a single save
+
+    Items may be exceptions, reported as errors of their row.
+    Returns the number of inserted entries and the errors of other rows.
+    """
+    imported = 0
+    errors = []
+
+    with db.batch():
+        for number, key, item in rows:
+            if isinstance(item, Exception):
+                errors.append(RowError(number, key, str(item)))
+                continue
+            try:
+                db[key] = item
+            except MissingSecret:
+                errors.append(RowError(number, key, "Missing secret"))
+            except WrongSecret:
+                errors.append(RowError(number, key, "Secret is not well-formated"))
+            except WrongParameter:
+                errors.append(RowError(number, key, "Type, algorithm, digits, period or counter is not supported"))
+            else:
+                imported += 1
+        if imported:
+            db.save()
+
+    return imported, errors
+
+
+def export_entries(db, format='jsonl'):
+    "Iterates over the lines of all database entries in the given format"
+    _, format_items, _ = FORMATS[format]
+    return format_items(db.decrypted_items())
@@ -0,0 +1,98 @@
+import base64
+import hashlib
+import json
+import secrets
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from .exceptions import WrongPassphrase
+from .utils import atomic_write
+
+# Prefix of encrypted secrets, followed by the base64 of nonce and ciphertext
+SEALED_PREFIX = 'enc1:'
+NONCE_SIZE = 12
+# Default scrypt cost, taking a few hundred milliseconds
+SCRYPT_N = 2 ** 15
+SCRYPT_R = 8
+SCRYPT_P = 1
+# Plaintext encrypted in the parameters file, to check the passphrase when deriving the key
+_CHECK_LABEL = '\0requireris'
+
+
+class SecretCipher:
+    """
+    Encrypts secrets of entries with AES-GCM, bound to their key
+
+    The encryption key is derived from a passphrase with scrypt on first
+    use only, then kept in memory for the lifetime of the cipher.
+    """
+
+    def __init__(self, path, get_passphrase):
+        self.path = path
+        self._get_passphrase = get_passphrase
+        self._aead = None
+
+    @classmethod
+    def create(cls, path, passphrase, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+        "Writes the parameters file of a new encrypted database, returns its unlocked cipher"
+        params = {'kdf': 'scrypt', 'salt': _encode(secrets.token_bytes(16)), 'n': n, 'r': r, 'p': p}
+        cipher = cls(path, lambda: passphrase)
+        cipher._aead = AESGCM(_derive(passphrase, params))
+        params['check'] = cipher.seal(_CHECK_LABEL, _CHECK_LABEL)
+        with atomic_write(path) as file:
+            json.dump(params, file)
+        return cipher
+
+    def unlock(self):
+        if self._aead is not None:
+            return
+        with open(self.path) as file:
+            params = json.load(file)
+        aead = AESGCM(_derive(self._get_passphrase(), params))
+        try:
+            _open(aead, _CHECK_LABEL, params['check'])
+        except InvalidTag:
+            raise WrongPassphrase(self.path)
+        self._aead = aead
+
+    @staticmethod
+    def is_sealed(value):
+        return value.startswith(SEALED_PREFIX)
+
+    def seal(self, key, secret):
+        self.unlock()
+        nonce = secrets.token_bytes(NONCE_SIZE)
+        return SEALED_PREFIX + _encode(nonce + self._aead.encrypt(nonce, secret.encode(), key.encode()))
+
+    def open(self, key, value):
+        "Decrypts a sealed secret of the entry key, raises ValueError if it was not sealed for it"
+        self.unlock()
+        try:
+            return _open(self._aead, key, value)
+        except InvalidTag:
+            raise ValueError(key)
+
+
+def _derive(passphrase, params):
+    if params['kdf'] != 'scrypt':
+        raise ValueError(params['kdf'])
+    n, r, p = params['n'], params['r'], params['p']
+    return hashlib.scrypt(
+        passphrase.encode(),
+        salt=base64.b64decode(params['salt']),
+        n=n,
+        r=r,
+        p=p,
+        maxmem=256 * n * r * p,
+        dklen=32,
+    )
+
+
+def _open(aead, key, value):
+    data = base64.b64decode(value.removeprefix(SEALED_PREFIX))
+    return aead.decrypt(data[:NONCE_SIZE], data[NONCE_SIZE:], key.encode()).decode()
+
+
+def _encode(data):
+    return base64.b64encode(data).decode()
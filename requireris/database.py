@@ -1,34 +1,186 @@
+import heapq
+import hmac
+import json
+import mmap
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import namedtuple
+from contextlib import contextmanager, nullcontext
 from configparser import ConfigParser, UNNAMED_SECTION
-from base64 import b32decode
 from logging import getLogger
 
-from .exceptions import MissingSecret, WrongSecret
+from .exceptions import MissingSecret, WrongParameter, WrongSecret
+from .journal import Journal
+from .patterns import compile_patterns, literal_prefixes, prefix_end
+from .section_index import load_index
+from .utils import atomic_write, lock_file
+from .totp import DEFAULT_ALGORITHM, DEFAULT_DIGITS, DEFAULT_PERIOD, decode_secret, get_time, make_generator
 
 logger = getLogger(__name__)
 
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'currsize'])
+WriteInfo = namedtuple('WriteInfo', ['count', 'seconds'])
+Generator = namedtuple('Generator', ['period', 'generate'])
+# Placeholder for a section of the database file that is not parsed yet
+_Unparsed = namedtuple('_Unparsed', ['start', 'end'])
+# Fields that cannot be searched: secrets, and counters changing on each code
+UNINDEXED_FIELDS = ('secret', 'counter')
+
 
 class Database:
+    # Number of journal records after which the journal is compacted into the database file
+    journal_threshold = 1000
+    # Whether written files are synced to disk before replacing the database file
+    fsync = False
+    # Delay (in seconds) during which successive saves are coalesced into a single write
+    save_delay = 0
+    # Number of steps around the current one (or after the counter for HOTP) whose codes are accepted by verify()
+    verify_window = 1
+    # Maximum number of used TOTP steps remembered to reject replayed codes
+    replay_cache_size = 100000
+    # Cipher encrypting secrets of entries when stored, None to store them in plain text
+    cipher = None
+
     def __init__(self, path=None, **kwargs):
         self.path = path
+        self._journal = None if path is None else Journal(f'{os.fspath(path)}.journal')
 
         missing_secrets = [k for k, item in kwargs.items() if 'secret' not in item]
         if missing_secrets:
             raise MissingSecret(missing_secrets)
 
         self._data = kwargs
+        self._dirty = {}
+        self._generators = {}
+        self._codes = {}
+        # Codes of the steps (or counters) around the current one, used to verify codes
+        self._window_codes = {}
+        # Maps (key, step) of accepted TOTP codes to the time they leave the
+        # window, with a heap of these times to forget them
+        self._used_steps = {}
+        self._used_expiries = []
+        self._code_hits = self._code_misses = 0
+        self._write_count = 0
+        self._write_seconds = 0.0
+        self._mmap = None
+        self._default_section = ''
+        self._lock = threading.RLock()
+        self._batch_depth = 0
+        self._file_lock_depth = 0
+        self._save_pending = False
+        self._save_timer = None
+        self._load_options = None
+        self._signature = None
+        # Maps each (name, value) field to the keys of entries having it,
+        # built on first search
+        self._field_index = None
+        self._indexed_fields = {}
+        # All keys in order, built on first pattern matching
+        self._sorted_keys = None
+
+    def load(self, missing_ok=False, lazy=False):
+        with self._lock:
+            self._data.clear()
+            self._dirty.clear()
+            self._generators.clear()
+            self._codes.clear()
+            self._window_codes.clear()
+            self._field_index = None
+            self._indexed_fields.clear()
+            self._sorted_keys = None
+            self._close_mmap()
+            self._load_options = (missing_ok, lazy)
+            self._signature = self._stat_signature()
+
+            if lazy:
+                self._load_index(missing_ok)
+            else:
+                self._load_config(missing_ok)
+
+            for record in self._journal.replay():
+                self._apply(record)
+
+    def _stat_signature(self):
+        # Identifies the current state of the database files, to notice
+        # changes made by other processes
+        signature = []
+        for path in self._files():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                signature.append(None)
+            else:
+                signature.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def _files(self):
+        return (self.path, self._journal.path)
 
-    def load(self, missing_ok=False):
-        self._data.clear()
+    def files_size(self):
+        "Returns the size in bytes of the existing files of the database"
+        size = 0
+        for path in self._files():
+            try:
+                size += os.stat(path).st_size
+            except FileNotFoundError:
+                pass
+        return size
 
+    def changed(self):
+        "Returns whether the database files were changed by another process since loaded"
+        return self._load_options is not None and self._stat_signature() != self._signature
+
+    def reopen(self):
+        "Returns a new instance of the database with the same options and used codes, loaded from its current files"
+        db = type(self)(self.path)
+        for option in ('fsync', 'save_delay', 'journal_threshold', 'verify_window', 'replay_cache_size', 'cipher'):
+            setattr(db, option, getattr(self, option))
+        db._used_steps = self._used_steps
+        db._used_expiries = self._used_expiries
+        missing_ok, lazy = self._load_options or (False, False)
+        db.load(missing_ok=missing_ok, lazy=lazy)
+        return db
+
+    def reload_if_changed(self):
+        """
+        Reloads the database if its files were changed by another process since loaded
+
+        Unsaved changes are lost on reload. Returns whether the database was reloaded.
+        """
+        if self._load_options is None:
+            return False
+        with self._lock:
+            signature = self._stat_signature()
+            if signature == self._signature:
+                return False
+            if self._journal_appended(self._signature, signature):
+                # Only records appended to the journal since are applied
+                self._signature = signature
+                for record in self._journal.replay(self._journal.offset):
+                    self._apply_appended(record)
+                return True
+            missing_ok, lazy = self._load_options
+            self.load(missing_ok=missing_ok, lazy=lazy)
+            return True
+
+    @staticmethod
+    def _journal_appended(old, new):
+        (old_file, old_journal), (new_file, new_journal) = old, new
+        if old_file != new_file or new_journal is None:
+            return False
+        # Same journal file (inode) grown, or a journal created since
+        return old_journal is None or (old_journal[0] == new_journal[0] and old_journal[2] < new_journal[2])
+
+    def _load_config(self, missing_ok):
         config = ConfigParser()
 
         try:
             with self.path.open() as file:
                 config.read_file(file)
         except FileNotFoundError:
-            if missing_ok:
-                return
-            else:
+            if not missing_ok:
                 raise
 
         for key, section in config.items():
@@ -37,40 +189,730 @@ class Database:
             elif key != 'DEFAULT':
                 logger.warning("No secret in section %s, skipping", key)
 
+    def _load_index(self, missing_ok):
+        # Sections are only indexed from a memory map of the file, and parsed
+        # when accessed
+        try:
+            file = open(self.path, 'rb')
+        except FileNotFoundError:
+            if not missing_ok:
+                raise
+            return
+
+        with file:
+            stat = os.fstat(file.fileno())
+            if not stat.st_size:
+                return
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        index, secretless = load_index(f'{os.fspath(self.path)}.index', stat, self._mmap)
+        if 'DEFAULT' in index:
+            start, end = index.pop('DEFAULT')
+            self._default_section = self._mmap[start:end].decode()
+        # Sections are listed the same as when loaded eagerly
+        for key in secretless:
+            logger.warning("No secret in section %s, skipping", key)
+            index.pop(key, None)
+        for key, (start, end) in index.items():
+            self._data[key] = _Unparsed(start, end)
+
+    def _parse(self, key, unparsed):
+        config = ConfigParser()
+        config.read_string(self._default_section + self._mmap[unparsed.start:unparsed.end].decode())
+        section = config[key]
+        if 'secret' not in section:
+            logger.warning("No secret in section %s, skipping", key)
+            del self._data[key]
+            self._update_indexes(key)
+            raise KeyError(key)
+        item = self._data[key] = dict(section)
+        return item
+
+    def _parse_all(self):
+        for key, item in list(self._data.items()):
+            if type(item) is _Unparsed:
+                try:
+                    self._parse(key, item)
+                except KeyError:
+                    pass
+        self._close_mmap()
+
+    def _close_mmap(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+            self._default_section = ''
+
+    def _apply_appended(self, record):
+        self._apply(record)
+        self._generators.pop(record['key'], None)
+        self._codes.pop(record['key'], None)
+        self._window_codes.pop(record['key'], None)
+
+    def _append_journal(self, *records):
+        "Appends records to the journal, applying first the ones appended by other processes"
+        keys = {record['key'] for record in records}
+        with self._file_lock():
+            for record in self._journal.append(*records, fsync=self.fsync):
+                # Changes made here are more recent
+                if record['key'] not in keys:
+                    self._apply_appended(record)
+            # Records appended by other processes after these ones are noticed on reload
+            file, journal = self._stat_signature()
+        self._signature = (file, journal and (*journal[:2], self._journal.offset))
+
+    def _apply(self, record):
+        match record:
+            case {'op': 'set', 'key': key, 'item': item}:
+                self._data[key] = item
+                self._update_indexes(key)
+            case {'op': 'del', 'key': key}:
+                self._data.pop(key, None)
+                self._update_indexes(key)
+            case {'op': 'counter', 'key': key, 'value': value} if key in self._data:
+                try:
+                    item = self[key]
+                except KeyError:
+                    pass
+                else:
+                    # Counters only move forward, whatever the order of their records
+                    item['counter'] = str(max(value, int(item.get('counter', 0))))
+
     def save(self):
-        config = ConfigParser(allow_unnamed_section=True)
+        with self._lock:
+            if self._batch_depth or self._save_timer is not None:
+                self._save_pending = True
+            elif self.save_delay:
+                self._save_pending = True
+                self._save_timer = threading.Timer(self.save_delay, self.flush)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+            else:
+                self._timed_write()
 
-        for key, item in self.items():
-            config.add_section(key)
-            for name, value in item.items():
-                config.set(key, name, value)
+    def flush(self):
+        "Writes pending saves right away, unless a batch is running"
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if self._save_pending and not self._batch_depth:
+                self._save_pending = False
+                self._timed_write()
+
+    def _timed_write(self):
+        start = time.perf_counter()
+        self._write()
+        self._write_count += 1
+        self._write_seconds += time.perf_counter() - start
 
-        with self.path.open('w') as file:
-            config.write(file)
+    def write_info(self):
+        "Returns the number of writes of the database files and their total duration (in seconds)"
+        return WriteInfo(self._write_count, self._write_seconds)
+
+    @contextmanager
+    def batch(self):
+        "Coalesces all saves made in the block into a single write at its end"
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                self.flush()
+
+    @contextmanager
+    def _file_lock(self):
+        "Locks the database files against writes of other processes"
+        with self._lock:
+            if self._file_lock_depth:
+                # Already held by this instance, flock() would wait for itself
+                self._file_lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._file_lock_depth -= 1
+                return
+            with open(f'{os.fspath(self.path)}.lock', 'w') as file:
+                lock_file(file)
+                self._file_lock_depth = 1
+                try:
+                    yield
+                finally:
+                    self._file_lock_depth = 0
+
+    @contextmanager
+    def _counter_lock(self, key):
+        "Locks the counter of an entry against other processes, after reading its latest value"
+        if self._journal is None:
+            with self._lock:
+                yield
+            return
+        with self._file_lock():
+            for record in self._journal.replay(self._journal.offset):
+                self._apply_appended(record)
+            yield
+
+    def _merge_changes(self):
+        "Reloads the database files changed by another process, keeping the entries changed here"
+        changes = {key: self._data.get(key) for key in self._dirty}
+        missing_ok, lazy = self._load_options
+        self.load(missing_ok=missing_ok, lazy=lazy)
+        for key, item in changes.items():
+            if item is None:
+                self._data.pop(key, None)
+            else:
+                self._data[key] = item
+            self._dirty[key] = None
+            self._update_indexes(key)
+
+    def _write(self):
+        with self._file_lock():
+            if self.changed():
+                self._merge_changes()
+
+            config = ConfigParser(allow_unnamed_section=True)
+            for key, item in self.items():
+                config.add_section(key)
+                for name, value in item.items():
+                    config.set(key, name, value)
+
+            with atomic_write(self.path, fsync=self.fsync) as file:
+                config.write(file)
+            self._journal.truncate()
+            self._dirty.clear()
+            self._signature = self._stat_signature()
+
+    # Entries can be changed by other threads (request handlers, delayed
+    # saves): they are only changed under the lock, and iterated from copies
 
     def keys(self):
-        return self._data.keys()
+        with self._lock:
+            return self._data.copy().keys()
 
     def items(self):
-        return self._data.items()
+        with self._lock:
+            if self._mmap is not None:
+                self._parse_all()
+            return self._data.copy().items()
 
     def __len__(self):
         return len(self._data)
 
     def __iter__(self):
-        return iter(self._data)
+        return iter(self.keys())
 
     def __getitem__(self, key):
-        return self._data[key]
+        item = self._data[key]
+        if type(item) is _Unparsed:
+            with self._lock:
+                # Another thread may have parsed it, or closed the memory map, meanwhile
+                item = self._data[key]
+                if type(item) is _Unparsed:
+                    return self._parse(key, item)
+        return item
+
+    def __contains__(self, key):
+        return key in self._data
 
     def __setitem__(self, key, item):
+        generator = self._make_generator(key, self._unsealed(key, item))
+        item = self._sealed(key, item)
+        with self._lock:
+            self._data[key] = item
+            self._dirty[key] = None
+            self._generators[key] = generator
+            self._codes.pop(key, None)
+            self._window_codes.pop(key, None)
+            self._update_indexes(key)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
+            self._dirty[key] = None
+            self._generators.pop(key, None)
+            self._codes.pop(key, None)
+            self._window_codes.pop(key, None)
+            self._update_indexes(key)
+
+    def find(self, fields):
+        "Returns the sorted keys of entries having all given field values"
+        with self._lock:
+            if self._field_index is None:
+                self._field_index = {}
+                for key, item in self.items():
+                    self._index_fields(key, item)
+            keys = None
+            for name, value in fields.items():
+                matched = self._field_index.get((name, str(value)), set())
+                keys = set(matched) if keys is None else keys & matched
+        return sorted(self.keys() if keys is None else keys)
+
+    def _index_fields(self, key, item):
+        fields = {(name, str(value)) for name, value in item.items() if name not in UNINDEXED_FIELDS}
+        self._indexed_fields[key] = fields
+        for field in fields:
+            self._field_index.setdefault(field, set()).add(key)
+
+    def match(self, patterns, after=None):
+        "Iterates in order over the keys matching any of the glob patterns, and greater than after if given"
+        regex = compile_patterns(patterns)
+        # Only ranges of keys starting with the literal prefixes of patterns are scanned
+        for prefix in literal_prefixes(patterns):
+            low, high = prefix, prefix_end(prefix)
+            if after is not None:
+                if high is not None and after >= high:
+                    continue
+                low = max(low, after)
+            for key in self._sorted_range(low, high):
+                if key != after and regex.match(key):
+                    yield key
+
+    def _sorted_range(self, low, high=None):
+        with self._lock:
+            if self._sorted_keys is None:
+                self._sorted_keys = sorted(self._data)
+            keys = self._sorted_keys
+            start = bisect_left(keys, low)
+            end = len(keys) if high is None else bisect_left(keys, high, start)
+            return keys[start:end]
+
+    def _update_indexes(self, key):
+        if self._sorted_keys is not None:
+            keys = self._sorted_keys
+            i = bisect_left(keys, key)
+            indexed = i < len(keys) and keys[i] == key
+            if key in self._data and not indexed:
+                keys.insert(i, key)
+            elif key not in self._data and indexed:
+                del keys[i]
+        if self._field_index is None:
+            return
+        for field in self._indexed_fields.pop(key, ()):
+            keys = self._field_index[field]
+            keys.discard(key)
+            if not keys:
+                del self._field_index[field]
+        if key in self._data:
+            self._index_fields(key, self[key])
+
+    @staticmethod
+    def _make_generator(key, item):
         if 'secret' not in item:
             raise MissingSecret(key)
         try:
-            b32decode(item['secret'].upper())
+            secret = decode_secret(item['secret'])
         except:
             raise WrongSecret(key)
-        self._data[key] = item
+        try:
+            algorithm = str(item.get('algorithm', DEFAULT_ALGORITHM)).lower()
+            digits = int(item.get('digits', DEFAULT_DIGITS))
+            match str(item.get('type', 'totp')).lower():
+                case 'totp':
+                    period = int(item.get('period', DEFAULT_PERIOD))
+                    if period <= 0:
+                        raise ValueError(period)
+                case 'hotp':
+                    # Counter-based entries have no period
+                    period = None
+                    if int(item.get('counter', 0)) < 0:
+                        raise ValueError(item['counter'])
+                case kind:
+                    raise ValueError(kind)
+            return Generator(period, make_generator(secret, algorithm, digits))
+        except ValueError:
+            raise WrongParameter(key)
+
+    def _get_generator(self, key):
+        try:
+            return self._generators[key]
+        except KeyError:
+            pass
+        generator = self._generators[key] = self._make_generator(key, self._unsealed(key, self[key]))
+        return generator
+
+    def _sealed(self, key, item):
+        secret = item.get('secret')
+        if self.cipher is None or secret is None or self.cipher.is_sealed(secret):
+            return item
+        return item | {'secret': self.cipher.seal(key, secret)}
+
+    def _unsealed(self, key, item):
+        secret = item.get('secret')
+        if self.cipher is None or secret is None or not self.cipher.is_sealed(secret):
+            return item
+        self.cipher.unlock()
+        try:
+            return item | {'secret': self.cipher.open(key, secret)}
+        except ValueError:
+            raise WrongSecret(key)
+
+    def decrypted_items(self):
+        "Iterates over entries with their secrets decrypted"
+        for key, item in self.items():
+            yield key, self._unsealed(key, item)
+
+    def _save_counter(self, key, value):
+        if self._journal is not None:
+            self._append_journal({'op': 'counter', 'key': key, 'value': value})
+            if len(self._journal) >= self.journal_threshold:
+                self.save()
+
+    def _next_hotp(self, key, generate):
+        with self._counter_lock(key):
+            item = self[key]
+            counter = int(item.get('counter', 0))
+            item['counter'] = str(counter + 1)
+            self._save_counter(key, counter + 1)
+        return generate(counter)
+
+    def _get_code(self, key, at):
+        period, generate = self._get_generator(key)
+        if period is None:
+            # HOTP codes are consumed when generated, they are never memoized
+            return self._next_hotp(key, generate)
+        step = get_time(at, period)
+        # Codes are memoized with their time step, an entry expires as soon as
+        # it is requested for another step
+        cached = self._codes.get(key)
+        if cached is not None and cached[0] == step:
+            self._code_hits += 1
+            return cached[1]
+        self._code_misses += 1
+        code = generate(step)
+        self._codes[key] = (step, code)
+        return code
+
+    def get_period(self, key):
+        "Returns the period of a TOTP entry, None for a HOTP entry"
+        return self._get_generator(key).period
+
+    def get_code(self, key, at=None):
+        return self._get_code(key, at)
+
+    def get_codes(self, keys, at=None):
+        if at is None:
+            at = time.time()
+        return [self._get_code(key, at) for key in keys]
+
+    def verify(self, key, code, at=None, window=None):
+        """
+        Checks a code of an entry against the codes of window steps around the current one
+
+        Each code is only accepted once: the counter of HOTP entries moves past
+        it, and used TOTP steps are remembered until they leave the window.
+        """
+        if window is None:
+            window = self.verify_window
+        if at is None:
+            at = time.time()
+        period, generate = self._get_generator(key)
+        code = str(code).encode()
+
+        # Counters of HOTP entries may have been moved by other processes
+        with self._lock, self._counter_lock(key) if period is None else nullcontext():
+            if period is None:
+                counter = int(self[key].get('counter', 0))
+                counters = range(counter, counter + window + 1)
+            else:
+                step = get_time(at, period)
+                counters = range(step - window, step + window + 1)
+
+            # All candidates are compared, in constant time, so that timing
+            # does not tell which one matched
+            matched = None
+            for counter, expected in zip(counters, self._get_window_codes(key, generate, counters)):
+                if hmac.compare_digest(expected, code) and matched is None:
+                    matched = counter
+            if matched is None:
+                return False
+
+            if period is None:
+                self[key]['counter'] = str(matched + 1)
+                self._save_counter(key, matched + 1)
+                return True
+            return self._use_step(key, matched, at, expires=(matched + window + 1) * period)
+
+    def _get_window_codes(self, key, generate, counters):
+        previous = self._window_codes.get(key, {})
+        # Codes still in the window are reused, others are forgotten
+        codes = self._window_codes[key] = {
+            counter: previous[counter] if counter in previous else generate(counter).encode()
+            for counter in counters
+        }
+        return codes.values()
+
+    def _use_step(self, key, step, at, expires):
+        used, expiries = self._used_steps, self._used_expiries
+        while expiries and expiries[0][0] <= at:
+            _, *used_step = heapq.heappop(expiries)
+            used.pop(tuple(used_step), None)
+        if (key, step) in used:
+            return False
+        if len(used) >= self.replay_cache_size:
+            # Forgetting a step still in the window would allow replaying its code
+            logger.warning("Replay cache is full, rejecting code of %s", key)
+            return False
+        used[key, step] = expires
+        heapq.heappush(expiries, (expires, key, step))
+        return True
+
+    def code_cache_info(self):
+        return CacheInfo(self._code_hits, self._code_misses, len(self._codes))
+
+
+class JournalDatabase(Database):
+    """
+    Database saving only changed entries, as records appended to its journal
+
+    The database file is a snapshot that gets rewritten only when the journal
+    reaches journal_threshold records.
+    """
+
+    journal_threshold = 10000
+
+    def _write(self):
+        if not self.path.exists() or len(self._journal) + len(self._dirty) >= self.journal_threshold:
+            self.compact()
+            return
+
+        records = [
+            {'op': 'set', 'key': key, 'item': self._data[key]}
+            if key in self._data
+            else {'op': 'del', 'key': key}
+            for key in self._dirty
+        ]
+        self._dirty.clear()
+        if records:
+            self._append_journal(*records)
+
+    def compact(self):
+        with self._lock:
+            super()._write()
+
+
+class SqliteDatabase(Database):
+    """
+    Database stored in a SQLite file
+
+    Entries are read lazily on access and every change is written as a single
+    row, so save() has nothing left to do.
+    """
+
+    def __init__(self, path=None, **kwargs):
+        super().__init__(path, **kwargs)
+        self._connection = None
+
+    def load(self, missing_ok=False, lazy=False):
+        if not missing_ok and not os.path.exists(self.path):
+            raise FileNotFoundError(self.path)
+
+        # Only SQLite databases need the module, it is not imported on startup
+        import sqlite3
+
+        with self._lock:
+            self._data.clear()
+            self._dirty.clear()
+            self._generators.clear()
+            self._codes.clear()
+            self._window_codes.clear()
+
+            if self._connection is not None:
+                self._connection.close()
+            self._connection = sqlite3.connect(self.path, check_same_thread=False, autocommit=True)
+            self._connection.executescript(SQLITE_SCHEMA)
+            # Writing the version on each load would make other connections reload
+            (version,), = self._execute('PRAGMA user_version')
+            if not version:
+                self._connection.executescript(SQLITE_FIELDS_BACKFILL)
+            self._load_options = (missing_ok, lazy)
+            self._signature = self._stat_signature()
+
+    def _stat_signature(self):
+        # Only changes committed by other connections update the data version
+        (version,), = self._execute('PRAGMA data_version')
+        return version
+
+    @staticmethod
+    def _journal_appended(old, new):
+        # SQLite databases have no journal to replay
+        return False
+
+    def _files(self):
+        return (self.path, f'{os.fspath(self.path)}-wal')
+
+    def save(self):
+        pass
+
+    @contextmanager
+    def batch(self):
+        "Makes all changes of the block in a single transaction, rolled back on error"
+        with self._lock:
+            if self._connection.in_transaction:
+                yield self
+                return
+            self._execute('BEGIN IMMEDIATE')
+            try:
+                yield self
+            except BaseException:
+                self._execute('ROLLBACK')
+                # Cached entries may have been changed by the block
+                self._data.clear()
+                self._generators.clear()
+                self._codes.clear()
+                self._window_codes.clear()
+                raise
+            self._execute('COMMIT')
+
+    def _execute(self, query, *params):
+        "Runs a statement and returns all its rows"
+        # The connection is shared by all threads, statements are run one at a
+        # time and their rows fetched at once
+        with self._lock:
+            return self._connection.execute(query, params).fetchall()
+
+    def _cache(self, key, raw_item):
+        try:
+            return self._data[key]
+        except KeyError:
+            item = self._data[key] = json.loads(raw_item)
+            return item
+
+    def keys(self):
+        return [key for key, in self._execute('SELECT key FROM entries ORDER BY id')]
+
+    def items(self):
+        for key, raw_item in self._execute('SELECT key, item FROM entries ORDER BY id'):
+            yield key, self._cache(key, raw_item)
+
+    def __len__(self):
+        (count,), = self._execute('SELECT COUNT(*) FROM entries')
+        return count
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __getitem__(self, key):
+        try:
+            return self._data[key]
+        except KeyError:
+            pass
+        rows = self._execute('SELECT item FROM entries WHERE key = ?', key)
+        if not rows:
+            raise KeyError(key)
+        return self._cache(key, rows[0][0])
+
+    def __contains__(self, key):
+        return key in self._data or bool(self._execute('SELECT 1 FROM entries WHERE key = ?', key))
+
+    def __setitem__(self, key, item):
+        with self._lock:
+            super().__setitem__(key, item)
+            del self._dirty[key]
+            self._execute(
+                'INSERT INTO entries (key, item) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET item = excluded.item',
+                key,
+                json.dumps(self._data[key]),
+            )
 
     def __delitem__(self, key):
-        del self._data[key]
+        with self._lock:
+            if not self._execute('DELETE FROM entries WHERE key = ? RETURNING id', key):
+                raise KeyError(key)
+            self._data.pop(key, None)
+            self._generators.pop(key, None)
+            self._codes.pop(key, None)
+            self._window_codes.pop(key, None)
+
+    def find(self, fields):
+        query = ' INTERSECT '.join(['SELECT entry_id FROM fields WHERE name = ? AND value = ?'] * len(fields))
+        if not query:
+            return sorted(self.keys())
+        params = [str(param) for field in fields.items() for param in field]
+        return [key for key, in self._execute(f'SELECT key FROM entries WHERE id IN ({query}) ORDER BY key', *params)]
+
+    def _sorted_range(self, low, high=None):
+        if high is None:
+            return [key for key, in self._execute('SELECT key FROM entries WHERE key >= ? ORDER BY key', low)]
+        return [key for key, in self._execute('SELECT key FROM entries WHERE key >= ? AND key < ? ORDER BY key', low, high)]
+
+    @contextmanager
+    def _counter_lock(self, key):
+        # The entry is read again in a write transaction, unless already in one
+        with self._lock:
+            if self._connection.in_transaction:
+                yield
+                return
+            self._execute('BEGIN IMMEDIATE')
+            self._data.pop(key, None)
+            try:
+                yield
+            except BaseException:
+                self._execute('ROLLBACK')
+                raise
+            self._execute('COMMIT')
+
+    def _save_counter(self, key, value):
+        self._execute('UPDATE entries SET item = json_set(item, \'$.counter\', ?) WHERE key = ?', str(value), key)
+
+
+SQLITE_SCHEMA = '''
+PRAGMA journal_mode = WAL;
+PRAGMA synchronous = NORMAL;
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    item TEXT NOT NULL
+);
+-- Inverted index of entry fields, kept up to date by triggers
+CREATE TABLE IF NOT EXISTS fields (
+    entry_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fields_name_value ON fields (name, value);
+CREATE INDEX IF NOT EXISTS fields_entry_id ON fields (entry_id);
+CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+    INSERT INTO fields SELECT new.id, key, value FROM json_each(new.item) WHERE key NOT IN ('secret', 'counter');
+END;
+CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF item ON entries
+WHEN json_remove(old.item, '$.counter') IS NOT json_remove(new.item, '$.counter') BEGIN
+    DELETE FROM fields WHERE entry_id = old.id;
+    INSERT INTO fields SELECT new.id, key, value FROM json_each(new.item) WHERE key NOT IN ('secret', 'counter');
+END;
+CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+    DELETE FROM fields WHERE entry_id = old.id;
+END;
+'''
+
+# Entries of databases created without the index are indexed once, the version
+# is checked again in the transaction in case another connection just did it
+SQLITE_FIELDS_BACKFILL = '''
+BEGIN IMMEDIATE;
+INSERT INTO fields
+    SELECT entries.id, field.key, field.value FROM entries, json_each(entries.item) AS field
+    WHERE field.key NOT IN ('secret', 'counter') AND (SELECT user_version FROM pragma_user_version) = 0;
+PRAGMA user_version = 1;
+COMMIT;
+'''
+
+SQLITE_MAGIC = b'SQLite format 3\x00'
+
+BACKENDS = {
+    'ini': Database,
+    'journal': JournalDatabase,
+    'sqlite': SqliteDatabase,
+}
+
+
+def detect_backend(path, default='ini'):
+    "Guesses the backend of an existing database file from its header"
+    try:
+        with open(path, 'rb') as file:
+            header = file.read(len(SQLITE_MAGIC))
+    except FileNotFoundError:
+        return default
+    if header == SQLITE_MAGIC:
+        return 'sqlite'
+    return default
@@ -4,3 +4,11 @@ class MissingSecret(ValueError):
 
 class WrongSecret(ValueError):
     pass
+
+
+class WrongParameter(ValueError):
+    pass
+
+
+class WrongPassphrase(ValueError):
+    pass
@@ -2,19 +2,30 @@ from http.server import HTTPServer
 from logging import getLogger
 
 from .asgi import ASGIRequestHandler
+from .server import PooledHTTPServer
+from .workers import serve_workers
 from ..utils import get_socket_url
 
 
 logger = getLogger(__name__)
 
 
-def run_server(db, port, on_started=None):
+def run_server(db, port, on_started=None, threads=0, workers=1):
     from .app import app
 
-    httpd = HTTPServer(('', port), ASGIRequestHandler)
+    if threads:
+        httpd = PooledHTTPServer(('', port), ASGIRequestHandler, threads=threads)
+    else:
+        httpd = HTTPServer(('', port), ASGIRequestHandler)
     httpd.app = app
+    # A single thread cannot let idle persistent connections block other clients
+    httpd.keep_alive = bool(threads)
 
     app.db = db
+    app.closing.clear()
+    # Half of the threads at most are held by event streams, none when
+    # requests are handled one at a time
+    app.max_event_streams = threads // 2
     app.url = get_socket_url(httpd.socket)
 
     logger.info('Starting serveur on %s', app.url)
@@ -22,7 +33,15 @@ def run_server(db, port, on_started=None):
         on_started(app)
 
     try:
-        httpd.serve_forever()
+        if workers > 1:
+            serve_workers(httpd, app, workers)
+        else:
+            httpd.serve_forever()
     except KeyboardInterrupt:
         logger.info('Shutting down...')
-        httpd.shutdown()
+        if workers <= 1:
+            httpd.shutdown()
+    finally:
+        # Let long-lived event streams end before waiting for the workers
+        app.closing.set()
+        httpd.server_close()
@@ -1,15 +1,38 @@
-from typing import Annotated
+import asyncio
+import codecs
+import json
+import math
+import tempfile
+import threading
+import time
+from itertools import islice
+from typing import Annotated, Literal
+from urllib.parse import urlencode
 
 import jinja2
 import fastapi
 import fastapi.templating
+from starlette.concurrency import run_in_threadpool
 
 from .fastapi_utils import AcceptHTML, FormOrJSON
-from .schemas import InsertData, UpdateData
-from ..totp import generate_totp
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, metrics
+from .schemas import BatchQuery, InsertData, UpdateData, VerifyData
+from ..bulk import FORMATS, export_entries, import_entries, insert_entries
+from ..patterns import compile_patterns
+from ..totp import get_time
+
+# Event streams are ended after this delay (in seconds), clients reconnect by themselves
+EVENTS_DURATION = 30
 
 
 app = fastapi.FastAPI()
+app.closing = threading.Event()
+# Each event stream holds a thread of the server: their number is capped
+# (by run_server, from the number of threads) and pages fall back to reloading
+app.max_event_streams = 4
+app.event_streams = 0
+_event_streams_lock = threading.Lock()
+app.add_middleware(MetricsMiddleware, metrics=metrics)
 templates = fastapi.templating.Jinja2Templates(
     env=jinja2.Environment(
         loader=jinja2.PackageLoader('requireris.www'),
@@ -24,16 +47,53 @@ def index(
         request: fastapi.Request,
         accept_html: AcceptHTML,
         additional_fields: Annotated[list[str], fastapi.Query(alias='add-field')] = [],
+        patterns: Annotated[list[str], fastapi.Query(alias='match')] = [],
+        limit: Annotated[int | None, fastapi.Query(ge=1)] = None,
+        after: str | None = None,
 ):
+    # Entries are filtered on fields given as field.<name>=<value> parameters
+    fields = {
+        name.removeprefix('field.'): value
+        for name, value in request.query_params.items()
+        if name.startswith('field.')
+    }
+    if fields:
+        keys = app.db.find(fields)
+        if patterns:
+            keys = filter(compile_patterns(patterns).match, keys)
+        if after is not None:
+            keys = (key for key in keys if key > after)
+    elif patterns or limit or after is not None:
+        # Pages are ranges of sorted keys
+        keys = app.db.match(patterns or ['*'], after=after)
+    else:
+        keys = app.db.keys()
+
+    next_page = None
+    if limit:
+        keys = list(islice(keys, limit + 1))
+        if len(keys) > limit:
+            del keys[limit:]
+            params = [(name, value) for name, value in request.query_params.multi_items() if name != 'after']
+            next_page = f'{app.url}/keys?{urlencode([*params, ("after", keys[-1])])}'
+
     if accept_html:
-        return templates.TemplateResponse(
-            request,
-            'index.html',
-            {
-                'keys': app.db.keys(),
-                'additional_fields': additional_fields,
-            }
-        )
+        with metrics.time('render'):
+            return templates.TemplateResponse(
+                request,
+                'index.html',
+                {
+                    'keys': keys,
+                    'next_page': next_page,
+                    'additional_fields': additional_fields,
+                }
+            )
+    links = {}
+    if next_page:
+        links['@next'] = {
+            'method': 'GET',
+            'href': next_page,
+        }
     return {
         'keys': {
             key: {
@@ -42,7 +102,7 @@ def index(
                     'href': f'{app.url}/keys/{key}',
                 },
             }
-            for key in app.db.keys()
+            for key in keys
         },
         '@list': {
             'method': 'GET',
@@ -56,9 +116,96 @@ def index(
                 'secret': 'string',
             },
         },
+        **links,
     }
 
 
+@app.get('/metrics')
+def get_metrics():
+    return fastapi.responses.PlainTextResponse(metrics.render(app.db), media_type=METRICS_CONTENT_TYPE)
+
+
+@app.get('/keys/_export')
+def export_keys(format: Literal['jsonl', 'csv', 'otpauth'] = 'jsonl'):
+    _, _, media_type = FORMATS[format]
+    return fastapi.responses.StreamingResponse(
+        export_entries(app.db, format),
+        media_type=media_type,
+    )
+
+
+async def code_events(periods):
+    # Codes of HOTP entries would be consumed on each rotation
+    periods = {key: period for key, period in periods.items() if period is not None}
+    steps = {}
+    end = time.monotonic() + EVENTS_DURATION
+    yield 'retry: 1000\n\n'
+    while periods and time.monotonic() < end and not app.closing.is_set():
+        now = time.time()
+        rotated = [key for key, period in periods.items() if steps.get(key) != get_time(now, period)]
+        # Codes are memoized per step by the database, they are computed once
+        # for all the subscribers
+        for key, code in zip(rotated, app.db.get_codes(rotated, now)):
+            period = periods[key]
+            steps[key] = step = get_time(now, period)
+            data = {'key': key, 'code': code, 'expires': (step + 1) * period}
+            yield f'event: code\ndata: {json.dumps(data)}\n\n'
+        next_rotation = min((steps[key] + 1) * period for key, period in periods.items())
+        # Wake up at least every second to notice the server shutdown
+        await asyncio.sleep(min(next_rotation - time.time(), 1))
+
+
+def _acquire_event_stream():
+    with _event_streams_lock:
+        if app.event_streams >= app.max_event_streams:
+            return False
+        app.event_streams += 1
+        return True
+
+
+async def _release_event_stream(events):
+    try:
+        async for event in events:
+            yield event
+    finally:
+        with _event_streams_lock:
+            app.event_streams -= 1
+
+
+@app.get('/keys/_events')
+def watch_keys(keys: Annotated[list[str], fastapi.Query(alias='key')] = []):
+    periods = {}
+    for key in keys:
+        try:
+            periods[key] = app.db.get_period(key)
+        except KeyError:
+            raise fastapi.HTTPException(
+                status_code=fastapi.status.HTTP_404_NOT_FOUND,
+                detail=f"Key {key!r} not found",
+            )
+        if periods[key] is None:
+            raise fastapi.HTTPException(
+                status_code=fastapi.status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f"Key {key!r} has no rotating code",
+            )
+    if not periods:
+        raise fastapi.HTTPException(
+            status_code=fastapi.status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="No key given",
+        )
+    if not _acquire_event_stream():
+        raise fastapi.HTTPException(
+            status_code=fastapi.status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many event streams, retry later",
+            headers={'Retry-After': str(EVENTS_DURATION)},
+        )
+    return fastapi.responses.StreamingResponse(
+        _release_event_stream(code_events(periods)),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache'},
+    )
+
+
 @app.get('/keys/{key}')
 @app.get('/get/{key}')
 def get_key(
@@ -75,23 +222,47 @@ def get_key(
             status_code=fastapi.status.HTTP_404_NOT_FOUND,
             detail=f"Key {key!r} not found",
         )
-    code = generate_totp(item.pop('secret'))
+    del item['secret']
+    with metrics.time('codes'):
+        code = app.db.get_code(key)
     if accept_html:
+        period = app.db.get_period(key)
+        # Pages of TOTP keys are updated by an event stream when one is
+        # available, or else reloaded when their code expires
+        refresh = None
+        if period is not None:
+            now = time.time()
+            refresh = max(math.ceil((get_time(now, period) + 1) * period - now), 1)
         common_fields = set(additional_fields) & set(delete_fields)
         for field in common_fields:
             additional_fields.remove(field)
             delete_fields.remove(field)
-        return templates.TemplateResponse(
-            request,
-            'get.html',
-            {
-                'key': key,
-                'code': code,
-                'data': item,
-                'additional_fields': additional_fields,
-                'delete_fields': delete_fields,
-            },
-        )
+        with metrics.time('render'):
+            return templates.TemplateResponse(
+                request,
+                'get.html',
+                {
+                    'key': key,
+                    'code': code,
+                    'watch': refresh is not None and app.event_streams < app.max_event_streams,
+                    'refresh': refresh,
+                    'data': item,
+                    'additional_fields': additional_fields,
+                    'delete_fields': delete_fields,
+                },
+            )
+    return _key_document(key, item, code)
+
+
+def _written_key(key):
+    "Returns the document of an entry just written, without consuming a code of HOTP entries"
+    item = dict(app.db[key])
+    del item['secret']
+    code = None if app.db.get_period(key) is None else app.db.get_code(key)
+    return _key_document(key, item, code)
+
+
+def _key_document(key, item, code):
     return {
         **item,
         'code': code,
@@ -117,13 +288,79 @@ def get_key(
     }
 
 
+@app.post('/keys/_batch')
+def get_keys(query: Annotated[BatchQuery, FormOrJSON()]):
+    keys = list(dict.fromkeys(query.keys))
+    if query.patterns:
+        selected = set(keys)
+        keys.extend(key for key in app.db.match(query.patterns) if key not in selected)
+
+    found = [key for key in keys if key in app.db]
+    # HOTP codes are consumed when generated: only entries named by keys get
+    # one, not the ones matched by patterns
+    named = set(query.keys)
+    coded = [key for key in found if key in named or app.db.get_period(key) is not None]
+    # All codes are generated at once, for the same instant
+    with metrics.time('codes'):
+        codes = dict(zip(coded, app.db.get_codes(coded)))
+
+    items = {}
+    for key in found:
+        item = dict(app.db[key])
+        del item['secret']
+        items[key] = {
+            **item,
+            'code': codes.get(key),
+            '@get': {
+                'method': 'GET',
+                'href': f'{app.url}/keys/{key}',
+            },
+        }
+
+    return {
+        'keys': items,
+        'missing': [key for key in keys if key not in items],
+        '@list': {
+            'method': 'GET',
+            'href': f'{app.url}/keys',
+        },
+    }
+
+
+@app.post('/keys/_import')
+async def import_keys(
+        request: fastapi.Request,
+        format: Literal['jsonl', 'csv', 'otpauth'] = 'jsonl',
+):
+    # The upload is spooled while received (to disk once large) then
+    # imported line by line
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024, mode='w+', encoding='utf-8', newline='') as file:
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        async for chunk in request.stream():
+            file.write(decoder.decode(chunk))
+        file.write(decoder.decode(b'', final=True))
+        file.seek(0)
+        imported, errors = await run_in_threadpool(import_entries, app.db, file, format)
+
+    return {
+        'imported': imported,
+        'errors': [error._asdict() for error in errors],
+        '@list': {
+            'method': 'GET',
+            'href': f'{app.url}/keys',
+        },
+    }
+
+
 @app.post('/new')
 @app.post('/keys')
 def insert_key(
-        data: Annotated[InsertData, FormOrJSON()],
+        data: Annotated[InsertData, FormOrJSON(batch=True)],
         request: fastapi.Request,
         accept_html: AcceptHTML,
 ):
+    if isinstance(data, list):
+        return insert_keys(data)
     data = data.model_dump()
     key = data.pop('key')
     app.db[key] = data
@@ -133,7 +370,43 @@ def insert_key(
             f'/get/{key}',
             status_code=fastapi.status.HTTP_303_SEE_OTHER,
         )
-    return get_key(key, request=request, accept_html=False)
+    return _written_key(key)
+
+
+def insert_keys(entries):
+    # Arrays of entries are inserted with a single save, like imports
+    rows = []
+    for index, entry in enumerate(entries):
+        item = entry.model_dump()
+        rows.append((index, item.pop('key'), item))
+    imported, errors = insert_entries(app.db, rows)
+    return {
+        'imported': imported,
+        'errors': [{'index': error.line, 'key': error.key, 'error': error.error} for error in errors],
+        '@list': {
+            'method': 'GET',
+            'href': f'{app.url}/keys',
+        },
+    }
+
+
+@app.post('/keys/{key}/verify')
+def verify_key(key: str, data: Annotated[VerifyData, FormOrJSON()]):
+    try:
+        with metrics.time('codes'):
+            valid = app.db.verify(key, data.code)
+    except KeyError:
+        raise fastapi.HTTPException(
+            status_code=fastapi.status.HTTP_404_NOT_FOUND,
+            detail=f"Key {key!r} not found",
+        )
+    return {
+        'valid': valid,
+        '@get': {
+            'method': 'GET',
+            'href': f'{app.url}/keys/{key}',
+        },
+    }
 
 
 @app.post('/del/{key}')
@@ -176,4 +449,4 @@ def update_key(
             f'/get/{key}',
             status_code=fastapi.status.HTTP_303_SEE_OTHER,
         )
-    return get_key(key, request=request, accept_html=False)
+    return _written_key(key)
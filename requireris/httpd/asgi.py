@@ -1,10 +1,39 @@
 import asyncio
+import threading
+from logging import getLogger
 from urllib.parse import urlparse
 
 from http.server import BaseHTTPRequestHandler
 
+logger = getLogger(__name__)
+
+# Maximum size of request body pieces given to the application at once
+CHUNK_SIZE = 64 * 1024
+
+_local = threading.local()
+
+
+def _run(coroutine):
+    # Each thread keeps its own event loop for all the requests it handles,
+    # instead of creating a new one per request
+    try:
+        runner = _local.runner
+    except AttributeError:
+        runner = _local.runner = asyncio.Runner()
+    return runner.run(coroutine)
+
 
 class ASGIRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Maximum delay (in seconds) waiting for data of a request
+    timeout = 30
+    # Persistent connections hold a thread while idle: they are closed when
+    # no new request starts within this delay (in seconds)
+    idle_timeout = 2
+    disable_nagle_algorithm = True
+    # Status line and headers of the response, until sent with its body
+    _head = None
+
     def route(self):
         url = urlparse(self.path)
         scope = {
@@ -15,24 +44,149 @@ class ASGIRequestHandler(BaseHTTPRequestHandler):
             'headers': [(header.lower().encode(), value.encode()) for header, value in self.headers.items()],
         }
 
+        if not getattr(self.server, 'keep_alive', True) or getattr(self.server, 'saturated', False):
+            # Threads are given back to the server as soon as possible
+            self.close_connection = True
+
+        chunked_request = 'chunked' in self.headers.get('Transfer-Encoding', '').lower()
+        remaining = int(self.headers.get('Content-Length') or 0)
+        request_complete = not chunked_request and not remaining
+        request_received = response_started = response_complete = chunked_response = client_gone = False
+        disconnected = asyncio.Event()
+
         async def receive():
-            content_type = self.headers['Content-Type']
-            size = int(self.headers['Content-Length'])
+            nonlocal remaining, request_complete, request_received
+            if request_received:
+                # Nothing left to read: only report the end of the exchange
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+            if chunked_request:
+                body = self._read_chunk()
+                request_complete = not body
+            elif remaining:
+                body = self.rfile.read(min(remaining, CHUNK_SIZE))
+                remaining -= len(body)
+                request_complete = not remaining or not body
+            else:
+                body = b''
+            request_received = request_complete
             return {
                 'type': 'http.request',
-                'body': self.rfile.read(size),
-                'more_body': False,
+                'body': body,
+                'more_body': not request_complete,
             }
 
         async def send(data):
+            nonlocal response_started, response_complete, chunked_response, client_gone
             match data['type']:
                 case 'http.response.start':
-                    self.send_response(data['status'])
-                    for header, value in data['headers']:
-                        self.send_header(header.decode(), value.decode())
-                    self.end_headers()
+                    headers = [(header.decode(), value.decode()) for header, value in data.get('headers', [])]
+                    names = {header.lower() for header, _ in headers}
+                    if 'content-length' not in names and self._may_have_body(data['status']):
+                        if self.request_version == 'HTTP/1.1':
+                            chunked_response = True
+                            headers.append(('Transfer-Encoding', 'chunked'))
+                        else:
+                            self.close_connection = True
+                    if self.close_connection and 'connection' not in names:
+                        headers.append(('Connection', 'close'))
+                    self._start_response(data['status'], headers)
+                    response_started = True
+                case 'http.response.body' if client_gone:
+                    pass
                 case 'http.response.body':
-                    self.wfile.write(data['body'])
-        asyncio.run(self.server.app(scope, receive, send))
+                    body = data.get('body', b'')
+                    more_body = data.get('more_body', False)
+                    if self.command == 'HEAD':
+                        body = b''
+                    elif chunked_response:
+                        body = b'%X\r\n%s\r\n' % (len(body), body) if body else b''
+                        if not more_body:
+                            body += b'0\r\n\r\n'
+                    try:
+                        self._write(body)
+                    except ConnectionError:
+                        # Long-lived responses learn that the client left from receive()
+                        client_gone = self.close_connection = True
+                        disconnected.set()
+                        return
+                    if not more_body:
+                        response_complete = True
+                        disconnected.set()
+
+        try:
+            _run(self.server.app(scope, receive, send))
+        except Exception:
+            logger.exception('Error while handling request %s %s', self.command, self.path)
+            if not response_started:
+                self.send_error(500)
+            self.close_connection = True
+            return
+
+        if client_gone:
+            return
+        if not response_complete:
+            if chunked_response:
+                self._write(b'0\r\n\r\n')
+            else:
+                self._write(b'')
+                if response_started and self._may_have_body(self._status):
+                    self.close_connection = True
+        if not request_complete:
+            # Unread body would be mistaken for the next request
+            self.close_connection = True
+
+    def handle(self):
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            # Idle connections are closed quietly, only timeouts of requests
+            # in progress are logged
+            self.connection.settimeout(self.idle_timeout)
+            try:
+                if not self.rfile.peek(1):
+                    return
+            except TimeoutError:
+                return
+            self.connection.settimeout(self.timeout)
+            self.handle_one_request()
+
+    def _start_response(self, status, headers):
+        self._status = status
+        self.log_request(status)
+        lines = [
+            f'{self.protocol_version} {status} {self.responses.get(status, ("",))[0]}',
+            f'Server: {self.version_string()}',
+            f'Date: {self.date_time_string()}',
+        ]
+        for header, value in headers:
+            lines.append(f'{header}: {value}')
+            if header.lower() == 'connection' and value.lower() in ('close', 'keep-alive'):
+                self.close_connection = value.lower() == 'close'
+        # Headers are only sent along with the first part of the body
+        self._head = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1', 'strict')
+
+    def _write(self, data):
+        if self._head is not None:
+            data = self._head + data
+            self._head = None
+        if data:
+            self.wfile.write(data)
+
+    def _may_have_body(self, status):
+        return self.command != 'HEAD' and status >= 200 and status not in (204, 304)
+
+    def _read_chunk(self):
+        # Reads the next chunk of a chunked request body, returns b'' on the last one
+        size_line = self.rfile.readline(CHUNK_SIZE)
+        size = int(size_line.split(b';', 1)[0].strip() or b'0', 16)
+        if not size:
+            # Skip trailers up to the final empty line
+            while self.rfile.readline(CHUNK_SIZE).strip():
+                pass
+            return b''
+        body = self.rfile.read(size)
+        self.rfile.readline(CHUNK_SIZE)
+        return body
 
     do_GET = do_HEAD = do_POST = do_PUT = do_PATCH = do_DELETE = do_CONNECT = do_OPTIONS = do_TRACE = route
@@ -0,0 +1,193 @@
+import threading
+import time
+from bisect import bisect_left
+
+# Upper bounds (in seconds) of the buckets of duration histograms
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        # Counts are kept per bucket and only accumulated when rendered
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self, name, labels):
+        total = 0
+        for bound, count in zip((*self.buckets, '+Inf'), self.counts):
+            total += count
+            yield f'{name}_bucket{_format_labels(labels | {"le": bound})} {total}'
+        yield f'{name}_sum{_format_labels(labels)} {self.sum}'
+        yield f'{name}_count{_format_labels(labels)} {total}'
+
+
+class Metrics:
+    """
+    Request counters and duration histograms of the HTTP server
+
+    Observations only update counters in memory, the Prometheus text
+    format is built when metrics are scraped.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._latencies = {}
+        self._stages = {}
+
+    def observe_request(self, method, route, status, duration):
+        with self._lock:
+            key = (method, route, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            try:
+                histogram = self._latencies[method, route]
+            except KeyError:
+                histogram = self._latencies[method, route] = Histogram()
+            histogram.observe(duration)
+
+    def observe_stage(self, stage, duration):
+        with self._lock:
+            try:
+                histogram = self._stages[stage]
+            except KeyError:
+                histogram = self._stages[stage] = Histogram()
+            histogram.observe(duration)
+
+    def time(self, stage):
+        "Returns a context manager measuring the duration of a stage of requests (parse, render, codes)"
+        return _StageTimer(self, stage)
+
+    def render(self, db=None):
+        "Returns all metrics (and those of the database if given) in the Prometheus text format"
+        with self._lock:
+            requests = dict(self._requests)
+            latencies = {key: _copy(histogram) for key, histogram in self._latencies.items()}
+            stages = {stage: _copy(histogram) for stage, histogram in self._stages.items()}
+
+        lines = [
+            '# HELP requireris_http_requests_total Number of handled HTTP requests',
+            '# TYPE requireris_http_requests_total counter',
+        ]
+        for (method, route, status), count in sorted(requests.items()):
+            labels = {'method': method, 'route': route, 'status': status}
+            lines.append(f'requireris_http_requests_total{_format_labels(labels)} {count}')
+
+        lines += [
+            '# HELP requireris_http_request_duration_seconds Time from the reception of HTTP requests to the start of their response',
+            '# TYPE requireris_http_request_duration_seconds histogram',
+        ]
+        for (method, route), histogram in sorted(latencies.items()):
+            lines.extend(histogram.render('requireris_http_request_duration_seconds', {'method': method, 'route': route}))
+
+        lines += [
+            '# HELP requireris_stage_duration_seconds Time spent in each stage of requests handling',
+            '# TYPE requireris_stage_duration_seconds histogram',
+        ]
+        for stage, histogram in sorted(stages.items()):
+            lines.extend(histogram.render('requireris_stage_duration_seconds', {'stage': stage}))
+
+        if db is not None:
+            lines.extend(_render_database(db))
+        return '\n'.join(lines) + '\n'
+
+
+class _StageTimer:
+    __slots__ = ('metrics', 'stage', 'start')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe_stage(self.stage, time.perf_counter() - self.start)
+
+
+class MetricsMiddleware:
+    "ASGI middleware counting requests per route and measuring their latency up to the start of their response"
+
+    def __init__(self, app, metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        started = False
+
+        async def timed_send(message):
+            nonlocal started
+            if message['type'] == 'http.response.start':
+                # Streamed responses are only measured up to their first byte
+                started = True
+                self._observe(scope, message['status'], start)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            if not started:
+                self._observe(scope, 500, start)
+
+    def _observe(self, scope, status, start):
+        # Routes are labelled by their template, never by the requested path
+        route = getattr(scope.get('route'), 'path', '')
+        self.metrics.observe_request(scope['method'], route, status, time.perf_counter() - start)
+
+
+def _render_database(db):
+    cache = db.code_cache_info()
+    writes = db.write_info()
+    return [
+        '# HELP requireris_db_entries Number of entries in the database',
+        '# TYPE requireris_db_entries gauge',
+        f'requireris_db_entries {len(db)}',
+        '# HELP requireris_db_size_bytes Size of the database files',
+        '# TYPE requireris_db_size_bytes gauge',
+        f'requireris_db_size_bytes {db.files_size()}',
+        '# HELP requireris_db_write_duration_seconds Time spent writing the database files on save',
+        '# TYPE requireris_db_write_duration_seconds summary',
+        f'requireris_db_write_duration_seconds_sum {writes.seconds}',
+        f'requireris_db_write_duration_seconds_count {writes.count}',
+        '# HELP requireris_code_cache_hits_total Codes served from the cache of the database',
+        '# TYPE requireris_code_cache_hits_total counter',
+        f'requireris_code_cache_hits_total {cache.hits}',
+        '# HELP requireris_code_cache_misses_total Codes generated from secrets',
+        '# TYPE requireris_code_cache_misses_total counter',
+        f'requireris_code_cache_misses_total {cache.misses}',
+        '# HELP requireris_code_cache_size Number of codes in the cache of the database',
+        '# TYPE requireris_code_cache_size gauge',
+        f'requireris_code_cache_size {cache.currsize}',
+    ]
+
+
+def _copy(histogram):
+    copy = Histogram(histogram.buckets)
+    copy.counts = list(histogram.counts)
+    copy.sum = histogram.sum
+    return copy
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+    return f'{{{pairs}}}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metrics = Metrics()
@@ -12,3 +12,12 @@ class UpdateData(pydantic.BaseModel):
     secret: str | None = None
 
     model_config = pydantic.ConfigDict(extra='allow')
+
+
+class VerifyData(pydantic.BaseModel):
+    code: str
+
+
+class BatchQuery(pydantic.BaseModel):
+    keys: list[str] = []
+    patterns: list[str] = []
@@ -0,0 +1,39 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer
+
+
+class PooledHTTPServer(HTTPServer):
+    "HTTP server handling requests concurrently in a fixed pool of worker threads"
+
+    def __init__(self, server_address, RequestHandlerClass, threads=8, bind_and_activate=True):
+        super().__init__(server_address, RequestHandlerClass, bind_and_activate)
+        self.threads = threads
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix='requireris-http')
+        # Number of accepted connections, being handled or waiting for a thread
+        self._connections = 0
+        self._connections_lock = threading.Lock()
+
+    @property
+    def saturated(self):
+        "Whether accepted connections are waiting for a thread of the pool"
+        return self._connections > self.threads
+
+    def process_request(self, request, client_address):
+        with self._connections_lock:
+            self._connections += 1
+        self._executor.submit(self._process_request_worker, request, client_address)
+
+    def _process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self._connections_lock:
+                self._connections -= 1
+
+    def server_close(self):
+        super().server_close()
+        self._executor.shutdown()
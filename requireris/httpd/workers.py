@@ -0,0 +1,103 @@
+import os
+import signal
+import threading
+import time
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+# Workers exiting within this delay (in seconds) of their start failed to start
+WORKER_STARTUP = 5
+# Failed workers are started again after a delay doubled on each failure in a row
+RESPAWN_DELAY = 0.5
+# Number of failures in a row after which workers are not started anymore
+MAX_FAILURES = 5
+
+
+class SharedDatabaseApp:
+    """
+    ASGI application reopening the database of the wrapped app once changed by another process
+
+    The database is replaced by a new instance, so running requests keep a
+    consistent view of the old one.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._lock = threading.Lock()
+
+    async def __call__(self, scope, receive, send):
+        db = self.app.db
+        # Only the files are stat'ed, they are parsed again when changed
+        if db.changed():
+            with self._lock:
+                if self.app.db is db:
+                    db.flush()
+                    self.app.db = db.reopen()
+        await self.app(scope, receive, send)
+
+
+def serve_workers(httpd, app, workers):
+    "Serves requests from forked worker processes sharing the listening socket of httpd"
+    # Used TOTP steps are only remembered in memory, by each worker
+    logger.warning('Running %d workers, a code could be accepted once by each of them', workers)
+    # Maps the pid of each worker to the time it was started
+    pids = {}
+    failures = 0
+
+    def fork_worker():
+        pid = os.fork()
+        if not pid:
+            _run_worker(httpd, app)
+        pids[pid] = time.monotonic()
+
+    for _ in range(workers):
+        fork_worker()
+
+    try:
+        while pids:
+            pid, status = os.wait()
+            started = pids.pop(pid, None)
+            if started is None or not status:
+                continue
+            if time.monotonic() - started < WORKER_STARTUP:
+                failures += 1
+            else:
+                failures = 0
+            if failures >= MAX_FAILURES:
+                logger.error('Workers keep failing on startup, stopping the server')
+                raise SystemExit(1)
+            logger.warning('Worker %d exited unexpectedly, starting a new one', pid)
+            if failures:
+                time.sleep(RESPAWN_DELAY * 2 ** (failures - 1))
+            fork_worker()
+    finally:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in pids:
+            os.waitpid(pid, 0)
+
+
+def _run_worker(httpd, app):
+    # Workers stop on SIGTERM sent by the main process, as on Ctrl-C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    status = 0
+    try:
+        # Each worker opens its own database, SQLite connections cannot be
+        # shared with a forked process
+        app.db = app.db.reopen()
+        httpd.app = SharedDatabaseApp(app)
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    except BaseException:
+        logger.exception('Worker %d failed', os.getpid())
+        status = 1
+    finally:
+        app.closing.set()
+        httpd.server_close()
+        app.db.flush()
+        os._exit(status)
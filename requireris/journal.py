@@ -0,0 +1,78 @@
+import json
+import os
+from logging import getLogger
+from pathlib import Path
+
+from .utils import lock_file
+
+logger = getLogger(__name__)
+
+
+class Journal:
+    "Append-only file of JSON records, one per line"
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._size = 0
+        # Position in the file up to which records were appended or replayed
+        self.offset = 0
+
+    def __len__(self):
+        "Number of records appended or replayed since last truncation"
+        return self._size
+
+    def append(self, *records, fsync=False):
+        """
+        Appends records at the end of the journal
+
+        Returns the records appended by other processes since last replay or
+        append: they are read under the same lock, so that the offset is only
+        moved past records that were read.
+        """
+        lines = ''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records).encode()
+        with self.path.open('a+b') as file:
+            lock_file(file)
+            pending = list(self._read(file, self.offset))
+            end = file.seek(0, os.SEEK_END)
+            file.write(lines)
+            if fsync:
+                file.flush()
+                os.fsync(file.fileno())
+            if self.offset == end:
+                self.offset = file.tell()
+        self._size += len(records)
+        return pending
+
+    def replay(self, offset=0):
+        "Yields the records of the journal, starting at a byte offset of the file"
+        if not offset:
+            self._size = 0
+        try:
+            file = self.path.open('rb')
+        except FileNotFoundError:
+            self.offset = 0
+            return
+
+        with file:
+            yield from self._read(file, offset)
+
+    def _read(self, file, offset):
+        file.seek(offset)
+        for line in file:
+            if not line.endswith(b'\n'):
+                # Last record is still being appended (or was interrupted by a crash)
+                break
+            offset += len(line)
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logger.warning("Skipping corrupted record in journal %s", self.path)
+                continue
+            self._size += 1
+            yield record
+        self.offset = offset
+
+    def truncate(self):
+        self.path.unlink(missing_ok=True)
+        self._size = 0
+        self.offset = 0
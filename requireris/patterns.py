@@ -0,0 +1,32 @@
+import re
+from fnmatch import translate
+
+# Characters starting a wildcard in glob patterns
+WILDCARDS_RE = re.compile(r'[*?[]')
+
+
+def compile_patterns(patterns):
+    "Compiles glob patterns into a single regex matching any of them"
+    return re.compile('|'.join(translate(pattern) for pattern in patterns))
+
+
+def literal_prefixes(patterns):
+    """
+    Returns the sorted literal prefixes that keys must start with to match any of the glob patterns
+
+    Prefixes already covered by a shorter one are dropped, so they never
+    overlap. A pattern starting with a wildcard gives the empty prefix.
+    """
+    prefixes = []
+    for prefix in sorted({WILDCARDS_RE.split(pattern, 1)[0] for pattern in patterns}):
+        if not prefixes or not prefix.startswith(prefixes[-1]):
+            prefixes.append(prefix)
+    return prefixes
+
+
+def prefix_end(prefix):
+    "Returns the first string greater than all strings starting with prefix, None if there is none"
+    prefix = prefix.rstrip(chr(0x10ffff))
+    if not prefix:
+        return None
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
@@ -0,0 +1,76 @@
+import json
+import re
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+SECTION_RE = re.compile(rb'^\[(.+)\]', re.MULTILINE)
+SECRET_RE = re.compile(rb'^secret[ \t]*[=:]', re.MULTILINE | re.IGNORECASE)
+
+
+def build_index(data) -> dict[str, tuple[int, int]]:
+    "Maps each section name of an INI content to the (start, end) offsets of the section"
+    index = {}
+    start = name = None
+    for match in SECTION_RE.finditer(data):
+        if name is not None:
+            index[name] = (start, match.start())
+        start, name = match.start(), match[1].decode()
+    if name is not None:
+        index[name] = (start, len(data))
+    return index
+
+
+def find_secretless(data, index) -> list[str]:
+    "Returns the names of indexed sections having no secret option, which are skipped when loaded"
+    if 'DEFAULT' in index and SECRET_RE.search(data, *index['DEFAULT']):
+        return []
+    return [name for name, (start, end) in index.items() if name != 'DEFAULT' and not SECRET_RE.search(data, start, end)]
+
+
+def read_index(path, stat):
+    """
+    Reads an index file and the sections it lists as secretless
+
+    Returns None if missing or outdated compared to the indexed file stat.
+    """
+    try:
+        with open(path) as file:
+            content = json.load(file)
+        if content['mtime_ns'] != stat.st_mtime_ns or content['size'] != stat.st_size:
+            return None
+        names, starts, secretless = content['names'], content['starts'], content['secretless']
+    except (OSError, ValueError, KeyError):
+        return None
+    return dict(zip(names, zip(starts, [*starts[1:], stat.st_size]))), secretless
+
+
+def write_index(path, stat, index, secretless=()):
+    # Sections are contiguous, so only their starts need to be stored
+    content = {
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'names': list(index),
+        'starts': [start for start, _ in index.values()],
+        'secretless': list(secretless),
+    }
+    try:
+        with open(path, 'w') as file:
+            json.dump(content, file, separators=(',', ':'))
+    except OSError as e:
+        logger.debug("Cannot write index file %s: %s", path, e)
+
+
+def load_index(path, stat, data):
+    """
+    Reads the index file if it is up to date, or builds the index from data and writes it
+
+    Returns the index and the names of sections having no secret.
+    """
+    result = read_index(path, stat)
+    if result is None:
+        index = build_index(data)
+        secretless = find_secretless(data, index)
+        write_index(path, stat, index, secretless)
+        result = index, secretless
+    return result
@@ -1,8 +1,21 @@
 import time
 from base64 import b32decode
 import hmac
-from hashlib import sha1
+from hashlib import sha1, sha256, sha512
 import struct
+from collections.abc import Callable, Iterable
+
+
+ALGORITHMS = {
+    'sha1': sha1,
+    'sha256': sha256,
+    'sha512': sha512,
+}
+DEFAULT_ALGORITHM = 'sha1'
+DEFAULT_DIGITS = 6
+DEFAULT_PERIOD = 30
+
+_pack_counter = struct.Struct('>Q').pack
 
 
 def ull_to_bytes(i: int) -> bytes:
@@ -44,8 +57,20 @@ def padding_6(i: int) -> str:
     return f'{i:06}'
 
 
-def get_time():
-    return int(time.time() / 30)
+def get_time(at: float | None = None, period: int = DEFAULT_PERIOD) -> int:
+    if at is None:
+        at = time.time()
+    return int(at / period)
+
+
+def decode_secret(secret: str | bytes) -> bytes:
+    return b32decode(secret.upper())
+
+
+def truncate(data: bytes) -> int:
+    "Dynamic truncation of an HMAC digest into a 31-bits unsigned int"
+    offset = data[-1] & 0xF
+    return int.from_bytes(data[offset:offset+4]) & 0x7FFFFFFF
 
 
 def generate_totp(secret: str | bytes) -> str:
@@ -56,3 +81,54 @@ def generate_totp(secret: str | bytes) -> str:
     truncated_data = remove_first_bit(truncated_data)
     code = bytes_to_ui(truncated_data) % 1000000
     return padding_6(code)
+
+
+def generate_hotp_many(keys: Iterable[bytes], counter: int) -> list[str]:
+    "Generates codes for already decoded keys, all sharing the same counter"
+    message = ull_to_bytes(counter)
+    digest = hmac.digest
+    return [
+        f'{truncate(digest(key, message, sha1)) % 1000000:06}'
+        for key in keys
+    ]
+
+
+def prime_hmac(key: bytes, algorithm: str = DEFAULT_ALGORITHM) -> hmac.HMAC:
+    "Makes a keyed HMAC object, to be copied for each message"
+    return hmac.new(key, digestmod=ALGORITHMS[algorithm])
+
+
+def make_generator(
+        key: bytes,
+        algorithm: str = DEFAULT_ALGORITHM,
+        digits: int = DEFAULT_DIGITS,
+) -> Callable[[int], str]:
+    "Makes a function generating codes from counters, specialized for the given parameters"
+    if algorithm not in ALGORITHMS:
+        raise ValueError(algorithm)
+    if not 6 <= digits <= 10:
+        raise ValueError(digits)
+
+    primed = prime_hmac(key, algorithm)
+    copy = primed.copy
+
+    if digits == DEFAULT_DIGITS:
+        def generate(counter: int) -> str:
+            mac = copy()
+            mac.update(_pack_counter(counter))
+            return f'{truncate(mac.digest()) % 1000000:06}'
+    else:
+        modulo = 10 ** digits
+        spec = f'0{digits}'
+
+        def generate(counter: int) -> str:
+            mac = copy()
+            mac.update(_pack_counter(counter))
+            return format(truncate(mac.digest()) % modulo, spec)
+
+    return generate
+
+
+def generate_totp_many(secrets: Iterable[str | bytes], at: float | None = None) -> list[str]:
+    "Generates codes for many secrets at once, packing the time step only once"
+    return generate_hotp_many(map(decode_secret, secrets), get_time(at))
@@ -1,7 +1,10 @@
-import socket
+import os
+from contextlib import contextmanager
 
 
 def get_socket_url(sock, *, scheme='http://', resolve=True):
+    import socket
+
     if sock.family is not socket.AF_INET:
         return f'{scheme}{sock.getsockname()}'
 
@@ -10,3 +13,44 @@ def get_socket_url(sock, *, scheme='http://', resolve=True):
         host = socket.gethostbyname(socket.gethostname())
 
     return f'{scheme}{host}:{port}'
+
+
+def lock_file(file):
+    "Takes an exclusive lock on an open file until it is closed, does nothing on platforms without fcntl"
+    try:
+        import fcntl
+    except ImportError:
+        return
+    fcntl.flock(file, fcntl.LOCK_EX)
+
+
+@contextmanager
+def atomic_write(path, mode='w', *, fsync=False):
+    "Opens a temporary file that replaces path once closed, so path is never left half-written"
+    import tempfile
+
+    path = os.fspath(path)
+    directory, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory or None, prefix=f'.{name}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as file:
+            try:
+                os.fchmod(fd, os.stat(path).st_mode)
+            except FileNotFoundError:
+                pass
+            yield file
+            if fsync:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    if fsync:
+        # The rename itself is only durable once the directory is synced
+        dir_fd = os.open(directory or '.', os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
@@ -1,3 +1,5 @@
+import asyncio
+
 import pytest
 from fastapi.testclient import TestClient
 
@@ -73,6 +75,65 @@ def test_index_json(cli, path):
     }
 
 
+@pytest.mark.parametrize('params,keys', [
+    ({'field.foo': 'bar'}, ['site2']),
+    ({'field.foo': 'baz'}, []),
+    ({'field.foo': 'bar', 'field.team': 'ops'}, []),
+])
+def test_index_fields(cli, params, keys):
+    resp = cli.get('/keys', params=params)
+    assert resp.status_code == 200
+    assert list(resp.json()['keys']) == keys
+
+
+@pytest.mark.parametrize('params,keys', [
+    ({'match': 'site*'}, ['site1', 'site2']),
+    ({'match': ['*2', 'site1']}, ['site1', 'site2']),
+    ({'match': 'site1', 'field.foo': 'bar'}, []),
+    ({'match': 'site*', 'field.foo': 'bar'}, ['site2']),
+    ({'after': 'site1'}, ['site2']),
+    ({'after': 'site1', 'field.foo': 'bar'}, ['site2']),
+    ({'limit': 2}, ['site1', 'site2']),
+])
+def test_index_match(cli, params, keys):
+    resp = cli.get('/keys', params=params)
+    assert resp.status_code == 200
+    assert list(resp.json()['keys']) == keys
+    assert '@next' not in resp.json()
+
+
+def test_index_pages(cli, database):
+    database['other'] = {'secret': 'ABABABAB'}
+    resp = cli.get('/keys', params={'match': 'site*', 'limit': 1})
+    assert list(resp.json()['keys']) == ['site1']
+    assert resp.json()['@next'] == {
+        'method': 'GET',
+        'href': f'{URL}/keys?match=site%2A&limit=1&after=site1',
+    }
+
+    resp = cli.get(resp.json()['@next']['href'])
+    assert list(resp.json()['keys']) == ['site2']
+    assert '@next' not in resp.json()
+
+
+def test_index_pages_html(html_cli):
+    resp = html_cli.get('/', params={'limit': 1})
+    assert 'get/site1' in resp.text
+    assert 'get/site2' not in resp.text
+    assert 'after=site1' in resp.text
+
+
+def test_index_wrong_limit(cli):
+    assert cli.get('/keys', params={'limit': 0}).status_code == 422
+
+
+def test_index_fields_html(html_cli):
+    resp = html_cli.get('/', params={'field.foo': 'bar'})
+    assert resp.status_code == 200
+    assert 'get/site1' not in resp.text
+    assert 'get/site2' in resp.text
+
+
 def test_index_html(html_cli):
     resp = html_cli.get('/')
     assert resp.status_code == 200
@@ -127,6 +188,17 @@ def test_get_key_html(html_cli):
     assert 'site1' in resp.text
     assert 'TOTP code: <b>235656</b>' in resp.text
     assert 'site2' not in resp.text
+    assert "new EventSource('/keys/_events?key=site1')" in resp.text
+    assert 'http-equiv="refresh"' not in resp.text
+
+
+def test_get_key_html_no_event_stream(html_cli, app, mocker):
+    mocker.patch.object(app, 'max_event_streams', 0)
+    resp = html_cli.get('/get/site1')
+    assert resp.status_code == 200
+    assert 'EventSource' not in resp.text
+    # The page is reloaded when the code expires
+    assert '<meta http-equiv="refresh" content="24">' in resp.text
 
 
 def test_get_key_html_not_found(html_cli):
@@ -154,6 +226,20 @@ def test_insert_key_json(cli, database, path):
     assert db2['site3'] == database['site3']
 
 
+def test_insert_update_hotp_key(cli, database):
+    resp = cli.post('/keys', json={'key': 'site3', 'secret': 'EFEFEFEF', 'type': 'hotp', 'counter': '1'})
+    assert resp.status_code == 200
+    # Writes do not consume codes of HOTP entries
+    assert resp.json()['code'] is None
+    assert database['site3']['counter'] == '1'
+
+    resp = cli.put('/keys/site3', json={'secret': 'EFEFEFEF', 'type': 'hotp', 'counter': '1', 'foo': 'bar'})
+    assert resp.status_code == 200
+    assert resp.json()['code'] is None
+    assert resp.json()['foo'] == 'bar'
+    assert database['site3']['counter'] == '1'
+
+
 def test_insert_key_json_extra_data(cli, database):
     resp = cli.post('/keys', json={'key': 'site3', 'secret': 'EFEFEFEF', 'extra_key': 'extra_value'})
     assert resp.status_code == 200
@@ -193,6 +279,43 @@ def test_insert_key_json_missing_data(cli, database):
     ]
 
 
+def test_insert_keys_json(cli, database, mocker):
+    save = mocker.spy(database, 'save')
+    resp = cli.post('/keys', json=[
+        {'key': 'site3', 'secret': 'EFEFEFEF', 'foo': 'baz'},
+        {'key': 'site4', 'secret': '0'},
+        {'key': 'site5', 'secret': 'GHGHGHGH', 'digits': '5'},
+        {'key': 'site6', 'secret': 'IJIJIJIJ'},
+    ])
+    assert resp.status_code == 200
+    assert resp.json() == {
+        'imported': 2,
+        'errors': [
+            {'index': 1, 'key': 'site4', 'error': 'Secret is not well-formated'},
+            {'index': 2, 'key': 'site5', 'error': 'Type, algorithm, digits, period or counter is not supported'},
+        ],
+        '@list': {
+            'method': 'GET',
+            'href': f'{URL}/keys',
+        },
+    }
+    save.assert_called_once_with()
+
+    db2 = Database(database.path)
+    db2.load()
+    assert db2['site3'] == {'secret': 'EFEFEFEF', 'foo': 'baz'}
+    assert db2['site6'] == {'secret': 'IJIJIJIJ'}
+    assert 'site4' not in db2
+    assert 'site5' not in db2
+
+
+def test_insert_keys_json_missing_data(cli, database):
+    resp = cli.post('/keys', json=[{'key': 'site3', 'secret': 'EFEFEFEF'}, {'key': 'site4'}])
+    assert resp.status_code == 422
+    assert [(record['type'], record['loc']) for record in resp.json()['detail']] == [('missing', [1, 'secret'])]
+    assert 'site3' not in database
+
+
 def test_insert_key_html(html_cli, database):
     assert 'site3' not in database
 
@@ -309,3 +432,250 @@ def test_update_key_html(html_cli, database):
     }
 
     assert resp.text == html_cli.get('/get/site2').text
+
+
+def test_get_keys_batch(cli, database, mocker):
+    get_codes = mocker.spy(database, 'get_codes')
+    database['other'] = {'secret': 'EFEFEFEF'}
+
+    resp = cli.post('/keys/_batch', json={'keys': ['site2', 'site3', 'site2'], 'patterns': ['site*']})
+    assert resp.status_code == 200
+    assert resp.json() == {
+        'keys': {
+            'site2': {
+                'foo': 'bar',
+                'code': '369886',
+                '@get': {
+                    'method': 'GET',
+                    'href': f'{URL}/keys/site2',
+                },
+            },
+            'site1': {
+                'code': '235656',
+                '@get': {
+                    'method': 'GET',
+                    'href': f'{URL}/keys/site1',
+                },
+            },
+        },
+        'missing': ['site3'],
+        '@list': {
+            'method': 'GET',
+            'href': f'{URL}/keys',
+        },
+    }
+    get_codes.assert_called_once_with(['site2', 'site1'])
+
+
+def test_get_keys_batch_hotp(cli, database):
+    database['site3'] = {'secret': 'EFEFEFEF', 'type': 'hotp', 'counter': '1'}
+    database['site4'] = {'secret': 'EFEFEFEF', 'type': 'hotp', 'counter': '1'}
+
+    resp = cli.post('/keys/_batch', json={'keys': ['site4'], 'patterns': ['*']})
+    assert resp.status_code == 200
+    keys = resp.json()['keys']
+    assert list(keys) == ['site4', 'site1', 'site2', 'site3']
+    # Only named HOTP entries get a code, matching them does not consume one
+    assert keys['site1']['code'] == '235656'
+    assert keys['site3']['code'] is None
+    assert database['site3']['counter'] == '1'
+    assert keys['site4']['code'] is not None
+    assert database['site4']['counter'] == '2'
+
+
+def test_get_keys_batch_empty(cli):
+    resp = cli.post('/keys/_batch', json={})
+    assert resp.status_code == 200
+    assert resp.json()['keys'] == {}
+    assert resp.json()['missing'] == []
+
+
+@pytest.mark.parametrize('format,media_type', [
+    ('jsonl', 'application/x-ndjson'),
+    ('csv', 'text/csv; charset=utf-8'),
+    ('otpauth', 'text/plain; charset=utf-8'),
+])
+def test_export_keys(cli, format, media_type):
+    resp = cli.get('/keys/_export', params={'format': format})
+    assert resp.status_code == 200
+    assert resp.headers['Content-Type'] == media_type
+    assert 'ABABABAB' in resp.text
+    assert 'CDCDCDCD' in resp.text
+
+
+def test_export_keys_wrong_format(cli):
+    resp = cli.get('/keys/_export', params={'format': 'xml'})
+    assert resp.status_code == 422
+
+
+def test_import_keys(cli, database):
+    def content():
+        yield b'{"key": "site3", "secret": "EFEFEFEF"}\n{"key": "si'
+        yield b'te4", "secret": "1"}\n{"key": "site5", "secret": "GHGH\xc3'
+        yield b'\xa9GH"}\n'
+
+    resp = cli.post('/keys/_import', content=content())
+    assert resp.status_code == 200
+    assert resp.json() == {
+        'imported': 1,
+        'errors': [
+            {'line': 2, 'key': 'site4', 'error': 'Secret is not well-formated'},
+            {'line': 3, 'key': 'site5', 'error': 'Secret is not well-formated'},
+        ],
+        '@list': {
+            'method': 'GET',
+            'href': f'{URL}/keys',
+        },
+    }
+    assert database['site3'] == {'secret': 'EFEFEFEF'}
+
+    db2 = Database(database.path)
+    db2.load()
+    assert db2.keys() == {'site1', 'site2', 'site3'}
+
+
+def test_import_keys_otpauth(cli, database):
+    resp = cli.post('/keys/_import', params={'format': 'otpauth'}, content=b'otpauth://totp/site3?secret=EFEFEFEF\n')
+    assert resp.status_code == 200
+    assert resp.json()['imported'] == 1
+    assert database['site3'] == {'secret': 'EFEFEFEF'}
+
+
+def test_code_events(app, database, mocker):
+    from requireris.httpd.app import code_events
+
+    database['site2'] = {'secret': 'CDCDCDCD', 'period': '60'}
+    sleep = mocker.patch('asyncio.sleep')
+    time = mocker.patch('time.time', return_value=123456)
+    events = code_events({'site1': 30, 'site2': 60})
+    runner = asyncio.Runner()
+
+    def read(count):
+        async def read():
+            return [await anext(events) for _ in range(count)]
+        return runner.run(read())
+
+    assert read(3) == [
+        'retry: 1000\n\n',
+        'event: code\ndata: {"key": "site1", "code": "235656", "expires": 123480}\n\n',
+        'event: code\ndata: {"key": "site2", "code": "841947", "expires": 123480}\n\n',
+    ]
+
+    time.return_value = 123481
+    assert read(2) == [
+        'event: code\ndata: {"key": "site1", "code": "856612", "expires": 123510}\n\n',
+        'event: code\ndata: {"key": "site2", "code": "094695", "expires": 123540}\n\n',
+    ]
+    assert sleep.call_args_list == [mocker.call(-1)]
+
+    time.return_value = 123540
+    assert read(2) == [
+        'event: code\ndata: {"key": "site1", "code": "814054", "expires": 123570}\n\n',
+        'event: code\ndata: {"key": "site2", "code": "100790", "expires": 123600}\n\n',
+    ]
+    assert app.db.code_cache_info().misses == 6
+    runner.close()
+
+
+def test_code_events_hotp(app, database, mocker):
+    from requireris.httpd.app import code_events
+
+    database['site3'] = {'secret': 'EFEFEFEF', 'type': 'hotp'}
+    mocker.patch('asyncio.sleep')
+    events = code_events({'site1': 30, 'site3': None})
+
+    async def read():
+        return [await anext(events) for _ in range(2)]
+    assert asyncio.run(read()) == [
+        'retry: 1000\n\n',
+        'event: code\ndata: {"key": "site1", "code": "235656", "expires": 123480}\n\n',
+    ]
+    assert database['site3'] == {'secret': 'EFEFEFEF', 'type': 'hotp'}
+
+
+def test_watch_keys(cli, mocker):
+    mocker.patch('requireris.httpd.app.EVENTS_DURATION', 0)
+    resp = cli.get('/keys/_events', params={'key': ['site1', 'site2']})
+    assert resp.status_code == 200
+    assert resp.headers['Content-Type'] == 'text/event-stream; charset=utf-8'
+    assert resp.text == 'retry: 1000\n\n'
+
+
+@pytest.mark.parametrize('keys,status_code', [
+    (['site1', 'site3'], 404),
+    ([], 422),
+])
+def test_watch_keys_errors(cli, keys, status_code):
+    resp = cli.get('/keys/_events', params={'key': keys})
+    assert resp.status_code == status_code
+
+
+def test_watch_keys_release(cli, app, mocker):
+    mocker.patch('requireris.httpd.app.EVENTS_DURATION', 0)
+    mocker.patch.object(app, 'max_event_streams', 1)
+    for _ in range(2):
+        resp = cli.get('/keys/_events', params={'key': 'site1'})
+        assert resp.status_code == 200
+    assert app.event_streams == 0
+
+
+def test_watch_keys_too_many(cli, app, mocker):
+    mocker.patch.object(app, 'max_event_streams', 0)
+    resp = cli.get('/keys/_events', params={'key': 'site1'})
+    assert resp.status_code == 503
+    assert resp.headers['Retry-After'] == '30'
+    assert app.event_streams == 0
+
+
+def test_watch_hotp_key(cli, database):
+    database['site3'] = {'secret': 'EFEFEFEF', 'type': 'hotp'}
+    resp = cli.get('/keys/_events', params={'key': 'site3'})
+    assert resp.status_code == 422
+    assert database['site3'] == {'secret': 'EFEFEFEF', 'type': 'hotp'}
+
+
+@pytest.mark.parametrize('code,valid', [
+    ('235656', True),
+    ('856612', True),
+    ('000000', False),
+])
+def test_verify_key(cli, code, valid):
+    resp = cli.post('/keys/site1/verify', json={'code': code})
+    assert resp.status_code == 200
+    assert resp.json() == {
+        'valid': valid,
+        '@get': {
+            'method': 'GET',
+            'href': f'{URL}/keys/site1',
+        },
+    }
+
+
+def test_verify_key_replay(cli):
+    assert cli.post('/keys/site1/verify', data={'code': '235656'}).json()['valid']
+    assert not cli.post('/keys/site1/verify', data={'code': '235656'}).json()['valid']
+
+
+def test_verify_key_errors(cli):
+    assert cli.post('/keys/site3/verify', json={'code': '235656'}).status_code == 404
+    assert cli.post('/keys/site1/verify', json={}).status_code == 422
+
+
+def test_metrics(cli, html_cli):
+    cli.get('/keys/site1')
+    cli.get('/keys/unknown')
+    html_cli.get('/keys/site1')
+    cli.post('/keys', json={'key': 'site3', 'secret': 'EFEFEFEF'})
+
+    resp = cli.get('/metrics')
+    assert resp.status_code == 200
+    assert resp.headers['content-type'].startswith('text/plain; version=0.0.4')
+    lines = resp.text.splitlines()
+    assert '# TYPE requireris_http_requests_total counter' in lines
+    assert any(line.startswith('requireris_http_requests_total{method="GET",route="/keys/{key}",status="404"} ') for line in lines)
+    assert any(line.startswith('requireris_http_request_duration_seconds_count{method="POST",route="/keys"} ') for line in lines)
+    for stage in ('codes', 'parse', 'render'):
+        assert any(line.startswith(f'requireris_stage_duration_seconds_count{{stage="{stage}"}} ') for line in lines)
+    assert 'requireris_db_entries 3' in lines
+    assert 'requireris_db_write_duration_seconds_count 1' in lines
+    assert any(line.startswith('requireris_code_cache_misses_total ') for line in lines)
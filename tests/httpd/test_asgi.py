@@ -1,3 +1,6 @@
+import asyncio
+import http.client
+import socket
 import threading
 from http.server import HTTPServer
 
@@ -27,6 +30,7 @@ def url(server):
 @pytest.fixture(scope='session')
 def _test_app(server):
     scope_logs = []
+    disconnects = []
 
     async def app(scope, receive, send):
         scope_logs.append(scope)
@@ -34,6 +38,37 @@ def _test_app(server):
             case ('GET', '/'):
                 await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'Content-Type', b'text/plain')]})
                 await send({'type': 'http.response.body', 'body': b'Index'})
+            case ('GET', '/loop'):
+                loop_id = str(id(asyncio.get_running_loop())).encode()
+                await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+                await send({'type': 'http.response.body', 'body': loop_id})
+            case ('GET', '/stream'):
+                await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+                for part in (b'first,', b'second,', b''):
+                    await send({'type': 'http.response.body', 'body': part, 'more_body': True})
+                await send({'type': 'http.response.body', 'body': b'last'})
+            case ('GET', '/forever'):
+                await receive()
+                await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+                listener = asyncio.ensure_future(receive())
+                while not listener.done():
+                    await send({'type': 'http.response.body', 'body': b'tick\n', 'more_body': True})
+                    await asyncio.sleep(0.01)
+                disconnects.append(listener.result())
+            case ('POST', '/echo'):
+                parts = []
+                more_body = True
+                while more_body:
+                    data = await receive()
+                    parts.append(data['body'])
+                    more_body = data['more_body']
+                await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'X-Parts', str(len(parts)).encode())]})
+                for part in parts:
+                    await send({'type': 'http.response.body', 'body': part, 'more_body': True})
+                await send({'type': 'http.response.body', 'body': b''})
+                assert await receive() == {'type': 'http.disconnect'}
+            case ('GET', '/error'):
+                raise RuntimeError
             case ('GET', '/empty'):
                 await send({'type': 'http.response.start', 'status': 204, 'headers': []})
             case ('POST', '/data'):
@@ -46,6 +81,7 @@ def _test_app(server):
                 await send({'type': 'http.response.body', 'body': b'Not found'})
 
     app.scope_logs = scope_logs
+    app.disconnects = disconnects
     server.app = app
     return app
 
@@ -56,6 +92,7 @@ def test_app(_test_app):
         yield _test_app
     finally:
         _test_app.scope_logs.clear()
+        _test_app.disconnects.clear()
 
 
 @pytest.fixture(scope='session')
@@ -161,3 +198,108 @@ def test_asgi_notfound_write(test_app, url, base_headers, method):
         'query_string': '',
         'headers': [*base_headers, (b'content-length', b'4')],
     }]
+
+
+def test_asgi_event_loop_reused(test_app, url):
+    assert httpx.get(f'{url}/loop').text == httpx.get(f'{url}/loop').text
+
+
+def test_asgi_keep_alive(test_app, server):
+    conn = http.client.HTTPConnection('localhost', server.server_port)
+    conn.request('GET', '/')
+    resp = conn.getresponse()
+    assert resp.version == 11
+    assert resp.read() == b'Index'
+    sock = conn.sock
+
+    conn.request('POST', '/data', body=b'abc', headers={'Content-Type': 'text/plain'})
+    resp = conn.getresponse()
+    assert resp.read() == b'abc'
+
+    conn.request('GET', '/empty')
+    resp = conn.getresponse()
+    assert resp.status == 204
+    assert resp.read() == b''
+
+    conn.request('HEAD', '/notfound')
+    resp = conn.getresponse()
+    assert resp.status == 404
+    assert resp.read() == b''
+
+    conn.request('GET', '/notfound')
+    assert conn.getresponse().read() == b'Not found'
+
+    assert conn.sock is sock
+    assert len(test_app.scope_logs) == 5
+    conn.close()
+
+
+def test_asgi_streaming_response(test_app, url):
+    with httpx.stream('GET', f'{url}/stream') as resp:
+        assert resp.status_code == 200
+        assert resp.headers['Transfer-Encoding'] == 'chunked'
+        assert b''.join(resp.iter_raw()) == b'first,second,last'
+
+
+def test_asgi_chunked_request(test_app, url):
+    def content():
+        yield b'first,'
+        yield b'second'
+
+    resp = httpx.post(f'{url}/echo', content=content())
+    assert resp.status_code == 200
+    assert resp.text == 'first,second'
+    assert resp.headers['X-Parts'] == '3'
+    assert (b'transfer-encoding', b'chunked') in test_app.scope_logs[0]['headers']
+
+
+def test_asgi_streaming_request(test_app, url, mocker):
+    mocker.patch('requireris.httpd.asgi.CHUNK_SIZE', 4)
+    resp = httpx.post(f'{url}/echo', content=b'0123456789')
+    assert resp.text == '0123456789'
+    assert resp.headers['X-Parts'] == '3'
+
+
+def test_asgi_request_without_length(test_app, server):
+    conn = http.client.HTTPConnection('localhost', server.server_port)
+    conn.putrequest('POST', '/echo')
+    conn.endheaders()
+    resp = conn.getresponse()
+    assert resp.read() == b''
+    assert resp.headers['X-Parts'] == '1'
+    conn.close()
+
+
+def test_asgi_client_gone(test_app, server, url):
+    with socket.create_connection(('localhost', server.server_port)) as sock:
+        sock.sendall(b'GET /forever HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        assert sock.recv(1024).startswith(b'HTTP/1.1 200 ')
+    # The server is free again once the application has been told the client left
+    assert httpx.get(url).text == 'Index'
+    assert test_app.disconnects == [{'type': 'http.disconnect'}]
+
+
+def test_asgi_http10(test_app, server):
+    with socket.create_connection(('localhost', server.server_port)) as sock:
+        sock.sendall(b'GET /stream HTTP/1.0\r\n\r\n')
+        response = b''
+        while data := sock.recv(1024):
+            response += data
+
+    assert response.startswith(b'HTTP/1.1 200')
+    assert b'Transfer-Encoding' not in response
+    assert response.endswith(b'\r\n\r\nfirst,second,last')
+
+
+def test_asgi_error(test_app, url):
+    resp = httpx.get(f'{url}/error')
+    assert resp.status_code == 500
+
+
+def test_asgi_no_keep_alive(test_app, server, mocker):
+    mocker.patch.object(server, 'keep_alive', False, create=True)
+    with httpx.Client() as client:
+        resp = client.get(f'http://localhost:{server.server_port}/stream')
+        assert resp.headers['Connection'] == 'close'
+        assert resp.text == 'first,second,last'
+        assert client.get(f'http://localhost:{server.server_port}/').text == 'Index'
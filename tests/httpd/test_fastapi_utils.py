@@ -80,3 +80,68 @@ def test_form_or_json():
     assert cli.post('/model-extra', json={'name': 'test', 'value': 1, 'extra': 'extra'}).json() == {'type': 'DataModelExtra', 'data': {'name': 'test', 'value': 1, 'extra': 'extra'}}
     assert cli.post('/model-extra', data={'name': 'test', 'value': 1}).json() == {'type': 'DataModelExtra', 'data': {'name': 'test', 'value': 1}}
     assert cli.post('/model-extra', data={'name': 'test', 'value': 1, 'extra': 'extra'}).json() == {'type': 'DataModelExtra', 'data': {'name': 'test', 'value': 1, 'extra': 'extra'}}
+
+
+def test_form_or_json_batch():
+    class DataModel(pydantic.BaseModel):
+        name: str
+        value: int
+
+    app = fastapi.FastAPI()
+
+    @app.post('/model')
+    def _model_route(data: Annotated[DataModel, FormOrJSON()]):
+        return {'type': type(data).__name__}
+
+    @app.post('/batch')
+    def _batch_route(data: Annotated[DataModel, FormOrJSON(batch=True)]):
+        return {'type': type(data).__name__, 'data': data}
+
+    cli = TestClient(app)
+
+    assert cli.post('/batch', json={'name': 'test', 'value': 1}).json() == {'type': 'DataModel', 'data': {'name': 'test', 'value': 1}}
+    assert cli.post('/batch', json=[{'name': 'a', 'value': 1}, {'name': 'b', 'value': '2'}]).json() == {
+        'type': 'list',
+        'data': [{'name': 'a', 'value': 1}, {'name': 'b', 'value': 2}],
+    }
+    assert cli.post('/batch', json=[]).json() == {'type': 'list', 'data': []}
+
+    resp = cli.post('/batch', json=[{'name': 'a', 'value': 1}, {'name': 'b'}])
+    assert resp.status_code == 422
+    assert [(e['type'], e['loc']) for e in resp.json()['detail']] == [('missing', [1, 'value'])]
+
+    resp = cli.post('/model', json=[{'name': 'a', 'value': 1}])
+    assert resp.status_code == 422
+    assert [e['type'] for e in resp.json()['detail']] == ['model_type']
+
+
+@pytest.mark.parametrize('body', [b'', b'{"name": ', b'[{"name": "test", "value": 1}'])
+def test_form_or_json_invalid_json(body):
+    class DataModel(pydantic.BaseModel):
+        name: str
+        value: int
+
+    app = fastapi.FastAPI()
+
+    @app.post('/batch')
+    def _batch_route(data: Annotated[DataModel, FormOrJSON(batch=True)]):
+        return {}
+
+    resp = TestClient(app).post('/batch', content=body, headers={'Content-Type': 'application/json'})
+    assert resp.status_code == 422
+    assert [e['type'] for e in resp.json()['detail']] == ['json_invalid']
+
+
+def test_form_or_json_adapter_once(mocker):
+    type_adapter = mocker.spy(pydantic, 'TypeAdapter')
+    app = fastapi.FastAPI()
+
+    @app.post('/dict')
+    def _dict_route(data: Annotated[dict, FormOrJSON()]):
+        return data
+
+    cli = TestClient(app)
+    for _ in range(3):
+        assert cli.post('/dict', json={'abc': 'def'}).json() == {'abc': 'def'}
+        assert cli.post('/dict', data={'abc': 'def'}).json() == {'abc': 'def'}
+    type_adapter.assert_called_once_with(dict)
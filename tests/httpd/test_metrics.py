@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from requireris.database import Database
+from requireris.httpd.metrics import Histogram, Metrics, MetricsMiddleware
+
+
+def test_histogram():
+    histogram = Histogram((0.1, 1))
+    for value in (0.05, 0.1, 0.5, 2):
+        histogram.observe(value)
+    assert list(histogram.render('duration', {'route': '/'})) == [
+        'duration_bucket{route="/",le="0.1"} 2',
+        'duration_bucket{route="/",le="1"} 3',
+        'duration_bucket{route="/",le="+Inf"} 4',
+        'duration_sum{route="/"} 2.65',
+        'duration_count{route="/"} 4',
+    ]
+
+
+def test_metrics_render(tmpdir):
+    metrics = Metrics()
+    metrics.observe_request('GET', '/keys/{key}', 200, 0.002)
+    metrics.observe_request('GET', '/keys/{key}', 200, 0.003)
+    metrics.observe_request('GET', '/say "hi"', 404, 0.001)
+    with metrics.time('render'):
+        pass
+
+    db = Database(tmpdir / 'requireris.db', site1={'secret': 'ABABABAB'})
+    db.get_code('site1')
+    db.get_code('site1')
+    db.save()
+
+    lines = metrics.render(db).splitlines()
+    assert 'requireris_http_requests_total{method="GET",route="/keys/{key}",status="200"} 2' in lines
+    assert 'requireris_http_requests_total{method="GET",route="/say \\"hi\\"",status="404"} 1' in lines
+    assert 'requireris_http_request_duration_seconds_bucket{method="GET",route="/keys/{key}",le="0.0025"} 1' in lines
+    assert 'requireris_http_request_duration_seconds_count{method="GET",route="/keys/{key}"} 2' in lines
+    assert 'requireris_stage_duration_seconds_count{stage="render"} 1' in lines
+    assert 'requireris_db_entries 1' in lines
+    assert f'requireris_db_size_bytes {(tmpdir / "requireris.db").size()}' in lines
+    assert 'requireris_db_write_duration_seconds_count 1' in lines
+    assert 'requireris_code_cache_hits_total 1' in lines
+    assert 'requireris_code_cache_misses_total 1' in lines
+    assert 'requireris_code_cache_size 1' in lines
+    assert 'requireris_db_entries' not in Metrics().render()
+
+
+@pytest.mark.parametrize('fail', [False, True])
+def test_middleware(mocker, fail):
+    metrics = Metrics()
+    observe = mocker.spy(metrics, 'observe_request')
+    sent = []
+
+    async def app(scope, receive, send):
+        scope['route'] = mocker.Mock(path='/keys/{key}')
+        if fail:
+            raise RuntimeError
+        await send({'type': 'http.response.start', 'status': 204})
+        await send({'type': 'http.response.body'})
+
+    async def send(message):
+        sent.append(message)
+
+    middleware = MetricsMiddleware(app, metrics)
+    scope = {'type': 'http', 'method': 'DELETE', 'path': '/keys/site1'}
+    if fail:
+        with pytest.raises(RuntimeError):
+            asyncio.run(middleware(scope, None, send))
+    else:
+        asyncio.run(middleware(scope, None, send))
+        assert [message['type'] for message in sent] == ['http.response.start', 'http.response.body']
+    observe.assert_called_once_with('DELETE', '/keys/{key}', 500 if fail else 204, mocker.ANY)
@@ -1,7 +1,7 @@
 import pydantic
 import pytest
 
-from requireris.httpd.schemas import InsertData, UpdateData
+from requireris.httpd.schemas import BatchQuery, InsertData, UpdateData
 
 
 def test_insert_data():
@@ -38,3 +38,8 @@ def test_update_data_no_values():
 def test_update_data_extra_values():
     schema = UpdateData(secret='AAAAAAAA', foo='bar', baz='spam')
     assert schema.model_dump() == {'secret': 'AAAAAAAA', 'foo': 'bar', 'baz': 'spam'}
+
+
+def test_batch_query():
+    assert BatchQuery().model_dump() == {'keys': [], 'patterns': []}
+    assert BatchQuery(keys=['site1'], patterns=['site*']).model_dump() == {'keys': ['site1'], 'patterns': ['site*']}
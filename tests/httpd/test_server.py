@@ -0,0 +1,122 @@
+import asyncio
+import http.client
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pytest
+
+from requireris.httpd.asgi import ASGIRequestHandler
+from requireris.httpd.server import PooledHTTPServer
+
+
+@pytest.fixture
+def server():
+    server = PooledHTTPServer(('localhost', 0), ASGIRequestHandler, threads=4)
+    barrier = threading.Barrier(4, timeout=5)
+    threads = set()
+
+    async def app(scope, receive, send):
+        # Only returns once 4 requests are handled at the same time
+        await asyncio.to_thread(barrier.wait)
+        threads.add(threading.current_thread().name)
+        await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b'OK'})
+
+    server.app = app
+    server.app_threads = threads
+    thread = threading.Thread(target=server.serve_forever)
+    try:
+        thread.start()
+        yield server
+    finally:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+
+
+def test_pooled_server_concurrency(server):
+    url = f'http://localhost:{server.server_port}'
+    with ThreadPoolExecutor(4) as executor:
+        responses = list(executor.map(lambda _: httpx.get(url), range(4)))
+
+    assert [resp.text for resp in responses] == ['OK'] * 4
+    assert len(server.app_threads) == 4
+    assert all(name.startswith('requireris-http') for name in server.app_threads)
+
+
+@pytest.fixture
+def single_thread_server():
+    server = PooledHTTPServer(('localhost', 0), ASGIRequestHandler, threads=1)
+
+    async def app(scope, receive, send):
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'Content-Length', b'2')]})
+        await send({'type': 'http.response.body', 'body': b'OK'})
+
+    server.app = app
+    thread = threading.Thread(target=server.serve_forever)
+    try:
+        thread.start()
+        yield server
+    finally:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+
+
+def test_pooled_server_saturated(single_thread_server):
+    first = http.client.HTTPConnection('localhost', single_thread_server.server_port)
+    first.request('GET', '/')
+    resp = first.getresponse()
+    assert resp.read() == b'OK'
+    assert resp.headers['Connection'] is None
+
+    # The only thread is held by the first connection, the second one waits for it
+    second = http.client.HTTPConnection('localhost', single_thread_server.server_port)
+    second.connect()
+    deadline = time.monotonic() + 5
+    while not single_thread_server.saturated and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert single_thread_server.saturated
+
+    first.request('GET', '/')
+    resp = first.getresponse()
+    assert resp.read() == b'OK'
+    assert resp.headers['Connection'] == 'close'
+
+    second.request('GET', '/')
+    assert second.getresponse().read() == b'OK'
+    first.close()
+    second.close()
+
+
+def test_idle_timeout(single_thread_server, mocker):
+    mocker.patch.object(ASGIRequestHandler, 'idle_timeout', 0.1)
+    log_error = mocker.spy(ASGIRequestHandler, 'log_error')
+    with socket.create_connection(('localhost', single_thread_server.server_port)) as sock:
+        sock.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        response = b''
+        while not response.endswith(b'OK'):
+            response += sock.recv(1024)
+        assert response.startswith(b'HTTP/1.1 200 OK\r\n')
+        # The server closes the idle connection instead of holding its only thread
+        sock.settimeout(5)
+        assert sock.recv(1024) == b''
+    log_error.assert_not_called()
+
+
+def test_request_timeout(single_thread_server, mocker):
+    mocker.patch.object(ASGIRequestHandler, 'idle_timeout', 5)
+    mocker.patch.object(ASGIRequestHandler, 'timeout', 0.1)
+    log_error = mocker.spy(ASGIRequestHandler, 'log_error')
+    with socket.create_connection(('localhost', single_thread_server.server_port)) as sock:
+        # Requests in progress still time out, and are logged
+        sock.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\nGET')
+        sock.settimeout(5)
+        response = b''
+        while chunk := sock.recv(1024):
+            response += chunk
+        assert response.startswith(b'HTTP/1.1 200 OK\r\n')
+    log_error.assert_called_once_with(mocker.ANY, 'Request timed out: %r', mocker.ANY)
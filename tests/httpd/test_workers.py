@@ -0,0 +1,154 @@
+import asyncio
+import signal
+import subprocess
+import sys
+
+import httpx
+import pytest
+
+from requireris.database import Database, JournalDatabase
+from requireris.httpd.workers import SharedDatabaseApp, serve_workers
+
+
+@pytest.fixture
+def database(tmp_path):
+    db = JournalDatabase(tmp_path / 'requireris.db', site1={'secret': 'ABABABAB'})
+    db.save()
+    db.load(lazy=True)
+    return db
+
+
+class App:
+    def __init__(self, db):
+        self.db = db
+        self.dbs = []
+
+    async def __call__(self, scope, receive, send):
+        self.dbs.append(self.db)
+
+
+def test_shared_database_app(database):
+    app = App(database)
+    shared_app = SharedDatabaseApp(app)
+
+    asyncio.run(shared_app({}, None, None))
+    assert app.dbs == [database]
+
+    other = JournalDatabase(database.path)
+    other.load()
+    other['site2'] = {'secret': 'CDCDCDCD'}
+    other.save()
+
+    asyncio.run(shared_app({}, None, None))
+    asyncio.run(shared_app({}, None, None))
+    new_db = app.db
+    assert new_db is not database
+    assert app.dbs == [database, new_db, new_db]
+    assert type(new_db) is JournalDatabase
+    assert new_db.keys() == {'site1', 'site2'}
+
+
+def test_shared_database_app_own_write(database):
+    app = App(database)
+    shared_app = SharedDatabaseApp(app)
+    database['site2'] = {'secret': 'CDCDCDCD'}
+    database.save()
+
+    asyncio.run(shared_app({}, None, None))
+    assert app.db is database
+
+
+@pytest.mark.parametrize('backend', [Database, JournalDatabase])
+def test_shared_database_app_lost_update(database, backend, mocker):
+    # Two workers having their own instance of the database, with delayed saves
+    mocker.patch.object(backend, 'save_delay', 60)
+    apps = []
+    for _ in range(2):
+        db = backend(database.path)
+        db.load(lazy=True)
+        apps.append(App(db))
+    first, second = apps
+    try:
+        first.db['site2'] = {'secret': 'CDCDCDCD'}
+        first.db.save()
+        second.db['site3'] = {'secret': 'EFEFEFEF'}
+        second.db.save()
+        second.db.flush()
+
+        # The first worker writes its pending change when noticing the other one
+        asyncio.run(SharedDatabaseApp(first)({}, None, None))
+        assert first.db.keys() == {'site1', 'site2', 'site3'}
+        asyncio.run(SharedDatabaseApp(second)({}, None, None))
+        assert second.db.keys() == {'site1', 'site2', 'site3'}
+
+        db = backend(database.path)
+        db.load()
+        assert db.keys() == {'site1', 'site2', 'site3'}
+    finally:
+        for app in apps:
+            app.db.flush()
+
+
+
+def test_serve_workers_failing(mocker):
+    pids = iter(range(100, 200))
+    fork = mocker.patch('os.fork', side_effect=lambda: next(pids))
+    # Each worker fails right after its start
+    mocker.patch('os.wait', side_effect=lambda: (fork.call_count + 99, 256))
+    kill = mocker.patch('os.kill')
+    mocker.patch('os.waitpid')
+    sleep = mocker.patch('time.sleep')
+
+    with pytest.raises(SystemExit):
+        serve_workers(None, None, 2)
+    assert fork.call_count == 6
+    assert sleep.call_args_list == [mocker.call(0.5), mocker.call(1), mocker.call(2), mocker.call(4)]
+    # Workers still running are stopped
+    kill.assert_called_once_with(100, signal.SIGTERM)
+
+
+def test_serve_workers_respawn(mocker):
+    pids = iter(range(100, 200))
+    fork = mocker.patch('os.fork', side_effect=lambda: next(pids))
+    mocker.patch('os.wait', side_effect=[(100, 256), (101, 0), (102, 0)])
+    # The failed worker ran for a minute, it is started again right away
+    mocker.patch('time.monotonic', side_effect=[0, 0, 60, 60])
+    sleep = mocker.patch('time.sleep')
+
+    serve_workers(None, None, 2)
+    assert fork.call_count == 3
+    sleep.assert_not_called()
+
+
+@pytest.mark.parametrize('backend', ['ini', 'journal', 'sqlite'])
+def test_workers(tmp_path, backend):
+    process = subprocess.Popen(
+        [
+            sys.executable, '-m', 'requireris',
+            '--db-path', str(tmp_path / 'requireris.db'),
+            '--db-backend', backend,
+            '--no-agent',
+            'http', '--port', '0', '--workers', '3',
+        ],
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        line = process.stderr.readline()
+        url = line.rsplit(' ', 1)[1].strip()
+
+        resp = httpx.post(f'{url}/keys', json={'key': 'site1', 'secret': 'ABABABAB'})
+        assert resp.status_code == 200
+        # Each request is a new connection, handled by any of the workers
+        for _ in range(10):
+            assert httpx.get(f'{url}/keys/site1').status_code == 200
+
+        httpx.put(f'{url}/keys/site1', json={'secret': 'ABABABAB', 'foo': 'bar'})
+        for _ in range(10):
+            assert httpx.get(f'{url}/keys/site1').json()['foo'] == 'bar'
+    finally:
+        process.send_signal(signal.SIGINT)
+        process.wait(timeout=10)
+        process.stderr.close()
+
+    assert process.returncode == 0
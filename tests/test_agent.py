@@ -0,0 +1,146 @@
+import os
+import socket
+import stat
+import threading
+
+import pytest
+
+from requireris.agent import AgentError, AgentServer, connect
+from requireris.database import Database, JournalDatabase
+from requireris.exceptions import WrongSecret
+
+
+@pytest.fixture
+def database(tmp_path):
+    db = JournalDatabase(tmp_path / 'requireris.db')
+    db['site1'] = {'secret': 'ABABABAB'}
+    db['site2'] = {'secret': 'CDCDCDCD', 'foo': 'bar'}
+    db.save()
+    db.load(lazy=True)
+    return db
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    return tmp_path / 'agent.sock'
+
+
+@pytest.fixture
+def agent(database, socket_path):
+    server = AgentServer(socket_path, database)
+    thread = threading.Thread(target=server.serve_forever, args=(0.01,))
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+@pytest.fixture
+def client(agent, database, socket_path):
+    client = connect(socket_path, database.path)
+    yield client
+    client.close()
+
+
+def test_agent_socket(agent, socket_path):
+    assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+
+
+def test_list(client):
+    assert client.keys() == ['site1', 'site2']
+    assert len(client) == 2
+    assert 'site1' in client
+    assert 'site3' not in client
+
+
+def test_get(client, database, mocker):
+    mocker.patch('time.time', return_value=123456)
+    assert client['site2'] == {'foo': 'bar'}
+    assert client.get_code('site1') == '235656'
+    with pytest.raises(KeyError):
+        client['site3']
+    with pytest.raises(KeyError):
+        client.get_code('site3')
+
+
+def test_add(client, database):
+    client['site3'] = {'secret': 'EFEFEFEF'}
+    client.save()
+    assert client.keys() == ['site1', 'site2', 'site3']
+
+    db = JournalDatabase(database.path)
+    db.load()
+    assert db['site3'] == {'secret': 'EFEFEFEF'}
+
+    with pytest.raises(WrongSecret):
+        client['site4'] = {'secret': '1'}
+
+
+def test_reload(client, database):
+    assert client['site2'] == {'foo': 'bar'}
+
+    other = JournalDatabase(database.path)
+    other.load()
+    other['site2'] = {'secret': 'CDCDCDCD', 'foo': 'baz'}
+    del other['site1']
+    other.save()
+
+    assert client['site2'] == {'foo': 'baz'}
+    assert client.keys() == ['site2']
+
+
+def test_connect_missing(database, socket_path):
+    assert connect(socket_path, database.path) is None
+
+
+def test_connect_other_database(agent, socket_path, tmp_path):
+    assert connect(socket_path, tmp_path / 'other.db') is None
+
+
+def test_stale_socket(database, socket_path):
+    with socket.socket(socket.AF_UNIX) as sock:
+        sock.bind(os.fspath(socket_path))
+    assert connect(socket_path, database.path) is None
+
+    server = AgentServer(socket_path, database)
+    server.server_close()
+    assert not socket_path.exists()
+
+
+def test_agent_already_running(agent, database, socket_path):
+    with pytest.raises(AgentError):
+        AgentServer(socket_path, Database(database.path))
+
+
+def test_find(client):
+    assert client.find({'foo': 'bar'}) == ['site2']
+    assert client.find({'foo': 'baz'}) == []
+
+
+def test_match(client):
+    assert client.match(['site*']) == ['site1', 'site2']
+    assert client.match(['*2']) == ['site2']
+
+
+def test_verify(client, database):
+    code = database.get_code('site1')
+    assert client.verify('site1', code)
+    assert not client.verify('site1', code)
+    with pytest.raises(KeyError):
+        client.verify('site3', code)
+
+
+def test_encrypt_with_agent(agent, database, socket_path, monkeypatch, caplog):
+    from requireris.__main__ import encrypt_secrets
+
+    monkeypatch.setenv('REQUIRERIS_PASSPHRASE', 'passphrase')
+    db = JournalDatabase(database.path)
+    db.load()
+    encrypt_secrets(db, db_path=database.path, agent_socket=socket_path)
+    assert 'An agent is running' in caplog.text
+    assert db.cipher is None
+    assert not os.path.exists(f'{database.path}.crypt')
+    assert database['site1'] == {'secret': 'ABABABAB'}
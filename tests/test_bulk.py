@@ -0,0 +1,177 @@
+import textwrap
+
+import pytest
+
+from requireris.bulk import (
+    RowError,
+    export_entries,
+    guess_format,
+    import_entries,
+    insert_entries,
+    parse_csv,
+    parse_jsonl,
+    parse_otpauth,
+)
+from requireris.crypto import SecretCipher
+from requireris.database import Database, SqliteDatabase
+
+
+@pytest.fixture
+def database(tmpdir):
+    return Database(
+        tmpdir / 'requireris.db',
+        site1={
+            'secret': 'ABCDEFGHIJKLMNOP',
+        },
+        site2={
+            'secret': 'ZYXWVUTSRQPONMLK',
+            'type': 'hotp',
+            'counter': '3',
+            'issuer': 'Example Corp',
+        },
+    )
+
+
+def _results(rows):
+    return [
+        (number, key, item if isinstance(item, dict) else ValueError if isinstance(item, ValueError) else item)
+        for number, key, item in rows
+    ]
+
+
+def test_parse_jsonl():
+    lines = [
+        '{"key": "site1", "secret": "ABCDEFGH"}\n',
+        '\n',
+        '{"key": "site2", "secret": "ABABABAB", "digits": 8}\n',
+        '{"secret": "ABABABAB"}\n',
+        '["site3"]\n',
+        '{"key": "site4", \n',
+    ]
+    assert _results(parse_jsonl(lines)) == [
+        (1, 'site1', {'secret': 'ABCDEFGH'}),
+        (3, 'site2', {'secret': 'ABABABAB', 'digits': '8'}),
+        (4, None, ValueError),
+        (5, None, ValueError),
+        (6, None, ValueError),
+    ]
+
+
+def test_parse_csv():
+    lines = textwrap.dedent('''
+    key,secret,issuer
+    site1,ABCDEFGH,
+    site2,ABABABAB,Example
+    ,ABABABAB,Example
+    ''').lstrip().splitlines(keepends=True)
+    assert _results(parse_csv(lines)) == [
+        (2, 'site1', {'secret': 'ABCDEFGH'}),
+        (3, 'site2', {'secret': 'ABABABAB', 'issuer': 'Example'}),
+        (4, None, ValueError),
+    ]
+
+
+def test_parse_otpauth():
+    lines = [
+        'otpauth://totp/Example:alice%40example.com?secret=ABCDEFGH&issuer=Example\n',
+        'otpauth://hotp/site2?secret=ABABABAB&counter=3&algorithm=SHA256&digits=8\n',
+        '\n',
+        'https://example.com/site3?secret=ABABABAB\n',
+    ]
+    assert _results(parse_otpauth(lines)) == [
+        (1, 'Example:alice@example.com', {'secret': 'ABCDEFGH', 'issuer': 'Example'}),
+        (2, 'site2', {'type': 'hotp', 'secret': 'ABABABAB', 'counter': '3', 'algorithm': 'sha256', 'digits': '8'}),
+        (4, None, ValueError),
+    ]
+
+
+@pytest.mark.parametrize('format', ['jsonl', 'csv', 'otpauth'])
+def test_export_import(database, tmpdir, format):
+    lines = list(export_entries(database, format))
+
+    db2 = Database(tmpdir / 'other.db')
+    assert import_entries(db2, ''.join(lines).splitlines(keepends=True), format) == (2, [])
+    assert dict(db2) == dict(database)
+
+
+def test_export_encrypted(database, tmpdir):
+    database.cipher = SecretCipher.create(tmpdir / 'requireris.db.crypt', 'passphrase', n=2 ** 10)
+    database['site1'] = database['site1']
+    assert database['site1']['secret'] != 'ABCDEFGHIJKLMNOP'
+    assert ''.join(export_entries(database, 'jsonl')).startswith('{"key": "site1", "secret": "ABCDEFGHIJKLMNOP"}\n')
+
+
+def test_export_formats(database):
+    assert ''.join(export_entries(database, 'jsonl')) == (
+        '{"key": "site1", "secret": "ABCDEFGHIJKLMNOP"}\n'
+        '{"key": "site2", "secret": "ZYXWVUTSRQPONMLK", "type": "hotp", "counter": "3", "issuer": "Example Corp"}\n'
+    )
+    assert ''.join(export_entries(database, 'csv')) == (
+        'key,secret,type,counter,issuer\r\n'
+        'site1,ABCDEFGHIJKLMNOP,,,\r\n'
+        'site2,ZYXWVUTSRQPONMLK,hotp,3,Example Corp\r\n'
+    )
+    assert ''.join(export_entries(database, 'otpauth')) == (
+        'otpauth://totp/site1?secret=ABCDEFGHIJKLMNOP\n'
+        'otpauth://hotp/site2?secret=ZYXWVUTSRQPONMLK&counter=3&issuer=Example%20Corp\n'
+    )
+
+
+def test_import_errors(database, mocker):
+    write = mocker.spy(database, '_write')
+    lines = [
+        '{"key": "site3", "secret": "EFEFEFEF"}\n',
+        '{"key": "site4"}\n',
+        '{"key": "site5", "secret": "123456"}\n',
+        '{"key": "site6", "secret": "EFEFEFEF", "digits": "4"}\n',
+        'not json\n',
+        '{"key": "site1", "secret": "EFEFEFEF"}\n',
+    ]
+
+    imported, errors = import_entries(database, lines)
+    assert imported == 2
+    assert [error[:2] for error in errors] == [(2, 'site4'), (3, 'site5'), (4, 'site6'), (5, None)]
+    assert all(isinstance(error, RowError) and error.error for error in errors)
+
+    assert database.keys() == {'site1', 'site2', 'site3'}
+    assert database['site1'] == {'secret': 'EFEFEFEF'}
+    write.assert_called_once()
+
+
+def test_import_nothing(database, mocker):
+    write = mocker.spy(database, '_write')
+    assert import_entries(database, ['{"key": "site4"}\n']) == (0, [RowError(1, 'site4', 'Missing secret')])
+    write.assert_not_called()
+
+
+@pytest.mark.parametrize('filename,expected', [
+    ('keys.csv', 'csv'),
+    ('keys.txt', 'otpauth'),
+    ('keys.jsonl', 'jsonl'),
+    ('<stdin>', 'jsonl'),
+])
+def test_guess_format(filename, expected):
+    assert guess_format(filename) == expected
+
+
+def test_import_sqlite(tmpdir):
+    path = tmpdir / 'requireris.sqlite'
+    db = SqliteDatabase(path)
+    db.load(missing_ok=True)
+    other = SqliteDatabase(path)
+    other.load()
+
+    rows = [(number, f'site{number}', {'secret': 'ABCDEFGH'}) for number in range(1, 11)]
+    assert insert_entries(db, rows) == (10, [])
+    assert len(other) == 10
+
+    def failing_rows():
+        yield 1, 'site11', {'secret': 'ABCDEFGH'}
+        raise OSError
+
+    # Rows are inserted in a single transaction, none is left on error
+    with pytest.raises(OSError):
+        insert_entries(db, failing_rows())
+    assert 'site11' not in db
+    assert 'site11' not in other
+    assert len(db) == 10
@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from requireris.crypto import SEALED_PREFIX, SecretCipher
+from requireris.exceptions import WrongPassphrase
+
+
+@pytest.fixture
+def params_file(tmpdir):
+    path = tmpdir / 'requireris.db.crypt'
+    SecretCipher.create(path, 'passphrase', n=2 ** 10)
+    return path
+
+
+def test_create(params_file):
+    params = json.loads(params_file.read_text('utf-8'))
+    assert params.keys() == {'kdf', 'salt', 'n', 'r', 'p', 'check'}
+    assert params['kdf'] == 'scrypt'
+    assert params['n'] == 2 ** 10
+
+
+def test_seal(params_file):
+    cipher = SecretCipher(params_file, lambda: 'passphrase')
+    sealed = cipher.seal('site1', 'ABCDEFGHIJKLMNOP')
+    assert sealed.startswith(SEALED_PREFIX)
+    assert 'ABCDEFGHIJKLMNOP' not in sealed
+    assert cipher.seal('site1', 'ABCDEFGHIJKLMNOP') != sealed
+    assert SecretCipher.is_sealed(sealed)
+    assert not SecretCipher.is_sealed('ABCDEFGHIJKLMNOP')
+
+    other = SecretCipher(params_file, lambda: 'passphrase')
+    assert other.open('site1', sealed) == 'ABCDEFGHIJKLMNOP'
+    with pytest.raises(ValueError):
+        other.open('site2', sealed)
+    with pytest.raises(ValueError):
+        other.open('site1', sealed[:-4] + 'AAA=')
+
+
+def test_unlock_once(params_file, mocker):
+    get_passphrase = mocker.Mock(return_value='passphrase')
+    cipher = SecretCipher(params_file, get_passphrase)
+    get_passphrase.assert_not_called()
+
+    sealed = cipher.seal('site1', 'ABCDEFGHIJKLMNOP')
+    cipher.open('site1', sealed)
+    cipher.unlock()
+    get_passphrase.assert_called_once_with()
+
+
+def test_wrong_passphrase(params_file):
+    cipher = SecretCipher(params_file, lambda: 'wrong')
+    with pytest.raises(WrongPassphrase):
+        cipher.unlock()
+    with pytest.raises(WrongPassphrase):
+        cipher.seal('site1', 'ABCDEFGHIJKLMNOP')
@@ -1,9 +1,18 @@
+import base64
+import os
+from configparser import ConfigParser
+from pathlib import Path
 import textwrap
+import threading
 
 import pytest
 
-from requireris.database import Database
-from requireris.exceptions import MissingSecret, WrongSecret
+from requireris import database as database_module
+from requireris import section_index
+from requireris.crypto import SEALED_PREFIX, SecretCipher
+from requireris.database import Database, JournalDatabase, SqliteDatabase, detect_backend
+from requireris.exceptions import MissingSecret, WrongParameter, WrongPassphrase, WrongSecret
+from requireris.totp import generate_totp, generate_totp_many
 
 
 @pytest.fixture
@@ -227,3 +236,962 @@ def test_save_empty(tmpdir):
     assert path.exists()
 
     assert path.read_text('utf-8') == ''
+
+
+def test_get_code(database, mocker):
+    mocker.patch('time.time', return_value=123456.789)
+    assert database.get_code('site1') == '258941'
+    assert database.get_code('site1', at=9876543.21) == '197309'
+    assert database.get_codes(['site1', 'site2', 'site1']) == ['258941', generate_totp('ZYXWVUTSRQPONMLK'), '258941']
+
+    with pytest.raises(KeyError):
+        database.get_code('site3')
+
+
+def test_get_code_sync(database, mocker):
+    mocker.patch('time.time', return_value=123456.789)
+    assert database.get_code('site1') == '258941'
+
+    database['site1'] = {'secret': 'AAAAAAAAAAAAAAAA'}
+    assert database.get_code('site1') == '291914'
+
+    del database['site1']
+    with pytest.raises(KeyError):
+        database.get_code('site1')
+
+    database['site1'] = {'secret': 'ABCDEFGHIJKLMNOP'}
+    assert database.get_code('site1') == '258941'
+
+
+def test_get_code_load(database, config_file):
+    database.get_code('site1')
+    database.load()
+
+    with pytest.raises(WrongSecret) as e:
+        database.get_code('site1')
+    assert e.value.args == ('site1',)
+
+
+def test_code_cache(database, mocker):
+    time = mocker.patch('time.time', return_value=123456.789)
+    # Codes are generated by the functions made for each entry, they are
+    # wrapped to count their calls
+    generators = []
+    make_generator = database_module.make_generator
+
+    def make_spied_generator(*args):
+        generators.append(mocker.Mock(wraps=make_generator(*args)))
+        return generators[-1]
+
+    mocker.patch.object(database_module, 'make_generator', side_effect=make_spied_generator)
+    assert database.code_cache_info() == (0, 0, 0)
+
+    assert database.get_code('site1') == '258941'
+    assert database.get_code('site1') == '258941'
+    assert database.get_codes(['site1', 'site2']) == ['258941', generate_totp('ZYXWVUTSRQPONMLK')]
+    assert database.code_cache_info() == (2, 2, 2)
+    assert sum(generate.call_count for generate in generators) == 2
+
+    time.return_value = 9876543.21
+    assert database.get_code('site1') == '197309'
+    assert database.code_cache_info() == (2, 3, 2)
+
+    database['site1'] = {'secret': 'AAAAAAAAAAAAAAAA'}
+    assert database.code_cache_info() == (2, 3, 1)
+    assert database.get_code('site1') == generate_totp('AAAAAAAAAAAAAAAA')
+    assert database.code_cache_info() == (2, 4, 2)
+
+    del database['site2']
+    assert database.code_cache_info() == (2, 4, 1)
+
+
+@pytest.mark.parametrize(
+    'params,current_time,expected',
+    [
+        # RFC 6238 appendix B test values
+        ({'algorithm': 'sha1', 'digits': '8'}, 59, '94287082'),
+        ({'algorithm': 'SHA256', 'digits': '8'}, 59, '46119246'),
+        ({'algorithm': 'sha512', 'digits': 8}, 59, '90693936'),
+        ({'algorithm': 'sha1', 'digits': '8'}, 1111111109, '07081804'),
+        ({'algorithm': 'sha256', 'digits': '8'}, 1111111109, '68084774'),
+        ({'algorithm': 'sha512', 'digits': '8'}, 1111111109, '25091201'),
+        ({'algorithm': 'sha1', 'digits': '8'}, 20000000000, '65353130'),
+        ({}, 59, '287082'),
+        ({'period': '60'}, 59, '755224'),
+        ({'period': '60', 'digits': '10'}, 60, '1094287082'),
+    ],
+)
+def test_get_code_parameters(mocker, params, current_time, expected):
+    mocker.patch('time.time', return_value=current_time)
+    seeds = {
+        'sha1': b'12345678901234567890',
+        'sha256': b'12345678901234567890123456789012',
+        'sha512': b'1234567890123456789012345678901234567890123456789012345678901234',
+    }
+    seed = seeds[str(params.get('algorithm', 'sha1')).lower()]
+    db = Database()
+    db['site'] = {'secret': base64.b32encode(seed).decode(), **params}
+    assert db.get_code('site') == expected
+
+
+@pytest.mark.parametrize(
+    'params',
+    [
+        {'algorithm': 'md5'},
+        {'digits': '5'},
+        {'digits': '11'},
+        {'digits': 'eight'},
+        {'period': '0'},
+        {'period': '-30'},
+    ],
+)
+def test_wrong_parameter(database, params):
+    with pytest.raises(WrongParameter) as e:
+        database['site3'] = {'secret': 'ABCDEFGH', **params}
+
+    assert e.value.args == ('site3',)
+    assert database.keys() == {'site1', 'site2'}
+
+
+def test_hotp(database):
+    # RFC 4226 appendix D test values
+    database['site3'] = {'secret': base64.b32encode(b'12345678901234567890').decode(), 'type': 'hotp'}
+    assert [database.get_code('site3') for _ in range(3)] == ['755224', '287082', '359152']
+    assert database['site3']['counter'] == '3'
+    assert database.get_codes(['site3', 'site3']) == ['969429', '338314']
+    assert database['site3']['counter'] == '5'
+    assert database.code_cache_info().currsize == 0
+
+    database['site4'] = {'secret': base64.b32encode(b'12345678901234567890').decode(), 'type': 'HOTP', 'counter': '9', 'digits': '8'}
+    assert database.get_code('site4') == '45520489'
+
+
+@pytest.mark.parametrize(
+    'params',
+    [
+        {'type': 'motp'},
+        {'type': 'hotp', 'counter': '-1'},
+        {'type': 'hotp', 'counter': 'abc'},
+    ],
+)
+def test_hotp_wrong_parameter(database, params):
+    with pytest.raises(WrongParameter):
+        database['site3'] = {'secret': 'ABCDEFGH', **params}
+
+
+def test_hotp_journal(database):
+    database['site3'] = {'secret': base64.b32encode(b'12345678901234567890').decode(), 'type': 'hotp'}
+    database.save()
+    content = database.path.read_text('utf-8')
+    journal_path = database._journal.path
+
+    assert database.get_code('site3') == '755224'
+    assert database.get_code('site3') == '287082'
+
+    # Counter increments are only appended to the journal
+    assert database.path.read_text('utf-8') == content
+    assert journal_path.read_text() == (
+        '{"op":"counter","key":"site3","value":1}\n'
+        '{"op":"counter","key":"site3","value":2}\n'
+    )
+
+    db2 = Database(database.path)
+    db2.load()
+    assert db2['site3']['counter'] == '2'
+    assert db2.get_code('site3') == '359152'
+
+    database.save()
+    assert not journal_path.exists()
+    assert 'counter = 2' in database.path.read_text('utf-8')
+
+
+def test_hotp_journal_compaction(database, mocker):
+    mocker.patch.object(Database, 'journal_threshold', 3)
+    database['site3'] = {'secret': base64.b32encode(b'12345678901234567890').decode(), 'type': 'hotp'}
+    journal_path = database._journal.path
+
+    database.get_code('site3')
+    database.get_code('site3')
+    assert not database.path.exists()
+    assert len(journal_path.read_text().splitlines()) == 2
+
+    database.get_code('site3')
+    assert not journal_path.exists()
+    assert 'counter = 3' in database.path.read_text('utf-8')
+
+    database.get_code('site3')
+    db2 = Database(database.path)
+    db2.load()
+    assert db2['site3']['counter'] == '4'
+
+
+def test_journal_database(database, config_file):
+    db = JournalDatabase(config_file)
+    db.load()
+    content = config_file.read_text('utf-8')
+    journal_path = db._journal.path
+
+    db['site2'] = {'secret': 'ZYXWVUTSRQPONMLK', 'key': 'value'}
+    del db['site1']
+    db['site3'] = {'secret': 'ABCDEFGH', 'comment': 'updated'}
+    db.save()
+
+    # Changes are only appended to the journal
+    assert config_file.read_text('utf-8') == content
+    assert len(journal_path.read_text().splitlines()) == 3
+
+    db.save()
+    assert len(journal_path.read_text().splitlines()) == 3
+
+    expected = {
+        'site3': {
+            'secret': 'ABCDEFGH',
+            'comment': 'updated',
+        },
+        'site2': {
+            'secret': 'ZYXWVUTSRQPONMLK',
+            'key': 'value',
+        },
+    }
+    assert dict(db) == expected
+
+    for cls in (JournalDatabase, Database):
+        db2 = cls(config_file)
+        db2.load()
+        assert dict(db2) == expected
+
+    db.compact()
+    assert not journal_path.exists()
+    db2 = Database(config_file)
+    db2.load()
+    assert dict(db2) == expected
+
+
+def test_journal_database_new_file(tmpdir):
+    path = tmpdir / 'requireris.db'
+    db = JournalDatabase(path)
+    db['site1'] = {'secret': 'ABCDEFGHIJKLMNOP'}
+    db.save()
+
+    assert path.read_text('utf-8') == '[site1]\nsecret = ABCDEFGHIJKLMNOP\n\n'
+    assert not db._journal.path.exists()
+
+
+def test_journal_database_compaction(config_file, mocker):
+    mocker.patch.object(JournalDatabase, 'journal_threshold', 3)
+    db = JournalDatabase(config_file)
+    db.load()
+
+    db['site4'] = {'secret': 'ABCDEFGH'}
+    db.save()
+    db['site5'] = {'secret': 'ABCDEFGH'}
+    db.save()
+    assert len(db._journal.path.read_text().splitlines()) == 2
+    assert 'site4' not in config_file.read_text('utf-8')
+
+    db['site6'] = {'secret': 'ABCDEFGH'}
+    db.save()
+    assert not db._journal.path.exists()
+    assert '[site6]' in config_file.read_text('utf-8')
+
+    db2 = JournalDatabase(config_file)
+    db2.load()
+    assert db2.keys() == {'site1', 'site3', 'site4', 'site5', 'site6'}
+
+
+@pytest.fixture
+def sqlite_database(tmpdir):
+    db = SqliteDatabase(tmpdir / 'requireris.sqlite')
+    db.load(missing_ok=True)
+    db['site1'] = {'secret': 'ABCDEFGHIJKLMNOP'}
+    db['site2'] = {'secret': 'ZYXWVUTSRQPONMLK', 'key': 'value'}
+    return db
+
+
+def test_sqlite_database(sqlite_database):
+    db = SqliteDatabase(sqlite_database.path)
+    db.load()
+    assert len(db) == 2
+    assert db.keys() == ['site1', 'site2']
+    assert dict(db.items()) == {
+        'site1': {'secret': 'ABCDEFGHIJKLMNOP'},
+        'site2': {'secret': 'ZYXWVUTSRQPONMLK', 'key': 'value'},
+    }
+    assert 'site1' in db
+    assert 'site3' not in db
+
+    with pytest.raises(KeyError):
+        db['site3']
+    with pytest.raises(KeyError):
+        del db['site3']
+    with pytest.raises(WrongSecret):
+        db['site3'] = {'secret': '123456'}
+
+    db['site1'] = {'secret': 'ABCDEFGH', 'comment': 'test'}
+    del db['site2']
+    db['site3'] = {'secret': 'EFEFEFEF'}
+
+    db2 = SqliteDatabase(sqlite_database.path)
+    db2.load()
+    assert list(db2) == ['site1', 'site3']
+    assert db2['site1'] == {'secret': 'ABCDEFGH', 'comment': 'test'}
+    assert db2.get_code('site3', at=123456.789) == generate_totp_many(['EFEFEFEF'], at=123456.789)[0]
+
+
+def test_sqlite_database_lazy(sqlite_database):
+    db = SqliteDatabase(sqlite_database.path)
+    db.load()
+    assert db._data == {}
+
+    assert db['site2'] == {'secret': 'ZYXWVUTSRQPONMLK', 'key': 'value'}
+    assert db._data.keys() == {'site2'}
+    assert db['site2'] is db['site2']
+
+
+def test_sqlite_database_hotp(sqlite_database):
+    sqlite_database['site3'] = {'secret': base64.b32encode(b'12345678901234567890').decode(), 'type': 'hotp'}
+    assert sqlite_database.get_code('site3') == '755224'
+    assert sqlite_database.get_code('site3') == '287082'
+
+    db2 = SqliteDatabase(sqlite_database.path)
+    db2.load()
+    assert db2['site3']['counter'] == '2'
+    assert db2.get_code('site3') == '359152'
+
+
+def test_sqlite_database_missing_file(tmpdir):
+    db = SqliteDatabase(tmpdir / 'requireris.sqlite')
+    with pytest.raises(FileNotFoundError):
+        db.load()
+    assert not db.path.exists()
+
+
+def test_detect_backend(sqlite_database, config_file, tmpdir):
+    assert detect_backend(sqlite_database.path) == 'sqlite'
+    assert detect_backend(config_file) == 'ini'
+    assert detect_backend(tmpdir / 'missing.db') == 'ini'
+    assert detect_backend(tmpdir / 'missing.db', default='journal') == 'journal'
+
+
+def test_load_lazy(config_file):
+    db = Database(config_file)
+    db.load(lazy=True)
+    assert list(db) == ['site1', 'site3']
+    assert db._data['site1'] == (0, 35)
+
+    assert db['site3'] == {
+        'secret': '1111111111111111',
+        'comment': 'test',
+    }
+    assert db['site3'] is db['site3']
+    assert type(db._data['site1']) is not dict
+
+    assert dict(db.items()) == {
+        'site1': {
+            'secret': '0000000000000000',
+        },
+        'site3': {
+            'secret': '1111111111111111',
+            'comment': 'test',
+        },
+    }
+    assert db._mmap is None
+
+
+def test_load_lazy_index(config_file, mocker):
+    db = Database(config_file)
+    db.load(lazy=True)
+    index_path = config_file + '.index'
+    assert index_path.exists()
+
+    build = mocker.spy(section_index, 'build_index')
+    db.load(lazy=True)
+    build.assert_not_called()
+
+    config_file.write_text(config_file.read_text('utf-8') + '\n[site4]\nsecret = ABCDEFGH\n', 'utf-8')
+    db.load(lazy=True)
+    build.assert_called_once()
+    assert db['site4'] == {'secret': 'ABCDEFGH'}
+
+
+def test_load_lazy_sections(tmpdir):
+    path = tmpdir / 'requireris.db'
+    path.write_text(
+        textwrap.dedent('''
+        [DEFAULT]
+        digits = 8
+
+        [site1]
+        secret = ABCDEFGH
+
+        [nosecret]
+        comment = test
+        ''').lstrip(),
+        'utf-8',
+    )
+    db = Database(path)
+    db.load(lazy=True)
+    # Sections without secret are not listed, as when loaded eagerly
+    assert list(db) == ['site1']
+    assert 'nosecret' not in db
+    assert db['site1'] == {'secret': 'ABCDEFGH', 'digits': '8'}
+    with pytest.raises(KeyError):
+        db['nosecret']
+    assert list(db.match(['*'])) == ['site1']
+
+    # Also when read from the index file
+    db.load(lazy=True)
+    assert list(db) == ['site1']
+
+    db2 = Database(path)
+    db2.load()
+    assert dict(db2) == dict(db)
+
+
+def test_load_lazy_missing_file(tmpdir):
+    db = Database(tmpdir / 'requireris.db')
+    with pytest.raises(FileNotFoundError):
+        db.load(lazy=True)
+    db.load(missing_ok=True, lazy=True)
+    assert dict(db) == {}
+
+    (tmpdir / 'requireris.db').write_text('', 'utf-8')
+    db.load(lazy=True)
+    assert dict(db) == {}
+
+
+def test_load_lazy_save(config_file):
+    db = Database(config_file)
+    db.load(lazy=True)
+    db['site2'] = {'secret': 'ABCDEFGH'}
+    db.save()
+
+    db2 = Database(config_file)
+    db2.load()
+    assert db2.keys() == {'site1', 'site2', 'site3'}
+    assert db2['site3'] == {'secret': '1111111111111111', 'comment': 'test'}
+
+
+def test_save_atomic(database, mocker):
+    database.save()
+    content = database.path.read_text('utf-8')
+
+    database['site3'] = {'secret': 'ABCDEFGH'}
+    mocker.patch.object(ConfigParser, 'write', side_effect=OSError)
+    with pytest.raises(OSError):
+        database.save()
+
+    assert database.path.read_text('utf-8') == content
+    # Only the lock file of writes is left besides the database file
+    assert sorted(os.listdir(database.path.dirname)) == ['requireris.db', 'requireris.db.lock']
+
+
+def test_save_fsync(database, mocker):
+    fsync = mocker.spy(os, 'fsync')
+    database.save()
+    fsync.assert_not_called()
+
+    database.fsync = True
+    database.save()
+    assert fsync.call_count == 2
+
+
+def test_batch(database, mocker):
+    write = mocker.spy(database, '_write')
+
+    with database.batch():
+        database['site3'] = {'secret': 'ABCDEFGH'}
+        database.save()
+        with database.batch():
+            del database['site1']
+            database.save()
+        assert not database.path.exists()
+        database.flush()
+        assert not database.path.exists()
+
+    write.assert_called_once()
+    db2 = Database(database.path)
+    db2.load()
+    assert db2.keys() == {'site2', 'site3'}
+
+    with database.batch():
+        pass
+    write.assert_called_once()
+
+
+def test_save_delay(database, mocker):
+    write = mocker.spy(database, '_write')
+    database.save_delay = 60
+
+    database.save()
+    database['site3'] = {'secret': 'ABCDEFGH'}
+    database.save()
+    assert not database.path.exists()
+    write.assert_not_called()
+
+    database.flush()
+    write.assert_called_once()
+    assert '[site3]' in database.path.read_text('utf-8')
+
+    database.flush()
+    write.assert_called_once()
+
+
+def test_save_delay_timer(database):
+    database.save_delay = 0.01
+    database.save()
+    timer = database._save_timer
+    timer.join()
+    assert database.path.exists()
+    assert database._save_timer is None
+
+
+@pytest.mark.parametrize('backend,lazy', [
+    (Database, False),
+    (Database, True),
+    (JournalDatabase, False),
+])
+def test_reload_if_changed(database, backend, lazy):
+    database.save()
+    db = backend(database.path)
+    db.load(lazy=lazy)
+    assert not db.reload_if_changed()
+
+    # Own writes are not considered as changes
+    db['site3'] = {'secret': 'ABCDEFGH'}
+    db.save()
+    assert not db.reload_if_changed()
+    assert db.get_code('site3')
+
+    other = backend(database.path)
+    other.load()
+    del other['site1']
+    other.save()
+
+    assert db.reload_if_changed()
+    assert db.keys() == {'site2', 'site3'}
+    assert not db.reload_if_changed()
+
+
+def test_reload_if_changed_hotp(database):
+    database['site3'] = {'secret': 'ABCDEFGH', 'type': 'hotp'}
+    database.save()
+    db = JournalDatabase(database.path)
+    db.load()
+    db.get_code('site3')
+    assert not db.reload_if_changed()
+    assert db['site3']['counter'] == '1'
+
+
+def test_reload_if_changed_not_loaded(database):
+    assert not database.reload_if_changed()
+
+
+def test_sqlite_reload_if_changed(sqlite_database):
+    assert not sqlite_database.reload_if_changed()
+    assert sqlite_database['site1']
+
+    other = SqliteDatabase(sqlite_database.path)
+    other.load()
+    other['site1'] = {'secret': 'ABCDEFGH'}
+
+    assert sqlite_database.reload_if_changed()
+    assert sqlite_database['site1'] == {'secret': 'ABCDEFGH'}
+    assert not sqlite_database.reload_if_changed()
+
+
+def test_reload_if_changed_journal(database, mocker):
+    database.save()
+    db = JournalDatabase(database.path)
+    db.load(lazy=True)
+    assert db.get_code('site2')
+    load = mocker.spy(db, 'load')
+
+    other = JournalDatabase(database.path)
+    other.load()
+    other['site2'] = {'secret': 'ABCDEFGH'}
+    other['site3'] = {'secret': 'ABABABAB'}
+    other.save()
+
+    # Only appended records are applied, without loading the database again
+    assert db.reload_if_changed()
+    assert db['site2'] == {'secret': 'ABCDEFGH'}
+    assert db['site3'] == {'secret': 'ABABABAB'}
+    assert db.get_code('site2') == other.get_code('site2')
+    load.assert_not_called()
+
+    other.compact()
+    assert db.reload_if_changed()
+    load.assert_called_once()
+    assert db.keys() == {'site1', 'site2', 'site3'}
+
+
+def test_journal_concurrent_appends(database):
+    database.save()
+    db = JournalDatabase(database.path)
+    db.load()
+    other = JournalDatabase(database.path)
+    other.load()
+
+    other['site3'] = {'secret': 'ABABABAB'}
+    other.save()
+    db['site1'] = {'secret': 'ABCDEFGH'}
+    db.save()
+    # Records appended by the other process are applied before appending
+    assert db['site3'] == {'secret': 'ABABABAB'}
+    assert not db.changed()
+
+    other['site4'] = {'secret': 'CDCDCDCD'}
+    other.save()
+    assert db.reload_if_changed()
+    assert db.keys() == {'site1', 'site2', 'site3', 'site4'}
+    assert not other.changed()
+    assert other['site1'] == {'secret': 'ABCDEFGH'}
+
+
+def test_reopen(database):
+    database.save()
+    database.load(lazy=True)
+    database.save_delay = 5
+    db = database.reopen()
+    assert db is not database
+    assert type(db) is Database
+    assert db.save_delay == 5
+    assert db.keys() == database.keys()
+    assert db._mmap is not None
+
+
+def test_find(database):
+    database['site3'] = {'secret': 'ABCDEFGH', 'key': 'value', 'team': 'ops'}
+    assert database.find({'key': 'value'}) == ['site2', 'site3']
+    assert database.find({'key': 'value', 'team': 'ops'}) == ['site3']
+    assert database.find({'key': 'other'}) == []
+    assert database.find({'secret': 'ABCDEFGH'}) == []
+    assert database.find({}) == ['site1', 'site2', 'site3']
+
+    # The index is kept up to date once built
+    database['site1'] = {'secret': 'ABCDEFGHIJKLMNOP', 'team': 'ops'}
+    database['site3'] = {'secret': 'ABCDEFGH', 'key': 'other'}
+    del database['site2']
+    assert database.find({'key': 'value'}) == []
+    assert database.find({'key': 'other'}) == ['site3']
+    assert database.find({'team': 'ops'}) == ['site1']
+
+    database['site1'] |= {'team': 'dev'}
+    assert database.find({'team': 'ops'}) == []
+    assert database.find({'team': 'dev'}) == ['site1']
+
+
+def test_find_load(database):
+    database['site3'] = {'secret': 'ABCDEFGH', 'type': 'hotp', 'key': 'value'}
+    database.save()
+    db = JournalDatabase(database.path)
+    db.load(lazy=True)
+    assert db.find({'key': 'value'}) == ['site2', 'site3']
+    db.get_code('site3')
+    assert db.find({'type': 'hotp'}) == ['site3']
+
+    other = JournalDatabase(database.path)
+    other.load()
+    del other['site2']
+    other.save()
+    assert db.reload_if_changed()
+    assert db.find({'key': 'value'}) == ['site3']
+
+    db.load()
+    assert db.find({'key': 'value'}) == ['site3']
+
+
+def test_sqlite_find(sqlite_database):
+    sqlite_database['site3'] = {'secret': 'ABCDEFGH', 'key': 'value', 'type': 'hotp'}
+    assert sqlite_database.find({'key': 'value'}) == ['site2', 'site3']
+    assert sqlite_database.find({'key': 'value', 'type': 'hotp'}) == ['site3']
+    assert sqlite_database.find({'secret': 'ABCDEFGH'}) == []
+    assert sqlite_database.find({}) == ['site1', 'site2', 'site3']
+
+    sqlite_database.get_code('site3')
+    sqlite_database['site2'] = {'secret': 'ZYXWVUTSRQPONMLK', 'key': 'other'}
+    del sqlite_database['site3']
+    assert sqlite_database.find({'key': 'value'}) == []
+    assert sqlite_database.find({'key': 'other'}) == ['site2']
+
+
+def test_sqlite_find_existing_database(tmpdir):
+    import sqlite3
+
+    path = tmpdir / 'requireris.sqlite'
+    with sqlite3.connect(path) as connection:
+        connection.execute('CREATE TABLE entries (id INTEGER PRIMARY KEY, key TEXT NOT NULL UNIQUE, item TEXT NOT NULL)')
+        connection.execute('INSERT INTO entries (key, item) VALUES (\'site1\', \'{"secret": "ABCDEFGH", "team": "ops"}\')')
+    connection.close()
+
+    db = SqliteDatabase(path)
+    db.load()
+    assert db.find({'team': 'ops'}) == ['site1']
+    db.load()
+    assert db.find({'team': 'ops'}) == ['site1']
+
+
+def test_sqlite_load_unchanged(sqlite_database):
+    other = SqliteDatabase(sqlite_database.path)
+    other.load()
+    # Loading an up to date database writes nothing that other connections would notice
+    sqlite_database.load()
+    SqliteDatabase(sqlite_database.path).load()
+    assert not other.changed()
+    assert not other.reload_if_changed()
+
+
+def test_match(database):
+    for key in ['prod-eu', 'prod-us', 'dev-eu', 'prod']:
+        database[key] = {'secret': 'ABCDEFGH'}
+    assert list(database.match(['prod-*'])) == ['prod-eu', 'prod-us']
+    assert list(database.match(['site?', 'prod*'])) == ['prod', 'prod-eu', 'prod-us', 'site1', 'site2']
+    assert list(database.match(['*-eu'])) == ['dev-eu', 'prod-eu']
+    assert list(database.match(['*'], after='prod-eu')) == ['prod-us', 'site1', 'site2']
+    assert list(database.match(['dev*', 'site*'], after='prod')) == ['site1', 'site2']
+    assert list(database.match(['site1'])) == ['site1']
+    assert list(database.match([])) == []
+
+    # The sorted index is kept up to date once built
+    database['prod-fr'] = {'secret': 'ABCDEFGH'}
+    database['prod-eu'] = {'secret': 'ABCDEFGH', 'key': 'value'}
+    del database['prod-us']
+    assert list(database.match(['prod-*'])) == ['prod-eu', 'prod-fr']
+
+
+def test_match_lazy(tmpdir):
+    path = tmpdir / 'requireris.db'
+    path.write_text('[site2]\nsecret = ABABABAB\n[site1]\ncomment = no secret\n[site3]\nsecret = ABABABAB\n', 'utf-8')
+    db = Database(path)
+    db.load(lazy=True)
+    assert list(db.match(['site*'])) == ['site2', 'site3']
+    with pytest.raises(KeyError):
+        db['site1']
+    assert list(db.match(['site*'])) == ['site2', 'site3']
+
+
+def test_sqlite_match(sqlite_database):
+    sqlite_database['prod-eu'] = {'secret': 'ABCDEFGH'}
+    sqlite_database['dev-eu'] = {'secret': 'ABCDEFGH'}
+    assert list(sqlite_database.match(['prod-*', 'site*'])) == ['prod-eu', 'site1', 'site2']
+    assert list(sqlite_database.match(['*-eu'], after='dev-eu')) == ['prod-eu']
+
+
+def test_verify(database):
+    at = 123456.789
+    code = database.get_code('site1', at)
+    assert database.verify('site1', code, at)
+    # A code is only accepted once
+    assert not database.verify('site1', code, at)
+    assert not database.verify('site1', '000000', at)
+    assert not database.verify('site1', code + '0', at)
+
+    next_code = database.get_code('site1', at + 30)
+    assert database.verify('site1', next_code, at)
+    previous_code = database.get_code('site1', at - 30)
+    assert not database.verify('site1', previous_code, at, window=0)
+    assert database.verify('site1', previous_code, at)
+    assert not database.verify('site1', database.get_code('site1', at + 60), at)
+    assert database.verify('site1', database.get_code('site1', at + 60), at, window=2)
+
+    with pytest.raises(KeyError):
+        database.verify('site3', code)
+
+
+def test_verify_replay_cache(database, mocker):
+    mocker.patch.object(Database, 'replay_cache_size', 2)
+    at = 123456.789
+    codes = [database.get_code('site1', at), database.get_code('site2', at), database.get_code('site1', at + 30)]
+    assert database.verify('site1', codes[2], at)
+    assert database.verify('site1', codes[0], at)
+    # Used steps still in the window are never forgotten, codes are rejected instead
+    assert not database.verify('site2', codes[1], at)
+    assert database._used_steps == {('site1', 4116): 123540, ('site1', 4115): 123510}
+
+    # Used steps are forgotten once out of the window
+    assert database.verify('site2', database.get_code('site2', at + 60), at + 60)
+    assert database._used_steps == {('site1', 4116): 123540, ('site2', 4117): 123570}
+    assert database.verify('site2', database.get_code('site2', at + 90), at + 90)
+    assert database._used_steps == {('site2', 4117): 123570, ('site2', 4118): 123600}
+
+
+def test_verify_updated_entry(database):
+    at = 123456.789
+    code = database.get_code('site1', at)
+    assert not database.verify('site1', '000000', at)
+    database['site1'] = {'secret': 'ABCDEFGH'}
+    assert not database.verify('site1', code, at)
+    assert database.verify('site1', database.get_code('site1', at), at)
+
+
+def test_verify_hotp(database):
+    database['site3'] = {'secret': 'ABCDEFGH', 'type': 'hotp', 'counter': '5'}
+    # Codes given by a separate token, not sharing the database files
+    other = Database(site3=dict(database['site3']))
+    codes = [other.get_code('site3') for _ in range(4)]
+
+    assert not database.verify('site3', codes[2])
+    assert database['site3']['counter'] == '5'
+    assert database.verify('site3', codes[1])
+    assert database['site3']['counter'] == '7'
+    assert not database.verify('site3', codes[1])
+    assert database.verify('site3', codes[3], window=2)
+    assert database['site3']['counter'] == '9'
+
+
+@pytest.mark.parametrize('backend', [Database, JournalDatabase, SqliteDatabase])
+def test_hotp_shared_file(tmpdir, backend):
+    path = Path(tmpdir) / 'requireris.db'
+    db = backend(path)
+    db.load(missing_ok=True)
+    db['site3'] = {'secret': 'ABCDEFGH', 'type': 'hotp', 'counter': '5'}
+    db.save()
+    other = backend(path)
+    other.load()
+    token = Database(site3=dict(db['site3']))
+    codes = [token.get_code('site3') for _ in range(4)]
+
+    # Both instances hand out codes from the latest counter
+    assert db.get_code('site3') == codes[0]
+    assert other.get_code('site3') == codes[1]
+    assert db.get_code('site3') == codes[2]
+    assert other['site3']['counter'] == '7'
+
+    # A code verified by one instance is rejected by the other, which never moves the counter back
+    assert other.verify('site3', codes[3])
+    assert not db.verify('site3', codes[3])
+    db.get_code('site3')
+    assert db['site3']['counter'] == '10'
+    reloaded = backend(path)
+    reloaded.load()
+    assert reloaded['site3']['counter'] == '10'
+
+
+@pytest.fixture
+def cipher(tmpdir):
+    return SecretCipher.create(tmpdir / 'requireris.db.crypt', 'passphrase', n=2 ** 10)
+
+
+@pytest.mark.parametrize('backend', [Database, JournalDatabase, SqliteDatabase])
+def test_encrypted_database(tmpdir, cipher, backend):
+    path = Path(tmpdir) / 'requireris.db'
+    db = backend(path)
+    db.cipher = cipher
+    db.load(missing_ok=True)
+    db['site1'] = {'secret': 'ABCDEFGHIJKLMNOP', 'comment': 'test'}
+    db.save()
+    for file in tmpdir.listdir('requireris.db*'):
+        assert b'ABCDEFGHIJKLMNOP' not in file.read_binary()
+    assert db['site1']['secret'].startswith(SEALED_PREFIX)
+    assert db.find({'comment': 'test'}) == ['site1']
+
+    db2 = backend(path)
+    db2.cipher = SecretCipher(cipher.path, lambda: 'passphrase')
+    db2.load()
+    assert db2['site1']['comment'] == 'test'
+    assert db2.get_code('site1', at=123456.789) == generate_totp_many(['ABCDEFGHIJKLMNOP'], at=123456.789)[0]
+    assert dict(db2.decrypted_items()) == {'site1': {'secret': 'ABCDEFGHIJKLMNOP', 'comment': 'test'}}
+
+
+def test_encrypted_database_lazy_unlock(database, cipher, mocker):
+    get_passphrase = mocker.Mock(return_value='passphrase')
+    database.cipher = cipher
+    database['site3'] = {'secret': 'EFEFEFEF'}
+    database.save()
+
+    db = Database(database.path)
+    db.cipher = SecretCipher(cipher.path, get_passphrase)
+    db.load()
+    assert sorted(db.match(['site*'])) == ['site1', 'site2', 'site3']
+    get_passphrase.assert_not_called()
+    # Entries that were not encrypted yet are still usable
+    db.get_code('site1')
+    get_passphrase.assert_not_called()
+    db.get_code('site3')
+    get_passphrase.assert_called_once_with()
+
+
+def test_encrypted_database_wrong_passphrase(database, cipher):
+    database.cipher = cipher
+    database['site3'] = {'secret': 'EFEFEFEF'}
+    database.save()
+
+    db = Database(database.path)
+    db.cipher = SecretCipher(cipher.path, lambda: 'wrong')
+    db.load()
+    with pytest.raises(WrongPassphrase):
+        db.get_code('site3')
+
+
+def test_encrypted_database_moved_secret(database, cipher):
+    database.cipher = cipher
+    database['site3'] = {'secret': 'EFEFEFEF'}
+    # A secret sealed for another key is rejected
+    with pytest.raises(WrongSecret):
+        database['site4'] = {'secret': database['site3']['secret']}
+
+
+@pytest.mark.parametrize('backend,lazy', [
+    (Database, False),
+    (Database, True),
+    (JournalDatabase, True),
+    (SqliteDatabase, False),
+])
+def test_threaded_access(tmpdir, backend, lazy):
+    path = Path(tmpdir) / 'requireris.db'
+    db = backend(path)
+    db.load(missing_ok=True)
+    with db.batch():
+        for i in range(200):
+            db[f'site{i}'] = {'secret': 'ABCDEFGH', 'group': str(i % 3)}
+        db.save()
+    db = backend(path)
+    db.load(lazy=lazy)
+
+    errors = []
+    barrier = threading.Barrier(4)
+
+    def run(action):
+        barrier.wait()
+        try:
+            for i in range(200):
+                action(i)
+        except Exception as e:
+            errors.append(e)
+
+    def writer(i):
+        db[f'new{i}'] = {'secret': 'EFEFEFEF', 'group': 'new'}
+        del db[f'site{i}']
+        db.save()
+
+    def reader(i):
+        dict(db.items())
+        list(db)
+        if f'new{i // 2}' in db:
+            db.get_code(f'new{i // 2}')
+
+    def searcher(i):
+        db.find({'group': 'new'})
+        list(db.match(['site1*', 'new*']))
+
+    def getter(i):
+        try:
+            db[f'site{199 - i}']
+        except KeyError:
+            pass
+
+    threads = [threading.Thread(target=run, args=(action,)) for action in (writer, reader, searcher, getter)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    expected = {f'new{i}' for i in range(200)}
+    assert set(db.keys()) == expected
+    assert set(db.find({'group': 'new'})) == expected
+
+    db2 = backend(path)
+    db2.load()
+    assert set(db2.keys()) == expected
@@ -0,0 +1,90 @@
+import pytest
+
+from requireris.journal import Journal
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return Journal(tmp_path / 'requireris.db.journal')
+
+
+def test_append_replay(journal):
+    assert list(journal.replay()) == []
+    assert len(journal) == 0
+
+    journal.append({'op': 'counter', 'key': 'site1', 'value': 1})
+    journal.append({'op': 'counter', 'key': 'site1', 'value': 2}, {'op': 'counter', 'key': 'site2', 'value': 1})
+    assert len(journal) == 3
+    assert journal.path.read_text() == (
+        '{"op":"counter","key":"site1","value":1}\n'
+        '{"op":"counter","key":"site1","value":2}\n'
+        '{"op":"counter","key":"site2","value":1}\n'
+    )
+
+    other = Journal(journal.path)
+    assert len(other) == 0
+    assert list(other.replay()) == [
+        {'op': 'counter', 'key': 'site1', 'value': 1},
+        {'op': 'counter', 'key': 'site1', 'value': 2},
+        {'op': 'counter', 'key': 'site2', 'value': 1},
+    ]
+    assert len(other) == 3
+
+
+def test_replay_corrupted(journal):
+    journal.path.write_text('{"op":"counter","key":"site1","value":1}\n{"op":"coun')
+    assert list(journal.replay()) == [{'op': 'counter', 'key': 'site1', 'value': 1}]
+    assert len(journal) == 1
+
+
+def test_truncate(journal):
+    journal.truncate()
+    assert not journal.path.exists()
+
+    journal.append({'op': 'counter', 'key': 'site1', 'value': 1})
+    journal.truncate()
+    assert not journal.path.exists()
+    assert len(journal) == 0
+    assert list(journal.replay()) == []
+
+
+def test_replay_offset(journal):
+    journal.append({'op': 'counter', 'key': 'site1', 'value': 1})
+    other = Journal(journal.path)
+    assert len(list(other.replay())) == 1
+    assert other.offset == journal.offset == journal.path.stat().st_size
+
+    journal.append({'op': 'counter', 'key': 'site1', 'value': 2})
+    with journal.path.open('a') as file:
+        file.write('{"op":"coun')
+    assert list(other.replay(other.offset)) == [{'op': 'counter', 'key': 'site1', 'value': 2}]
+    assert len(other) == 2
+    assert other.offset == journal.offset
+
+    # Partial records are replayed once complete
+    with journal.path.open('a') as file:
+        file.write('ter","key":"site1","value":3}\n')
+    assert list(other.replay(other.offset)) == [{'op': 'counter', 'key': 'site1', 'value': 3}]
+    assert len(other) == 3
+
+
+def test_append_pending(journal):
+    other = Journal(journal.path)
+    journal.append({'op': 'counter', 'key': 'site1', 'value': 1})
+    assert other.append({'op': 'counter', 'key': 'site2', 'value': 1}) == [{'op': 'counter', 'key': 'site1', 'value': 1}]
+    assert other.offset == journal.path.stat().st_size
+
+    # Records appended by others are not skipped by the offset
+    assert journal.append({'op': 'counter', 'key': 'site1', 'value': 2}) == [{'op': 'counter', 'key': 'site2', 'value': 1}]
+    assert list(other.replay(other.offset)) == [{'op': 'counter', 'key': 'site1', 'value': 2}]
+    assert other.offset == journal.offset == journal.path.stat().st_size
+
+
+def test_append_partial(journal):
+    journal.append({'op': 'counter', 'key': 'site1', 'value': 1})
+    offset = journal.offset
+    with journal.path.open('a') as file:
+        file.write('{"op":"coun')
+    assert journal.append({'op': 'counter', 'key': 'site1', 'value': 2}) == []
+    # The offset stays before the incomplete record
+    assert journal.offset == offset
@@ -0,0 +1,55 @@
+import pytest
+
+from requireris.__main__ import default_agent_socket, env_flag, verify_code
+from requireris.database import Database
+
+
+@pytest.mark.parametrize('value,expected', [
+    (None, False),
+    ('', False),
+    ('0', False),
+    ('false', False),
+    ('no', False),
+    ('1', True),
+    ('true', True),
+    (' Yes ', True),
+    ('ON', True),
+])
+def test_env_flag(monkeypatch, value, expected):
+    if value is None:
+        monkeypatch.delenv('REQUIRERIS_TEST_FLAG', raising=False)
+    else:
+        monkeypatch.setenv('REQUIRERIS_TEST_FLAG', value)
+    assert env_flag('REQUIRERIS_TEST_FLAG') is expected
+
+
+def test_parser_alias():
+    from requireris.__main__ import parser
+    args = parser.parse_args(['get', 'site1'])
+    assert args.keys == ['site1']
+
+    import requireris.__main__
+    with pytest.raises(AttributeError):
+        requireris.__main__.missing
+
+
+def test_verify_code_without_agent(tmp_path, caplog):
+    db = Database(tmp_path / 'requireris.db', site1={'secret': 'ABABABAB'}, site2={'secret': 'CDCDCDCD', 'type': 'hotp'})
+    verify_code(db, 'site1', db.get_code('site1'))
+    assert 'No agent running' in caplog.text
+
+    # HOTP counters are saved in the database
+    caplog.clear()
+    with pytest.raises(SystemExit):
+        verify_code(db, 'site2', 'wrong')
+    assert 'No agent running' not in caplog.text
+
+
+def test_default_agent_socket(monkeypatch):
+    monkeypatch.setenv('XDG_RUNTIME_DIR', '/run/user/1000')
+    monkeypatch.setattr('os.getuid', lambda: 1000)
+    assert str(default_agent_socket()) == '/run/user/1000/requireris-1000.sock'
+
+    # Platforms without user ids
+    monkeypatch.delattr('os.getuid')
+    assert str(default_agent_socket()) == '/run/user/1000/requireris.sock'
@@ -0,0 +1,27 @@
+import pytest
+
+from requireris.patterns import compile_patterns, literal_prefixes, prefix_end
+
+
+def test_compile_patterns():
+    regex = compile_patterns(['prod-*', 'dev-?', '[ab]c'])
+    keys = ['prod-1', 'prod-', 'dev-1', 'dev-12', 'ac', 'bc', 'cc', 'xprod-1', 'prod\n']
+    assert [key for key in keys if regex.match(key)] == ['prod-1', 'prod-', 'dev-1', 'ac', 'bc']
+
+
+@pytest.mark.parametrize('patterns,prefixes', [
+    (['prod-*'], ['prod-']),
+    (['prod-eu-*', 'prod-*', 'dev?'], ['dev', 'prod-']),
+    (['site1', 'site10'], ['site1']),
+    (['prod-*', '*-eu'], ['']),
+    (['[ab]*'], ['']),
+    ([], []),
+])
+def test_literal_prefixes(patterns, prefixes):
+    assert literal_prefixes(patterns) == prefixes
+
+
+def test_prefix_end():
+    assert prefix_end('prod-') == 'prod.'
+    assert prefix_end('ab\U0010ffff') == 'ac'
+    assert prefix_end('') is None
@@ -0,0 +1,65 @@
+import os
+
+from requireris.section_index import build_index, find_secretless, load_index, read_index, write_index
+
+
+CONTENT = b'''[DEFAULT]
+digits = 8
+
+[site1]
+secret = ABCDEFGH
+[site2] trailing
+secret = ABABABAB
+  [not a section]
+comment = [test]
+'''
+
+
+def test_build_index():
+    assert build_index(b'') == {}
+    assert build_index(b'secret = ABCDEFGH\n') == {}
+    assert build_index(CONTENT) == {
+        'DEFAULT': (0, 22),
+        'site1': (22, 48),
+        'site2': (48, len(CONTENT)),
+    }
+
+
+def test_find_secretless():
+    content = CONTENT + b'[site3]\ncomment = secret = no\n[site4]\nSecret: ABCDEFGH\n'
+    assert find_secretless(content, build_index(content)) == ['site3']
+    content = b'[site1]\ncomment = test\n[DEFAULT]\nsecret = ABCDEFGH\n'
+    assert find_secretless(content, build_index(content)) == []
+    assert find_secretless(CONTENT, build_index(CONTENT)) == []
+
+
+def test_read_write_index(tmp_path):
+    data_path = tmp_path / 'requireris.db'
+    data_path.write_bytes(CONTENT)
+    path = tmp_path / 'requireris.db.index'
+    stat = os.stat(data_path)
+
+    assert read_index(path, stat) is None
+
+    write_index(path, stat, build_index(CONTENT), ['site2'])
+    assert read_index(path, stat) == (build_index(CONTENT), ['site2'])
+
+    data_path.write_bytes(CONTENT + b'\n')
+    assert read_index(path, os.stat(data_path)) is None
+
+    path.write_text('{')
+    assert read_index(path, stat) is None
+
+
+def test_load_index(tmp_path, mocker):
+    data_path = tmp_path / 'requireris.db'
+    data_path.write_bytes(CONTENT)
+    path = tmp_path / 'requireris.db.index'
+    stat = os.stat(data_path)
+
+    assert load_index(path, stat, CONTENT) == (build_index(CONTENT), [])
+    assert path.exists()
+
+    build = mocker.patch('requireris.section_index.build_index')
+    assert load_index(path, stat, CONTENT) == (build_index(CONTENT), [])
+    build.assert_not_called()
@@ -0,0 +1,53 @@
+import subprocess
+import sys
+
+import pytest
+
+# Modules that are only needed by some commands and must not slow down others
+LAZY_MODULES = [
+    'cryptography',
+    'csv',
+    'fastapi',
+    'jinja2',
+    'requireris.bulk',
+    'requireris.crypto',
+    'requireris.httpd',
+    'socket',
+    'sqlite3',
+    'tempfile',
+]
+# Budget for the import of the CLI module (in microseconds), generous
+# enough for slow machines but catching heavy dependencies
+IMPORT_TIME_BUDGET = 300_000
+
+
+@pytest.fixture(scope='module')
+def import_times():
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import requireris.__main__'],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line.removeprefix('import time:').split('|')
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_lazy_imports(import_times):
+    assert 'requireris.__main__' in import_times
+    assert set(LAZY_MODULES).isdisjoint(import_times)
+
+
+def test_import_time(import_times):
+    assert import_times['requireris.__main__'] < IMPORT_TIME_BUDGET
+
+
+def test_import_without_posix_modules():
+    # Windows has neither fcntl nor user ids
+    code = "import os, sys; sys.modules['fcntl'] = None; del os.getuid; import requireris.__main__; requireris.__main__._get_parser()"
+    subprocess.run([sys.executable, '-c', code], check=True)
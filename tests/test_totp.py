@@ -1,6 +1,6 @@
 import pytest
 
-from requireris.totp import ull_to_bytes, bytes_to_ui, hmac_sha1, last_nibble, remove_first_bit, padding_6, get_time, generate_totp
+from requireris.totp import ull_to_bytes, bytes_to_ui, hmac_sha1, last_nibble, remove_first_bit, padding_6, get_time, generate_totp, truncate, generate_hotp_many, generate_totp_many, make_generator
 
 
 @pytest.mark.parametrize(
@@ -136,6 +136,40 @@ def test_get_time(mocker, current_time, expected):
     assert get_time() == expected
 
 
+@pytest.mark.parametrize(
+    'at,expected',
+    [
+        (0.0, 0),
+        (30.0, 1),
+        (123456.789, 4115),
+    ],
+)
+def test_get_time_at(mocker, at, expected):
+    mocker.patch('time.time', return_value=9876543.21)
+    assert get_time(at) == expected
+
+
+@pytest.mark.parametrize(
+    'data,expected',
+    [
+        (b'\x00' * 20, 0),
+        (b'\xFF' * 4 + b'\x00' * 15 + b'\x00', 0x7FFFFFFF),
+        (b'\x1F\x86\x98\x69\x0E\x02\xCA\x16\x61\x85\x50\xEF\x7F\x19\xDA\x8E\x94\x5B\x55\x5A', 0x50EF7F19),
+    ],
+)
+def test_truncate(data, expected):
+    assert truncate(data) == expected
+
+
+def test_generate_hotp_many():
+    # RFC 4226 appendix D test values
+    key = b'12345678901234567890'
+    expected = ['755224', '287082', '359152', '969429', '338314', '254676', '287922', '162583', '399871', '520489']
+    assert [generate_hotp_many([key], counter)[0] for counter in range(10)] == expected
+    assert generate_hotp_many([key, key], 0) == ['755224', '755224']
+    assert generate_hotp_many([], 0) == []
+
+
 @pytest.mark.parametrize(
     'secret,current_time,expected',
     [
@@ -151,3 +185,41 @@ def test_get_time(mocker, current_time, expected):
 def test_generate_totp(mocker, secret, current_time, expected):
     mocker.patch('time.time', return_value=current_time)
     assert generate_totp(secret) == expected
+
+
+def test_generate_totp_many(mocker):
+    mocker.patch('time.time', return_value=123456.789)
+    secrets = ['', 'AAAAAAAAAAAAAAAA', 'ABCDEFGHIJKLMNOP', b'abcdefghijklmnop']
+    assert generate_totp_many(secrets) == ['291914', '291914', '258941', '258941']
+    assert generate_totp_many(secrets[:2], at=0.0) == ['328482', '328482']
+    assert generate_totp_many(secrets[2:], at=9876543.21) == ['197309', '197309']
+    assert generate_totp_many(iter(secrets)) == [generate_totp(secret) for secret in secrets]
+
+
+@pytest.mark.parametrize(
+    'algorithm,digits,key,counter,expected',
+    [
+        ('sha1', 6, b'12345678901234567890', 1, '287082'),
+        ('sha1', 8, b'12345678901234567890', 1, '94287082'),
+        ('sha256', 8, b'12345678901234567890123456789012', 1, '46119246'),
+        ('sha512', 8, b'1234567890123456789012345678901234567890123456789012345678901234', 1, '90693936'),
+        ('sha1', 10, b'12345678901234567890', 1, '1094287082'),
+    ],
+)
+def test_make_generator(algorithm, digits, key, counter, expected):
+    generate = make_generator(key, algorithm, digits)
+    assert generate(counter) == expected
+    assert generate(counter) == expected
+
+
+@pytest.mark.parametrize(
+    'algorithm,digits',
+    [
+        ('md5', 6),
+        ('sha1', 5),
+        ('sha1', 11),
+    ],
+)
+def test_make_generator_errors(algorithm, digits):
+    with pytest.raises(ValueError):
+        make_generator(b'key', algorithm, digits)
@@ -1,9 +1,11 @@
+import os
 import socket
 import socketserver
+import sys
 
 import pytest
 
-from requireris.utils import get_socket_url
+from requireris.utils import atomic_write, get_socket_url, lock_file
 
 
 @pytest.mark.parametrize('server_cls', [socketserver.TCPServer, socketserver.UDPServer])
@@ -32,3 +34,44 @@ def test_get_socket_url_unix(tmp_path):
     server = socketserver.UnixStreamServer(addr, socketserver.BaseRequestHandler)
 
     assert get_socket_url(server.socket, scheme='file://') == f'file://{addr}'
+
+
+def test_atomic_write(tmp_path, mocker):
+    path = tmp_path / 'file.txt'
+    fsync = mocker.spy(os, 'fsync')
+
+    with atomic_write(path) as file:
+        file.write('content')
+        assert not path.exists()
+    assert path.read_text() == 'content'
+    fsync.assert_not_called()
+
+    path.chmod(0o640)
+    with atomic_write(path, fsync=True) as file:
+        file.write('new content')
+        assert path.read_text() == 'content'
+    assert path.read_text() == 'new content'
+    assert path.stat().st_mode & 0o777 == 0o640
+    assert fsync.call_count == 2
+
+    assert os.listdir(tmp_path) == ['file.txt']
+
+
+def test_atomic_write_error(tmp_path):
+    path = tmp_path / 'file.txt'
+    path.write_text('content')
+
+    with pytest.raises(RuntimeError):
+        with atomic_write(path) as file:
+            file.write('partial')
+            raise RuntimeError
+
+    assert path.read_text() == 'content'
+    assert os.listdir(tmp_path) == ['file.txt']
+
+
+def test_lock_file_without_fcntl(tmp_path, monkeypatch):
+    # Platforms without fcntl write without locking
+    monkeypatch.setitem(sys.modules, 'fcntl', None)
+    with (tmp_path / 'file.lock').open('w') as file:
+        lock_file(file)